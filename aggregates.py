@@ -0,0 +1,514 @@
+# aggregates.py - Score statistics per (scope, dimension, value, exam day) and score histograms, kept current by the grade loader
+from datetime import datetime, time, timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import Integer, String, bindparam, case, cast, delete, func, insert, literal, or_, select, union_all
+
+from models import db, Grade, GradeAggregate, GradeHistogram, Subject, Teacher, Topic, Weekday
+from database import dialect_insert, bump_data_version
+from validation import SCORE_MIN, SCORE_MAX
+
+# scope -> grade column holding its scope_id; 'all' rows use scope_id 0
+SCOPES = {'all': None, 'teacher': 'teacher_id'}
+# dimension -> grade column holding its value (an id); 'overall' rows use value 0
+DIMENSIONS = {
+    'overall': None,
+    'subject': 'subject_id',
+    'teacher_name': 'teacher_id',
+    'day_of_week': 'weekday_id',
+    'topic': 'topic_id',
+    'student': 'student_id'
+}
+# Nothing windows these by date, so they keep one all-time row per value instead of one per exam day
+ALL_TIME_DIMENSIONS = {'student'}
+# dimension -> column holding the display name of its ids, for labelled_stats
+LABELS = {'subject': Subject.name, 'teacher_name': Teacher.full_name, 'day_of_week': Weekday.name, 'topic': Topic.name}
+# Grade columns a contribution frame is built from
+GRADE_COLUMNS = ['teacher_id', 'student_id', 'subject_id', 'weekday_id', 'topic_id', 'exam_date', 'score']
+KEY = ['scope', 'scope_id', 'dimension', 'value', 'period']
+STATS = ['score_sum', 'score_count', 'score_sum_sq', 'score_min', 'score_max']
+REBUILD_CHUNK_SIZE = 200000
+# Periods the trend series can be bucketed by; weeks start on Monday, terms are the four-month
+# spans starting in January, May and September
+TREND_BUCKETS = ('day', 'week', 'month', 'term')
+TERM_MONTHS = 4
+# Percentiles reported per trend bucket, by the nearest-rank method
+TREND_PERCENTILES = (25, 50, 75)
+# Dimensions with all-time score histograms, in HISTOGRAM_BINS equal bins over the score range. Merging
+# groups adds their counts and taking a grade out subtracts it, so percentiles read from them stay within
+# one bin width of the exact ones at a fixed size per group. Students get none: they would take about a
+# row per grade, and a student's few grades are binned straight from the grades table instead.
+HISTOGRAM_DIMENSIONS = ('overall', 'subject', 'teacher_name', 'day_of_week', 'topic')
+HISTOGRAM_BINS = 100
+HISTOGRAM_KEY = ['scope', 'scope_id', 'dimension', 'value', 'bin']
+
+
+def _dimension_values(frame, column):
+    """(value per grade row, whether the row has one) for a DIMENSIONS column; None is 'overall', value 0"""
+    if not column:
+        return np.zeros(len(frame), dtype=np.int64), np.ones(len(frame), dtype=bool)
+    # weekday_id is the only nullable one; grades without a day are left out of that dimension
+    return frame[column].fillna(0).to_numpy(dtype=np.int64), frame[column].notna().to_numpy()
+
+
+def score_bins(scores):
+    """Histogram bin of each score in a NumPy array; a top score goes in the last bin"""
+    bins = np.floor((scores - SCORE_MIN) * HISTOGRAM_BINS / (SCORE_MAX - SCORE_MIN)).astype(np.int64)
+    return np.clip(bins, 0, HISTOGRAM_BINS - 1)
+
+
+def score_bin_column(score):
+    """SQL expression for score_bins"""
+    bin_number = cast((score - SCORE_MIN) * HISTOGRAM_BINS / (SCORE_MAX - SCORE_MIN), Integer)
+    return case((bin_number >= HISTOGRAM_BINS, HISTOGRAM_BINS - 1), else_=bin_number)
+
+
+def histogram_table(aggregates):
+    """The histogram table kept alongside an aggregates table, live or staged"""
+    name = aggregates.name.replace(GradeAggregate.__tablename__, GradeHistogram.__tablename__, 1)
+    return aggregates.metadata.tables[name]
+
+
+def grade_contributions(frame):
+    """Group grade rows (GRADE_COLUMNS) into one stats row per aggregate key they fall under"""
+    if len(frame) == 0:
+        return pd.DataFrame(columns=KEY + STATS)
+    codes, days = pd.factorize(pd.to_datetime(frame['exam_date']).dt.normalize())
+    periods = np.asarray(days.strftime('%Y-%m-%d'), dtype=object)[codes]
+    scores = frame['score'].to_numpy(dtype=float)
+
+    parts = []
+    for scope, scope_column in SCOPES.items():
+        scope_ids = frame[scope_column].to_numpy() if scope_column else np.zeros(len(frame), dtype=np.int64)
+        for dimension, column in DIMENSIONS.items():
+            values, present = _dimension_values(frame, column)
+            rows = pd.DataFrame({
+                'scope_id': scope_ids,
+                'value': values,
+                'period': '' if dimension in ALL_TIME_DIMENSIONS else periods,
+                'score': scores,
+                'square': scores * scores
+            })[present]
+            grouped = rows.groupby(['scope_id', 'value', 'period'], sort=False).agg(
+                score_sum=('score', 'sum'),
+                score_count=('score', 'size'),
+                score_sum_sq=('square', 'sum'),
+                score_min=('score', 'min'),
+                score_max=('score', 'max')
+            ).reset_index()
+            grouped.insert(0, 'scope', scope)
+            grouped.insert(2, 'dimension', dimension)
+            parts.append(grouped)
+    return pd.concat(parts, ignore_index=True)[KEY + STATS]
+
+
+def histogram_contributions(frame, sign=1):
+    """Count grade rows (GRADE_COLUMNS) per histogram key they fall under, times sign (-1 for removed rows)"""
+    if len(frame) == 0:
+        return pd.DataFrame(columns=HISTOGRAM_KEY + ['grade_count'])
+    bins = score_bins(frame['score'].to_numpy(dtype=float))
+
+    parts = []
+    for scope, scope_column in SCOPES.items():
+        scope_ids = frame[scope_column].to_numpy() if scope_column else np.zeros(len(frame), dtype=np.int64)
+        for dimension in HISTOGRAM_DIMENSIONS:
+            values, present = _dimension_values(frame, DIMENSIONS[dimension])
+            rows = pd.DataFrame({'scope_id': scope_ids, 'value': values, 'bin': bins})[present]
+            grouped = rows.groupby(['scope_id', 'value', 'bin'], sort=False).size().reset_index(name='grade_count')
+            grouped.insert(0, 'scope', scope)
+            grouped.insert(2, 'dimension', dimension)
+            parts.append(grouped)
+    contributions = pd.concat(parts, ignore_index=True)[HISTOGRAM_KEY + ['grade_count']]
+    contributions['grade_count'] *= sign
+    return contributions
+
+
+def merge_histogram_contributions(parts):
+    """Net count per histogram key over contribution frames, keys that cancel out dropped"""
+    merged = pd.concat(parts, ignore_index=True).groupby(HISTOGRAM_KEY, sort=False)['grade_count'].sum()
+    return merged[merged != 0].reset_index()
+
+
+def merge_contributions(parts):
+    """Combine contribution frames that may share keys, as adding them one after another would"""
+    return pd.concat(parts, ignore_index=True).groupby(KEY, sort=False).agg(
+        score_sum=('score_sum', 'sum'),
+        score_count=('score_count', 'sum'),
+        score_sum_sq=('score_sum_sq', 'sum'),
+        score_min=('score_min', 'min'),
+        score_max=('score_max', 'max')
+    ).reset_index()
+
+
+def _records(frame, rename=None):
+    # Much faster than to_dict('records'), and tolist() yields plain Python values for the driver
+    names = [(rename or {}).get(name, name) for name in frame.columns]
+    return [dict(zip(names, row)) for row in zip(*(frame[name].tolist() for name in frame.columns))]
+
+
+def _add_contributions(contributions, aggregates):
+    stmt = dialect_insert(aggregates)
+    c, excluded = aggregates.c, stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[c[name] for name in KEY],
+        set_={
+            'score_sum': c.score_sum + excluded.score_sum,
+            'score_count': c.score_count + excluded.score_count,
+            'score_sum_sq': c.score_sum_sq + excluded.score_sum_sq,
+            'score_min': case((excluded.score_min < c.score_min, excluded.score_min), else_=c.score_min),
+            'score_max': case((excluded.score_max > c.score_max, excluded.score_max), else_=c.score_max)
+        }
+    )
+    db.session.execute(stmt, _records(contributions))
+
+
+def _key_matches(aggregates):
+    return [aggregates.c[name] == bindparam('k_' + name) for name in KEY]
+
+
+def _retract_contributions(contributions, aggregates):
+    c = aggregates.c
+    stmt = aggregates.update().where(*_key_matches(aggregates)).values(
+        score_sum=c.score_sum - bindparam('d_sum'),
+        score_count=c.score_count - bindparam('d_count'),
+        score_sum_sq=c.score_sum_sq - bindparam('d_sum_sq')
+    )
+    rename = {**{name: 'k_' + name for name in KEY},
+              'score_sum': 'd_sum', 'score_count': 'd_count', 'score_sum_sq': 'd_sum_sq'}
+    db.session.execute(stmt, _records(contributions[KEY + STATS[:3]], rename))
+
+
+def _repair_extremes(contributions, aggregates, grades):
+    """Recompute min/max from grades for groups whose current min or max was one of the removed scores"""
+    for (scope, dimension), group in contributions.groupby(['scope', 'dimension'], sort=False):
+        conditions = []
+        if SCOPES[scope]:
+            conditions.append(grades.c[SCOPES[scope]] == bindparam('k_scope_id'))
+        if DIMENSIONS[dimension]:
+            conditions.append(grades.c[DIMENSIONS[dimension]] == bindparam('g_value'))
+        if dimension not in ALL_TIME_DIMENSIONS:
+            conditions += [grades.c.exam_date >= bindparam('g_day_start'), grades.c.exam_date < bindparam('g_day_end')]
+        stmt = aggregates.update().where(
+            *_key_matches(aggregates),
+            or_(aggregates.c.score_min >= bindparam('r_min'), aggregates.c.score_max <= bindparam('r_max'))
+        ).values(
+            score_min=select(func.min(grades.c.score)).where(*conditions).scalar_subquery(),
+            score_max=select(func.max(grades.c.score)).where(*conditions).scalar_subquery()
+        )
+        params = _records(group[KEY + ['score_min', 'score_max']],
+                          {**{name: 'k_' + name for name in KEY}, 'score_min': 'r_min', 'score_max': 'r_max'})
+        for row in params:
+            row['g_value'] = row['k_value']
+            if dimension not in ALL_TIME_DIMENSIONS:
+                row['g_day_start'] = datetime.strptime(row['k_period'], '%Y-%m-%d')
+                row['g_day_end'] = row['g_day_start'] + timedelta(days=1)
+        db.session.execute(stmt, params)
+
+
+def _apply_histogram_changes(added, removed, histograms):
+    """Add the net count change of inserted and removed grade rows to their histogram bins"""
+    parts = [part for part in (histogram_contributions(added), histogram_contributions(removed, -1)) if len(part)]
+    if not parts:
+        return
+    changes = merge_histogram_contributions(parts)
+    if len(changes):
+        stmt = dialect_insert(histograms)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=[histograms.c[name] for name in HISTOGRAM_KEY],
+            set_={'grade_count': histograms.c.grade_count + stmt.excluded.grade_count}
+        ), _records(changes))
+    if len(removed):
+        db.session.execute(delete(histograms).where(histograms.c.grade_count <= 0))
+
+
+def apply_grade_changes(added, removed, grades=None, aggregates=None):
+    """Fold inserted and removed grade rows (frames of GRADE_COLUMNS) into the aggregates and histograms.
+
+    An updated grade is its old version removed plus its new version added.
+    Sums, counts and bin counts are adjusted in place; a min or max is
+    recomputed from ``grades``, which must already reflect the change, only
+    when a removed score was the group's extreme. Groups left empty are
+    deleted. The caller owns the transaction.
+    """
+    grades = Grade.__table__ if grades is None else grades
+    aggregates = GradeAggregate.__table__ if aggregates is None else aggregates
+    removed_contributions = grade_contributions(removed)
+    if len(removed_contributions):
+        _retract_contributions(removed_contributions, aggregates)
+    if len(added):
+        _add_contributions(grade_contributions(added), aggregates)
+    if len(removed_contributions):
+        _repair_extremes(removed_contributions, aggregates, grades)
+        db.session.execute(delete(aggregates).where(aggregates.c.score_count <= 0))
+    _apply_histogram_changes(added, removed, histogram_table(aggregates))
+
+
+def _grade_frame(statement):
+    return pd.DataFrame(db.session.execute(statement).all(), columns=GRADE_COLUMNS)
+
+
+def rebuild_aggregates(grades=None, aggregates=None, chunk_size=REBUILD_CHUNK_SIZE):
+    """Recompute every aggregate and histogram row from the grades table, reading it in id order one chunk at a time"""
+    grades = Grade.__table__ if grades is None else grades
+    aggregates = GradeAggregate.__table__ if aggregates is None else aggregates
+    histograms = histogram_table(aggregates)
+    db.session.execute(delete(aggregates))
+    db.session.execute(delete(histograms))
+    parts = []
+    histogram_parts = []
+    last_id = 0
+    while True:
+        rows = db.session.execute(
+            select(grades.c.id, *(grades.c[name] for name in GRADE_COLUMNS))
+            .where(grades.c.id > last_id).order_by(grades.c.id).limit(chunk_size)
+        ).all()
+        if not rows:
+            break
+        frame = pd.DataFrame([row[1:] for row in rows], columns=GRADE_COLUMNS)
+        parts.append(grade_contributions(frame))
+        histogram_parts.append(histogram_contributions(frame))
+        last_id = rows[-1][0]
+    if parts:
+        db.session.execute(insert(aggregates), _records(merge_contributions(parts)))
+        db.session.execute(insert(histograms), _records(merge_histogram_contributions(histogram_parts)))
+
+
+def backfill_aggregates():
+    """Build the aggregates and histograms for a database that has grades from before they existed"""
+    has_aggregates = db.session.execute(select(GradeAggregate.id).limit(1)).first()
+    has_histograms = db.session.execute(select(GradeHistogram.id).limit(1)).first()
+    has_grades = db.session.execute(select(Grade.id).limit(1)).first()
+    if has_grades and not (has_aggregates and has_histograms):
+        print("📊 Building grade aggregates...")
+        rebuild_aggregates()
+        db.session.commit()
+
+
+def delete_grades(where, grades=None, aggregates=None):
+    """DELETE the grades matching a condition and take them out of the aggregates; returns the row count.
+
+    Deleting most of the table rebuilds the aggregates instead, which is
+    cheaper than retracting nearly every group.
+    """
+    grades = Grade.__table__ if grades is None else grades
+    aggregates = GradeAggregate.__table__ if aggregates is None else aggregates
+    removed = _grade_frame(select(*(grades.c[name] for name in GRADE_COLUMNS)).where(where))
+    if len(removed) == 0:
+        return 0
+    total = db.session.execute(select(func.count()).select_from(grades)).scalar()
+    deleted = db.session.execute(delete(grades).where(where)).rowcount
+    if len(removed) * 2 > total:
+        rebuild_aggregates(grades, aggregates)
+    else:
+        apply_grade_changes(removed.iloc[:0], removed, grades, aggregates)
+    if grades is Grade.__table__:
+        bump_data_version()
+    return deleted
+
+
+def first_period(since):
+    """First exam day whose grades (stored at midnight) fall on or after the datetime since"""
+    day = since.date()
+    if since.time() != time.min:
+        day += timedelta(days=1)
+    return day.strftime('%Y-%m-%d')
+
+
+def aggregate_stats(scope, dimension, scope_id=0, since=None):
+    """value (an id, 0 for 'overall') -> {'sum', 'count', 'sum_sq', 'min', 'max'} for one scope and dimension.
+
+    ``since`` (a datetime) restricts per-day dimensions to exam days from
+    then on; it is ignored for ALL_TIME_DIMENSIONS.
+    """
+    t = GradeAggregate.__table__
+    windowed = since is not None and dimension not in ALL_TIME_DIMENSIONS
+    # Grouping by value + 0 stops SQLite walking uq_grade_aggregates_key for the GROUP BY order, so a
+    # window range-scans ix_grade_aggregates_period and costs the same however much history there is
+    value = t.c.value + 0 if windowed else t.c.value
+    query = select(
+        value, func.sum(t.c.score_sum), func.sum(t.c.score_count), func.sum(t.c.score_sum_sq),
+        func.min(t.c.score_min), func.max(t.c.score_max)
+    ).where(t.c.scope == scope, t.c.scope_id == scope_id, t.c.dimension == dimension).group_by(value)
+    if windowed:
+        query = query.where(t.c.period >= first_period(since))
+    return {
+        value: {'sum': total, 'count': count, 'sum_sq': sum_sq, 'min': low, 'max': high}
+        for value, total, count, sum_sq, low, high in db.session.execute(query) if count
+    }
+
+
+def dimension_names(dimension):
+    """id -> display name for one of the dimensions in LABELS"""
+    label = LABELS[dimension]
+    return dict(db.session.execute(select(label.class_.id, label)).all())
+
+
+def merge_by_name(stats_by_id, names):
+    """Re-key stats by display name, merging the entries of ids that share one"""
+    merged = {}
+    for value, stats in stats_by_id.items():
+        name = names.get(value, str(value))
+        if name not in merged:
+            merged[name] = stats
+            continue
+        current = merged[name]
+        merged[name] = {
+            'sum': current['sum'] + stats['sum'],
+            'count': current['count'] + stats['count'],
+            'sum_sq': current['sum_sq'] + stats['sum_sq'],
+            'min': min(current['min'], stats['min']),
+            'max': max(current['max'], stats['max'])
+        }
+    return merged
+
+
+def _stats_part(dimension, source, value, stats, *conditions):
+    """One dimension's grouped SELECT for _union_stats: dimension, id, name and the five stats.
+
+    LABELS dimensions are joined to their names and grouped by name, which
+    merges ids that share one as merge_by_name does; others are grouped by
+    id, and 'overall' (value None) is a single row with id 0.
+    """
+    name = literal(None, String)
+    group = []
+    if value is not None and dimension in LABELS:
+        label = LABELS[dimension]
+        source = source.join(label.class_.__table__, label.class_.id == value)
+        name, value, group = label, literal(0), [label]
+    elif value is not None:
+        group = [value]
+    else:
+        value = literal(0)
+    return select(literal(dimension), value, name, *stats).select_from(source).where(*conditions).group_by(*group)
+
+
+def _union_stats(dimensions, parts):
+    """Run _stats_part SELECTs as one UNION ALL; dimension -> id, or name for LABELS dimensions -> stats"""
+    result = {dimension: {} for dimension in dimensions}
+    for dimension, value, name, total, count, sum_sq, low, high in db.session.execute(union_all(*parts)):
+        if count:
+            key = name if dimension in LABELS else value
+            result[dimension][key] = {'sum': total, 'count': count, 'sum_sq': sum_sq, 'min': low, 'max': high}
+    return result
+
+
+def aggregate_breakdown(scope, dimensions, scope_id=0, since=None):
+    """dimension -> stats for one scope in one query, keyed by display name for the dimensions in LABELS.
+
+    Reads the aggregates as aggregate_stats does, ``since`` included; ids
+    that share a name, such as two teachers with the same full name, are
+    merged into one entry.
+    """
+    return _union_stats(dimensions, breakdown_parts(scope, dimensions, scope_id, since))
+
+
+def breakdown_parts(scope, dimensions, scope_id=0, since=None):
+    """The per-dimension aggregate SELECTs aggregate_breakdown runs as one UNION ALL"""
+    t = GradeAggregate.__table__
+    stats = (func.sum(t.c.score_sum), func.sum(t.c.score_count), func.sum(t.c.score_sum_sq),
+             func.min(t.c.score_min), func.max(t.c.score_max))
+    parts = []
+    for dimension in dimensions:
+        conditions = [t.c.scope == scope, t.c.scope_id == scope_id, t.c.dimension == dimension]
+        windowed = since is not None and dimension not in ALL_TIME_DIMENSIONS
+        if windowed:
+            conditions.append(t.c.period >= first_period(since))
+        # value + 0 keeps a window on ix_grade_aggregates_period, as in aggregate_stats
+        value = (t.c.value + 0 if windowed else t.c.value) if DIMENSIONS[dimension] else None
+        parts.append(_stats_part(dimension, t, value, stats, *conditions))
+    return parts
+
+
+def labelled_stats(scope, dimension, scope_id=0, since=None):
+    """aggregate_stats keyed by display name instead of id, for the dimensions in LABELS.
+
+    Ids that share a name, such as two teachers with the same full name,
+    are merged into one entry.
+    """
+    return aggregate_breakdown(scope, (dimension,), scope_id, since)[dimension]
+
+
+def grade_stats(dimensions, *conditions):
+    """dimension -> labelled_stats-style dict computed from the grades table in one grouped query.
+
+    For scopes the aggregates do not cover, such as one student's grades;
+    ``conditions`` filter the grades (e.g. ``Grade.student_id == 5``).
+    Grades without a value for a dimension are left out of it, and
+    'overall' is keyed by 0 as in aggregate_stats.
+    """
+    g = Grade.__table__
+    score = g.c.score
+    stats = (func.sum(score), func.count(), func.sum(score * score), func.min(score), func.max(score))
+    parts = []
+    for dimension in dimensions:
+        column = g.c[DIMENSIONS[dimension]] if DIMENSIONS[dimension] else None
+        part_conditions = conditions + ((column.is_not(None),) if column is not None else ())
+        parts.append(_stats_part(dimension, g, column, stats, *part_conditions))
+    return _union_stats(dimensions, parts)
+
+
+def value_counts(scope, dimension):
+    """scope_id -> number of distinct values with grades, e.g. students per teacher"""
+    t = GradeAggregate.__table__
+    rows = db.session.execute(
+        select(t.c.scope_id, func.count(t.c.value.distinct()))
+        .where(t.c.scope == scope, t.c.dimension == dimension).group_by(t.c.scope_id)
+    )
+    return dict(rows.all())
+
+
+def _histogram_counts(rows):
+    counts = {}
+    for value, bin_number, count in rows:
+        if value not in counts:
+            counts[value] = np.zeros(HISTOGRAM_BINS, dtype=np.int64)
+        counts[value][bin_number] += count
+    return counts
+
+
+def aggregate_histograms(scope, dimension, scope_id=0):
+    """value (an id, 0 for 'overall') -> grade count per bin (a NumPy array) for one scope and dimension"""
+    return _histogram_counts(db.session.execute(histogram_statement(scope, dimension, scope_id)))
+
+
+def histogram_statement(scope, dimension, scope_id=0):
+    """The stored histogram SELECT aggregate_histograms runs: value, bin and grade count"""
+    t = GradeHistogram.__table__
+    return (select(t.c.value, t.c.bin, t.c.grade_count)
+            .where(t.c.scope == scope, t.c.scope_id == scope_id, t.c.dimension == dimension))
+
+
+def grade_histograms(dimension, *conditions):
+    """aggregate_histograms computed from the grades table in one grouped query, e.g. for one student's grades"""
+    return _histogram_counts(db.session.execute(grade_histogram_statement(dimension, *conditions)))
+
+
+def grade_histogram_statement(dimension, *conditions):
+    """The grouped grades SELECT grade_histograms runs: value, bin and grade count"""
+    g = Grade.__table__
+    column = g.c[DIMENSIONS[dimension]] if DIMENSIONS[dimension] else literal(0)
+    bin_number = score_bin_column(g.c.score)
+    if DIMENSIONS[dimension]:
+        conditions += (column.is_not(None),)
+    return select(column, bin_number, func.count()).where(*conditions).group_by(column, bin_number)
+
+
+def histogram_percentiles(counts, percentiles):
+    """Scores at the given percentiles of a histogram, interpolated linearly within their bin.
+
+    Each lies in the same bin as the exact percentile, so it is off by less
+    than a bin width, (SCORE_MAX - SCORE_MIN) / HISTOGRAM_BINS. An empty
+    histogram has no percentiles: each is None.
+    """
+    cumulative = np.cumsum(counts)
+    if cumulative[-1] == 0:
+        return [None] * len(percentiles)
+    ranks = np.asarray(percentiles, dtype=float) / 100 * cumulative[-1]
+    bins = np.searchsorted(cumulative, ranks)
+    fraction = (ranks - (cumulative[bins] - counts[bins])) / counts[bins]
+    return SCORE_MIN + (bins + fraction) * (SCORE_MAX - SCORE_MIN) / HISTOGRAM_BINS
+
+
+def mean(stats):
+    return stats['sum'] / stats['count'] if stats and stats['count'] else 0
@@ -0,0 +1,276 @@
+# analytics.py - Factor trends, impact analysis, trend series and score distributions for everyone, a teacher or a student
+from datetime import datetime
+from functools import wraps
+from inspect import signature
+
+from flask import g, has_request_context
+from sqlalchemy import Integer, case, cast, extract, func, select
+
+from models import db, Grade
+from database import data_epoch, data_version
+from aggregates import (aggregate_breakdown, aggregate_histograms, dimension_names, first_period, grade_histograms,
+                        grade_stats, histogram_percentiles, mean, HISTOGRAM_BINS, LABELS, TERM_MONTHS, TREND_PERCENTILES)
+from validation import SCORE_MIN, SCORE_MAX
+from snapshot import current_snapshot
+
+# External factors the trend and impact analytics break scores down by
+FACTORS = ('day_of_week', 'teacher_name', 'topic')
+# Breakdowns charted by the performance dashboard
+PERFORMANCE_DIMENSIONS = ('overall', 'subject', 'teacher_name', 'day_of_week', 'topic')
+
+# Percentiles reported by the distribution endpoint
+DISTRIBUTION_PERCENTILES = (10, 25, 50, 75, 90)
+# Histogram widths it serves, in score points; each is a whole number of the stored one-point bins
+DISTRIBUTION_BIN_WIDTHS = (1, 2, 5, 10, 20, 25, 50)
+
+
+class AnalyticsContext:
+    """Analytics results worked out during one request, so views that share them compute each once.
+
+    Entries are keyed by the data epoch and version too, so a change made
+    earlier in the same request is never answered from before it.
+    """
+
+    def __init__(self):
+        self.results = {}
+
+    def get(self, key, compute):
+        key = (data_epoch(), data_version()) + key
+        if key not in self.results:
+            self.results[key] = compute()
+        return self.results[key]
+
+
+def analytics_context():
+    """The current request's AnalyticsContext; outside a request a new, empty one every call"""
+    if not has_request_context():
+        return AnalyticsContext()
+    if 'analytics' not in g:
+        g.analytics = AnalyticsContext()
+    return g.analytics
+
+
+def per_request(function):
+    """Memoize an analytics function in the request's AnalyticsContext, by its arguments.
+
+    Datetimes are keyed by the first exam day they let in, as grades are
+    dated to the day, so windows computed moments apart share an entry.
+    """
+    parameters = signature(function)
+
+    @wraps(function)
+    def memoized(*args, **kwargs):
+        bound = parameters.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = (function.__name__,) + tuple(first_period(value) if isinstance(value, datetime) else value
+                                           for value in bound.arguments.values())
+        return analytics_context().get(key, lambda: function(*args, **kwargs))
+    return memoized
+
+
+def scope_conditions(student_id=None, teacher_id=None):
+    """Grade filters for a student's or a teacher's grades; none for everyone's"""
+    conditions = []
+    if student_id:
+        conditions.append(Grade.student_id == student_id)
+    if teacher_id:
+        conditions.append(Grade.teacher_id == teacher_id)
+    return conditions
+
+
+def database_stats(dimensions, student_id=None, teacher_id=None, since=None):
+    """scope_stats read from the database: one grouped query over a student's grades, else over the aggregates"""
+    if student_id:
+        conditions = scope_conditions(student_id, teacher_id)
+        if since is not None:
+            conditions.append(Grade.exam_date >= since)
+        return grade_stats(dimensions, *conditions)
+    scope, scope_id = ('teacher', teacher_id) if teacher_id else ('all', 0)
+    return aggregate_breakdown(scope, dimensions, scope_id, since)
+
+
+def scope_stats(dimensions, student_id=None, teacher_id=None, since=None):
+    """dimension -> stats for a student, a teacher or everyone, keyed by display name for the dimensions in LABELS.
+
+    Read from the grade snapshot while it is current, else from the database.
+    """
+    snapshot = current_snapshot()
+    if snapshot is not None:
+        return snapshot.scope_stats(dimensions, student_id, teacher_id, since)
+    return database_stats(dimensions, student_id, teacher_id, since)
+
+
+@per_request
+def performance_summary(student_id=None, teacher_id=None, since=None, points=20):
+    """(stats per PERFORMANCE_DIMENSIONS, dates and scores of the last grades, window) for the dashboard charts.
+
+    Covers the grades from the datetime since on, window 'recent', or all
+    of them when there are none that recent (or no since), window 'all',
+    so the dashboards can say which they show. Without the snapshot that
+    is three queries whatever the data size: the data version, the latest
+    ``points`` grades (whose newest date also settles the window) and one
+    grouped query.
+    """
+    snapshot = current_snapshot()
+    if snapshot is not None:
+        if since is not None and not len(snapshot.rows(student_id, teacher_id, since, last=1)):
+            since = None
+        dates, scores = snapshot.recent(points, student_id, teacher_id, since)
+        stats = snapshot.scope_stats(PERFORMANCE_DIMENSIONS, student_id, teacher_id, since)
+        return stats, dates, scores, 'all' if since is None else 'recent'
+    latest = db.session.execute(
+        select(Grade.exam_date, Grade.score).where(*scope_conditions(student_id, teacher_id))
+        .order_by(Grade.exam_date.desc(), Grade.id.desc()).limit(points)
+    ).all()
+    if not latest:
+        return {dimension: {} for dimension in PERFORMANCE_DIMENSIONS}, [], [], 'all'
+    if since is not None and latest[0].exam_date < since:
+        since = None
+    # The window is a suffix in exam-date order, so its last grades are among the overall latest
+    recent = [(exam_date, score) for exam_date, score in reversed(latest) if since is None or exam_date >= since]
+    stats = database_stats(PERFORMANCE_DIMENSIONS, student_id, teacher_id, since)
+    return (stats, [exam_date.strftime('%Y-%m-%d') for exam_date, _ in recent], [score for _, score in recent],
+            'all' if since is None else 'recent')
+
+
+@per_request
+def factor_trends(student_id=None, teacher_id=None, since=None):
+    """factor -> value name -> {'average', 'count', 'min', 'max'} over grades since a datetime.
+
+    Grouped over the in-memory snapshot when there is one. Otherwise
+    teacher-wide and school-wide trends read the aggregates and a student's
+    grades are grouped by the database; either way the cost follows the
+    number of groups rather than the number of grades.
+    """
+    factor_stats = scope_stats(FACTORS, student_id, teacher_id, since)
+    return {
+        factor: {
+            value: {'average': round(mean(stats), 2), 'count': stats['count'], 'min': stats['min'], 'max': stats['max']}
+            for value, stats in factor_stats[factor].items()
+        }
+        for factor in FACTORS
+    }
+
+
+@per_request
+def factor_impact(student_id=None, teacher_id=None):
+    """factor -> value name -> how far that value's average sits from the scope's overall average.
+
+    The baseline comes from the same grades as the factor averages, so a
+    teacher's topics are measured against that teacher's average rather
+    than the whole school's. One grouped pass, scoped as in factor_trends.
+    """
+    factor_stats = scope_stats(('overall',) + FACTORS, student_id, teacher_id, None)
+    baseline = mean(factor_stats['overall'].get(0))
+    impact = {}
+    for factor in FACTORS:
+        impact[factor] = {}
+        for value, stats in factor_stats[factor].items():
+            difference = mean(stats) - baseline
+            impact[factor][value] = {
+                'average_score': round(mean(stats), 2),
+                'impact': round(difference, 2),
+                'count': stats['count'],
+                'performance': 'above' if difference > 0 else 'below'
+            }
+    return impact
+
+
+def bucket_start(bucket):
+    """SQL expression for the first day of the TREND_BUCKETS period each grade's exam date falls in"""
+    if db.engine.dialect.name == 'sqlite':
+        exam_date = Grade.exam_date
+        if bucket == 'day':
+            return func.date(exam_date)
+        if bucket == 'week':
+            return func.date(exam_date, 'weekday 0', '-6 days')
+        if bucket == 'month':
+            return func.strftime('%Y-%m-01', exam_date)
+        month = cast(func.strftime('%m', exam_date), Integer)
+        return func.printf('%s-%02d-01', func.strftime('%Y', exam_date), (month - 1) // TERM_MONTHS * TERM_MONTHS + 1)
+    if bucket != 'term':
+        return func.date_trunc(bucket, Grade.exam_date)
+    month = cast(extract('month', Grade.exam_date), Integer)
+    return func.make_date(cast(extract('year', Grade.exam_date), Integer),
+                          (month - 1) // TERM_MONTHS * TERM_MONTHS + 1, 1)
+
+
+@per_request
+def performance_trend(bucket, student_id=None, teacher_id=None, subject_id=None, since=None):
+    """Per-bucket mean, count, min, max and TREND_PERCENTILES of a scope's scores, oldest bucket first.
+
+    Grouped over the grade snapshot while it is current. Otherwise one
+    GROUP BY on the bucket's start date, so a year of grades comes back as
+    a few dozen rows; SQLite has no percentile aggregate, so each grade is
+    ranked within its bucket by a window function and a percentile is the
+    lowest score ranked at or past it.
+    """
+    snapshot = current_snapshot()
+    if snapshot is not None:
+        return snapshot.trend(bucket, student_id, teacher_id, subject_id, since)
+    rows = db.session.execute(trend_statement(bucket, student_id, teacher_id, subject_id, since)).all()
+    series = []
+    for start, count, average, low, high, *values in rows:
+        point = {'start': str(start)[:10], 'count': count, 'mean': round(average, 2), 'min': low, 'max': high}
+        point.update({f'p{percentile}': value for percentile, value in zip(TREND_PERCENTILES, values)})
+        series.append(point)
+    return series
+
+
+def trend_statement(bucket, student_id=None, teacher_id=None, subject_id=None, since=None):
+    """The grouped grades SELECT performance_trend runs: bucket start, count, mean, min, max and percentiles"""
+    conditions = scope_conditions(student_id, teacher_id)
+    if subject_id:
+        conditions.append(Grade.subject_id == subject_id)
+    if since is not None:
+        conditions.append(Grade.exam_date >= since)
+    start = bucket_start(bucket)
+    ranked = select(
+        start.label('start'), Grade.score,
+        func.row_number().over(partition_by=start, order_by=Grade.score).label('rank'),
+        func.count().over(partition_by=start).label('size')
+    ).where(*conditions).subquery()
+    percentiles = [
+        func.min(case((ranked.c.rank * 100 >= ranked.c.size * percentile, ranked.c.score)))
+        for percentile in TREND_PERCENTILES
+    ]
+    return (
+        select(ranked.c.start, func.count(), func.avg(ranked.c.score), func.min(ranked.c.score),
+               func.max(ranked.c.score), *percentiles)
+        .group_by(ranked.c.start).order_by(ranked.c.start)
+    )
+
+
+@per_request
+def score_distribution(dimension, student_id=None, teacher_id=None, bin_width=10):
+    """group name ('overall' for that dimension) -> count, DISTRIBUTION_PERCENTILES and histogram of a scope's scores.
+
+    Everyone's and a teacher's come from the stored histograms, merged on
+    read across the ids sharing a name; a student's grades are binned by
+    one grouped query. The histogram returned has bins bin_width (one of
+    DISTRIBUTION_BIN_WIDTHS) points wide.
+    """
+    if student_id:
+        histograms = grade_histograms(dimension, *scope_conditions(student_id, teacher_id))
+    else:
+        scope, scope_id = ('teacher', teacher_id) if teacher_id else ('all', 0)
+        histograms = aggregate_histograms(scope, dimension, scope_id)
+    names = dimension_names(dimension) if dimension in LABELS else {0: 'overall'}
+    merged = {}
+    for value, counts in histograms.items():
+        name = names.get(value, str(value))
+        merged[name] = merged[name] + counts if name in merged else counts
+    stored_per_bin = round(bin_width * HISTOGRAM_BINS / (SCORE_MAX - SCORE_MIN))
+    distribution = {}
+    for name, counts in merged.items():
+        # A group left without grades, e.g. after every one was retracted, has nothing to describe
+        if not counts.any():
+            continue
+        percentiles = histogram_percentiles(counts, DISTRIBUTION_PERCENTILES)
+        distribution[name] = {
+            'count': int(counts.sum()),
+            'percentiles': {f'p{percentile}': round(float(score), 1) if score is not None else None
+                            for percentile, score in zip(DISTRIBUTION_PERCENTILES, percentiles)},
+            'histogram': counts.reshape(-1, stored_per_bin).sum(axis=1).tolist()
+        }
+    return distribution
@@ -1,25 +1,48 @@
 # app.py - Complete Flask application with all routes
 from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_file, send_from_directory
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from models import db, User, Teacher, Student, Subject, Grade, SystemLog, Recommendation
+from models import db, User, Teacher, Student, Subject, Topic, Weekday, Grade, GradeAggregate, GradeHistogram, SystemLog, Recommendation, ImportJob, SourceManifest
+from migrations import upgrade_schema
 from config import config
+from ingest import (bulk_load_grades, load_entity_lookups, file_fingerprint, find_resumable_checkpoint,
+                    start_checkpoint, finish_checkpoint, stream_import, count_grade_rows, ensure_natural_key_index, parse_files_parallel,
+                    plan_source_refresh, validated_loader, checkpoint_error_report, LOAD_COUNTERS,
+                    GRADE_FILE_FORMATS)
+from validation import ErrorReport
+from staging import (supports_staging, staging_tables, staging_tables_exist, create_staging_tables,
+                     build_staging_indexes, validate_staging, swap_staging_tables, drop_retired_tables)
+from uploads import init_uploads
+from aggregates import (aggregate_stats, labelled_stats, value_counts, delete_grades, rebuild_aggregates, mean,
+                        TREND_BUCKETS, HISTOGRAM_DIMENSIONS)
+from analytics import (factor_trends, factor_impact, performance_summary, performance_trend,
+                       score_distribution, DISTRIBUTION_BIN_WIDTHS)
+from snapshot import init_snapshot
+from result_cache import init_result_cache, cached_result, result_cache_stats
+from recommendations import rebuild_recommendations, stored_recommendations, GENERAL_RECOMMENDATIONS
+from database import init_engine_profile, bump_data_version
+from jobs import (init_job_runner, create_job, submit_job, reap_orphaned_jobs, job_progress, job_status,
+                  ImportBusyError)
 import json
 from datetime import datetime, timedelta
-from sqlalchemy import func, and_, or_
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import joinedload
 import pandas as pd
 import numpy as np
 import io
 import os
-from collections import defaultdict
-import secrets
 import glob
 
 def create_app():
     app = Flask(__name__)
-    app.config.from_object(config['development'])
+    app.config.from_object(config[os.environ.get('FLASK_CONFIG') or 'default'])
 
     # Initialize extensions
     db.init_app(app)
+    init_engine_profile(app)
+    init_job_runner(app)
+    init_uploads(app)
+    init_snapshot(app)
+    init_result_cache(app)
     login_manager = LoginManager()
     login_manager.init_app(app)
     login_manager.login_view = 'login'
@@ -30,8 +53,9 @@ def create_app():
         return User.query.get(int(user_id))
 
     # NEW FUNCTION: Completely replace all data from CSV - FIXED TO NOT CREATE USERS AUTOMATICALLY
-    def replace_all_data_with_csv(csv_file_path):
+    def replace_all_data_with_csv(csv_file_path, source_name=None, on_progress=None, source_hash=None):
         """Completely replace ALL system data with data from CSV file - FIXED: Only creates from CSV"""
+        checkpoint = None
         try:
             print("🔄 Starting complete data replacement from CSV...")
             
@@ -43,148 +67,101 @@ def create_app():
             
             print(f"📊 Before replacement - Grades: {total_grades_before}, Students: {total_students_before}, Subjects: {total_subjects_before}, Teachers: {total_teachers_before}")
             
-            # DELETE ALL DATA (in correct order to avoid foreign key constraints)
-            print("🗑️  Deleting all existing data...")
-            
-            # Delete grades first
-            deleted_grades = Grade.query.delete()
-            print(f"🗑️  Deleted {deleted_grades} grades")
-            
-            # Delete ALL students (including those linked to users except admin)
-            students_to_delete = Student.query.filter(Student.user_id != 1).delete()
-            print(f"🗑️  Deleted {students_to_delete} students")
-            
-            # Delete subjects
-            subjects_to_delete = Subject.query.delete()
-            print(f"🗑️  Deleted {subjects_to_delete} subjects")
-            
-            # Delete ALL teachers (including those linked to users except admin)
-            teachers_to_delete = Teacher.query.filter(Teacher.user_id != 1).delete()
-            print(f"🗑️  Deleted {teachers_to_delete} teachers")
-            
-            # Delete user accounts that are not admin
-            users_to_delete = User.query.filter(User.id != 1, User.role.in_(['teacher', 'student'])).delete()
-            print(f"🗑️  Deleted {users_to_delete} user accounts")
-            
-            db.session.commit()
+            # The new dataset is built in shadow tables so dashboards keep reading the old one until the swap
+            staged = supports_staging()
+            
+            # A re-upload of a file whose import failed picks up after the last committed chunk
+            source_hash = source_hash or file_fingerprint(csv_file_path)
+            checkpoint = find_resumable_checkpoint(source_hash, 'replace')
+            if checkpoint and staged and not staging_tables_exist():
+                checkpoint = None
+            
+            if checkpoint:
+                print(f"⏩ Resuming interrupted import after row {checkpoint.rows_committed}")
+            elif staged:
+                # Refuses while another replacement is running, before its staging tables are touched
+                checkpoint = start_checkpoint(source_hash, source_name or os.path.basename(csv_file_path), 'replace',
+                                              app.config['IMPORT_CHUNK_SIZE'])
+                db.session.flush()
+                print("🧱 Creating staging tables...")
+                create_staging_tables()
+                db.session.commit()
+            else:
+                # DELETE ALL DATA (in correct order to avoid foreign key constraints)
+                print("🗑️  Deleting all existing data...")
+            
+                # Delete grades first
+                deleted_grades = Grade.query.delete()
+                GradeAggregate.query.delete()
+                GradeHistogram.query.delete()
+                Recommendation.query.delete()
+                bump_data_version()
+                print(f"🗑️  Deleted {deleted_grades} grades")
+            
+                # Delete ALL students (including those linked to users except admin)
+                students_to_delete = Student.query.filter(Student.user_id != 1).delete()
+                print(f"🗑️  Deleted {students_to_delete} students")
+            
+                # Delete subjects
+                subjects_to_delete = Subject.query.delete()
+                print(f"🗑️  Deleted {subjects_to_delete} subjects")
+                Topic.query.delete()
+                Weekday.query.delete()
+            
+                # Delete ALL teachers (including those linked to users except admin)
+                teachers_to_delete = Teacher.query.filter(Teacher.user_id != 1).delete()
+                print(f"🗑️  Deleted {teachers_to_delete} teachers")
+            
+                # Delete user accounts that are not admin
+                users_to_delete = User.query.filter(User.id != 1, User.role.in_(['teacher', 'student'])).delete()
+                print(f"🗑️  Deleted {users_to_delete} user accounts")
+            
+                # Teacher CSVs must be re-ingested by the next refresh
+                SourceManifest.query.delete()
+            
+                checkpoint = start_checkpoint(source_hash, source_name or os.path.basename(csv_file_path), 'replace',
+                                              app.config['IMPORT_CHUNK_SIZE'])
+                db.session.commit()
             
-            # Now process the new CSV file
+            # Now stream the new CSV file in chunks, committing each one
             print(f"📖 Processing new CSV file: {csv_file_path}")
             
-            df = pd.read_csv(csv_file_path)
-            
-            # Validate required columns
-            required_columns = ['Student_ID', 'Student_Name', 'Subject', 'Topic', 'Test_Date', 'Day', 'Teacher_Name', 'Score']
-            if not all(col in df.columns for col in required_columns):
-                raise ValueError(f"CSV missing required columns. Required: {required_columns}")
-            
-            grades_added = 0
-            students_created = 0
-            subjects_created = 0
-            teachers_created = 0
-            
-            # Track unique entities to avoid duplicates
-            processed_students = {}
-            processed_subjects = {}
-            processed_teachers = {}
-            
-            for _, row in df.iterrows():
-                # Process teacher - ONLY CREATE FROM CSV
-                teacher_name = row['Teacher_Name']
-                if teacher_name not in processed_teachers:
-                    teacher = Teacher.query.filter_by(full_name=teacher_name).first()
-                    if not teacher:
-                        # Create new teacher user
-                        teacher_username = teacher_name.replace(' ', '').replace('.', '').replace(',', '').lower()
-                        # Ensure username is unique
-                        base_username = teacher_username
-                        counter = 1
-                        while User.query.filter_by(username=teacher_username).first():
-                            teacher_username = f"{base_username}{counter}"
-                            counter += 1
-                        
-                        teacher_user = User(
-                            username=teacher_username,
-                            email=f"{teacher_username}@tutoring.com",
-                            role='teacher'
-                        )
-                        teacher_user.set_password('password321')
-                        db.session.add(teacher_user)
-                        db.session.flush()
-                        
-                        teacher = Teacher(
-                            user_id=teacher_user.id,
-                            full_name=teacher_name,
-                            subjects=row['Subject']
-                        )
-                        db.session.add(teacher)
-                        teachers_created += 1
-                        db.session.flush()
-                    
-                    processed_teachers[teacher_name] = teacher
+            # Entity lookup maps stay resident; each chunk is bulk inserted and committed.
+            # The aggregates are built once at the end rather than maintained chunk by chunk.
+            tables = staging_tables() if staged else None
+            if not staged:
+                ensure_natural_key_index()
+            lookups = load_entity_lookups(tables, track_aggregates=False)
+            # Rows failing validation are skipped and listed in a downloadable report
+            report = checkpoint_error_report(app.config['IMPORT_REPORT_DIR'], checkpoint)
+            # The checkpoint stays running until the swap, keeping other replacements off the staging tables
+            load_stats = stream_import(csv_file_path, checkpoint,
+                                       validated_loader(lookups, report, source_name or csv_file_path),
+                                       on_progress=on_progress, finish=False)
+            
+            print("📊 Building grade aggregates...")
+            if staged:
+                rebuild_aggregates(tables['grades'], tables['grade_aggregates'])
                 
-                # Process student - ONLY CREATE FROM CSV
-                student_id = row['Student_ID']
-                if student_id not in processed_students:
-                    student = Student.query.filter_by(student_id=student_id).first()
-                    if not student:
-                        # Create new student user
-                        username = row['Student_Name'].replace(' ', '').replace('.', '').replace(',', '').lower()
-                        # Ensure username is unique
-                        base_username = username
-                        counter = 1
-                        while User.query.filter_by(username=username).first():
-                            username = f"{base_username}{counter}"
-                            counter += 1
-                        
-                        student_user = User(
-                            username=username,
-                            email=f"{username}@tutoring.com",
-                            role='student'
-                        )
-                        student_user.set_password('password321')
-                        db.session.add(student_user)
-                        db.session.flush()
-                        
-                        student = Student(
-                            user_id=student_user.id,
-                            student_id=student_id,
-                            full_name=row['Student_Name'],
-                            grade_level='Form 4'
-                        )
-                        db.session.add(student)
-                        students_created += 1
-                        db.session.flush()
-                    
-                    processed_students[student_id] = student
-                
-                # Process subject - ONLY CREATE FROM CSV
-                subject_name = row['Subject']
-                if subject_name not in processed_subjects:
-                    subject = Subject.query.filter_by(name=subject_name).first()
-                    if not subject:
-                        subject = Subject(name=subject_name, description=subject_name)
-                        db.session.add(subject)
-                        subjects_created += 1
-                        db.session.flush()
-                    
-                    processed_subjects[subject_name] = subject
-                
-                # Create grade
-                grade = Grade(
-                    student_id=processed_students[student_id].id,
-                    teacher_id=processed_teachers[teacher_name].id,
-                    subject_id=processed_subjects[subject_name].id,
-                    score=float(row['Score']),
-                    topic=row['Topic'],
-                    exam_date=datetime.strptime(row['Test_Date'], '%Y-%m-%d'),
-                    day_of_week=row['Day'],
-                    teacher_name=teacher_name
-                )
-                db.session.add(grade)
-                grades_added += 1
-            
-            db.session.commit()
+                # Nothing live has changed yet; a failed check leaves the old data in place
+                build_staging_indexes()
+                validate_staging()
+                swap_staging_tables()
+                bump_data_version()
+                # Rebuilt before the commit, so no one is served rows keyed by the old ids
+                rebuild_recommendations()
+                # Teacher CSVs must be re-ingested by the next refresh
+                SourceManifest.query.delete()
+                finish_checkpoint(checkpoint)
+                db.session.commit()
+                print("🔀 Swapped staged data in")
+                drop_retired_tables()
+            else:
+                rebuild_aggregates()
+                bump_data_version()
+                rebuild_recommendations()
+                finish_checkpoint(checkpoint)
+                db.session.commit()
             
             total_grades_after = Grade.query.count()
             total_students_after = Student.query.count()
@@ -192,15 +169,21 @@ def create_app():
             total_teachers_after = Teacher.query.count()
             
             print(f"📊 After replacement - Grades: {total_grades_after}, Students: {total_students_after}, Subjects: {total_subjects_after}, Teachers: {total_teachers_after}")
-            print(f"✅ Added - Grades: {grades_added}, Students: {students_created}, Subjects: {subjects_created}, Teachers: {teachers_created}")
+            print(f"✅ Added - Grades: {load_stats['grades_added']}, Students: {load_stats['students_created']}, Subjects: {load_stats['subjects_created']}, Teachers: {load_stats['teachers_created']}")
             print("✅ Data replacement completed successfully!")
             
             return {
                 'success': True,
-                'grades_added': grades_added,
-                'students_created': students_created,
-                'subjects_created': subjects_created,
-                'teachers_created': teachers_created,
+                'grades_added': load_stats['grades_added'],
+                'students_created': load_stats['students_created'],
+                'subjects_created': load_stats['subjects_created'],
+                'teachers_created': load_stats['teachers_created'],
+                'elapsed_seconds': load_stats['elapsed_seconds'],
+                'rows_per_second': load_stats['rows_per_second'],
+                'chunks': load_stats['chunks'],
+                'resumed_from_row': load_stats['resumed_from_row'],
+                'rows_rejected': load_stats['rows_rejected'],
+                'error_report': report.summary(),
                 'total_grades': total_grades_after,
                 'total_students': total_students_after,
                 'total_subjects': total_subjects_after,
@@ -210,176 +193,210 @@ def create_app():
         except Exception as e:
             db.session.rollback()
             print(f"❌ Error during data replacement: {e}")
+            if checkpoint is not None and checkpoint.status == 'running':
+                finish_checkpoint(checkpoint, str(e))
+                db.session.commit()
             return {
                 'success': False,
                 'error': str(e)
             }
 
-    # UPDATED FUNCTION: Refresh all data from teacher CSVs - FIXED TO NOT CREATE SAMPLE DATA
-    def refresh_all_teacher_data():
-        """Clear all grade data and re-import from all teacher CSV files - FIXED: No sample data"""
+    # NEW FUNCTION: Merge CSV rows into the existing data instead of replacing it
+    def merge_data_with_csv(csv_file_path, source_name=None, on_progress=None, source_hash=None):
+        """Insert new grades and update changed scores from a CSV, keyed on (Student_ID, Subject, Topic, Test_Date)"""
         try:
-            print("🔄 Starting complete data refresh...")
+            print("🔄 Starting incremental merge from CSV...")
+            ensure_natural_key_index()
             
-            # Count existing data before deletion
-            total_grades_before = Grade.query.count()
-            total_students_before = Student.query.count()
-            total_subjects_before = Subject.query.count()
-            
-            print(f"📊 Before refresh - Grades: {total_grades_before}, Students: {total_students_before}, Subjects: {total_subjects_before}")
-            
-            # Delete ALL grades from the database
-            deleted_grades = Grade.query.delete()
-            print(f"🗑️  Deleted {deleted_grades} grades from database")
-            
-            # Delete students (except admin)
-            students_to_delete = Student.query.filter(Student.user_id != 1).delete()
-            print(f"🗑️  Deleted {students_to_delete} students")
-            
-            # Delete subjects not linked to any grades (they'll be recreated)
-            subjects_to_delete = Subject.query.filter(~Subject.id.in_(db.session.query(Grade.subject_id))).delete()
-            print(f"🗑️  Deleted {subjects_to_delete} orphaned subjects")
-            
-            # Delete teachers (except admin)
-            teachers_to_delete = Teacher.query.filter(Teacher.user_id != 1).delete()
-            print(f"🗑️  Deleted {teachers_to_delete} teachers")
+            source_hash = source_hash or file_fingerprint(csv_file_path)
+            checkpoint = find_resumable_checkpoint(source_hash, 'merge')
+            if checkpoint:
+                print(f"⏩ Resuming interrupted merge after row {checkpoint.rows_committed}")
+            else:
+                checkpoint = start_checkpoint(source_hash, source_name or os.path.basename(csv_file_path), 'merge',
+                                              app.config['IMPORT_CHUNK_SIZE'])
+                db.session.commit()
             
-            # Delete user accounts that are not admin
-            users_to_delete = User.query.filter(User.id != 1, User.role.in_(['teacher', 'student'])).delete()
-            print(f"🗑️  Deleted {users_to_delete} user accounts")
+            print(f"📖 Processing CSV file: {csv_file_path}")
+            lookups = load_entity_lookups()
+            report = checkpoint_error_report(app.config['IMPORT_REPORT_DIR'], checkpoint)
+            load_stats = stream_import(csv_file_path, checkpoint,
+                                       validated_loader(lookups, report, source_name or csv_file_path),
+                                       on_progress=on_progress)
             
+            print("💡 Rebuilding recommendations...")
+            rebuild_recommendations()
             db.session.commit()
             
-            # Now process CSV files from uploads directory
-            csv_files = glob.glob('uploads/*.csv') + glob.glob('static/*.csv')
+            total_grades_after = Grade.query.count()
+            print(f"✅ Merged - New: {load_stats['grades_added']}, Updated: {load_stats['grades_updated']}, Unchanged: {load_stats['grades_unchanged']}, Total grades: {total_grades_after}")
             
-            total_grades_added = 0
-            total_students_created = 0
-            total_subjects_created = 0
+            return {
+                'success': True,
+                'grades_added': load_stats['grades_added'],
+                'grades_updated': load_stats['grades_updated'],
+                'grades_unchanged': load_stats['grades_unchanged'],
+                'students_created': load_stats['students_created'],
+                'subjects_created': load_stats['subjects_created'],
+                'teachers_created': load_stats['teachers_created'],
+                'elapsed_seconds': load_stats['elapsed_seconds'],
+                'rows_per_second': load_stats['rows_per_second'],
+                'chunks': load_stats['chunks'],
+                'resumed_from_row': load_stats['resumed_from_row'],
+                'rows_rejected': load_stats['rows_rejected'],
+                'error_report': report.summary(),
+                'total_grades': total_grades_after
+            }
             
-            print(f"📂 Processing {len(csv_files)} CSV files...")
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Error during data merge: {e}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
+
+    def run_csv_upload_job(csv_file_path, source_name, user_id, ip_address, mode='replace', on_progress=None,
+                           source_hash=None):
+        """Background body of /admin/upload-csv: replace or merge the data and log the outcome"""
+        if mode == 'merge':
+            result = merge_data_with_csv(csv_file_path, source_name=source_name, on_progress=on_progress,
+                                         source_hash=source_hash)
+            if result['success']:
+                log = SystemLog(
+                    user_id=user_id,
+                    action='Admin merged CSV upload into system data',
+                    status='success',
+                    details=f"Added {result['grades_added']} grades, updated {result['grades_updated']}, unchanged {result['grades_unchanged']}, rejected {result['rows_rejected']} rows ({result['rows_per_second']} rows/sec)",
+                    ip_address=ip_address
+                )
+                db.session.add(log)
+                db.session.commit()
+                result['message'] = f'Merged CSV: {result["grades_added"]} new grades, {result["grades_updated"]} updated, {result["grades_unchanged"]} unchanged, {result["rows_rejected"]} rows rejected.'
+            return result
+        
+        result = replace_all_data_with_csv(csv_file_path, source_name=source_name, on_progress=on_progress,
+                                           source_hash=source_hash)
+        
+        if result['success']:
+            log = SystemLog(
+                user_id=user_id,
+                action='Admin completely replaced all system data with CSV upload',
+                status='success',
+                details=f"Added {result['grades_added']} grades, {result['students_created']} students, {result['subjects_created']} subjects, {result['teachers_created']} teachers, rejected {result['rows_rejected']} rows ({result['rows_per_second']} rows/sec)",
+                ip_address=ip_address
+            )
+            db.session.add(log)
+            db.session.commit()
+            result['message'] = f'Successfully replaced ALL system data with {result["grades_added"]} grades from CSV ({result["rows_rejected"]} rows rejected).'
+        
+        return result
+
+    def run_refresh_job(user_id, ip_address, on_progress=None):
+        """Background body of /admin/refresh-data: refresh from the teacher CSVs and log the outcome"""
+        result = refresh_all_teacher_data(on_progress=on_progress)
+        if result['success']:
+            log = SystemLog(
+                user_id=user_id,
+                action='Refreshed all system data from teacher CSVs',
+                status='success',
+                details=f"Added {result['grades_added']} grades, {result['students_created']} students, {result['subjects_created']} subjects",
+                ip_address=ip_address
+            )
+            db.session.add(log)
+            db.session.commit()
+            result['message'] = f"Data refresh completed! Added {result['grades_added']} grades."
+        return result
+
+    # UPDATED FUNCTION: Refresh data from teacher CSVs - only files that changed since the last refresh
+    def refresh_all_teacher_data(on_progress=None):
+        """Re-import teacher CSV files whose content changed and drop rows of files that disappeared"""
+        try:
+            print("🔄 Starting data refresh...")
             
-            for csv_file in csv_files:
-                try:
-                    print(f"   📖 Processing CSV file: {csv_file}")
-                    # For refresh, we need to process each CSV and create teachers/students
-                    df = pd.read_csv(csv_file)
-                    
-                    # Validate required columns
-                    required_columns = ['Student_ID', 'Student_Name', 'Subject', 'Topic', 'Test_Date', 'Day', 'Teacher_Name', 'Score']
-                    if not all(col in df.columns for col in required_columns):
-                        print(f"   ⚠️  CSV missing required columns: {csv_file}")
-                        continue
-                    
-                    grades_added = 0
-                    students_created = 0
-                    subjects_created = 0
-                    
-                    # Process each row
-                    for _, row in df.iterrows():
-                        # Find or create teacher
-                        teacher = Teacher.query.filter_by(full_name=row['Teacher_Name']).first()
-                        if not teacher:
-                            # Create teacher user
-                            teacher_username = row['Teacher_Name'].replace(' ', '').replace('.', '').replace(',', '').lower()
-                            base_username = teacher_username
-                            counter = 1
-                            while User.query.filter_by(username=teacher_username).first():
-                                teacher_username = f"{base_username}{counter}"
-                                counter += 1
-                            
-                            teacher_user = User(
-                                username=teacher_username,
-                                email=f"{teacher_username}@tutoring.com",
-                                role='teacher'
-                            )
-                            teacher_user.set_password('password321')
-                            db.session.add(teacher_user)
-                            db.session.flush()
-                            
-                            teacher = Teacher(
-                                user_id=teacher_user.id,
-                                full_name=row['Teacher_Name'],
-                                subjects=row['Subject']
-                            )
-                            db.session.add(teacher)
-                            db.session.flush()
-                        
-                        # Find or create student
-                        student = Student.query.filter_by(student_id=row['Student_ID']).first()
-                        if not student:
-                            # Create student user
-                            username = row['Student_Name'].replace(' ', '').replace('.', '').replace(',', '').lower()
-                            base_username = username
-                            counter = 1
-                            while User.query.filter_by(username=username).first():
-                                username = f"{base_username}{counter}"
-                                counter += 1
-                            
-                            student_user = User(
-                                username=username,
-                                email=f"{username}@tutoring.com",
-                                role='student'
-                            )
-                            student_user.set_password('password321')
-                            db.session.add(student_user)
-                            db.session.flush()
-                            
-                            student = Student(
-                                user_id=student_user.id,
-                                student_id=row['Student_ID'],
-                                full_name=row['Student_Name'],
-                                grade_level='Form 4'
-                            )
-                            db.session.add(student)
-                            students_created += 1
-                            db.session.flush()
-                        
-                        # Find or create subject
-                        subject = Subject.query.filter_by(name=row['Subject']).first()
-                        if not subject:
-                            subject = Subject(name=row['Subject'], description=row['Subject'])
-                            db.session.add(subject)
-                            subjects_created += 1
-                            db.session.flush()
-                        
-                        # Create grade
-                        grade = Grade(
-                            student_id=student.id,
-                            teacher_id=teacher.id,
-                            subject_id=subject.id,
-                            score=float(row['Score']),
-                            topic=row['Topic'],
-                            exam_date=datetime.strptime(row['Test_Date'], '%Y-%m-%d'),
-                            day_of_week=row['Day'],
-                            teacher_name=row['Teacher_Name']
-                        )
-                        db.session.add(grade)
-                        grades_added += 1
-                    
-                    total_grades_added += grades_added
-                    total_students_created += students_created
-                    total_subjects_created += subjects_created
-                    print(f"   ✅ Added {grades_added} grades from {csv_file}")
-                    
-                except Exception as e:
-                    print(f"   ❌ Error processing {csv_file}: {e}")
-                    continue
+            total_grades_before = Grade.query.count()
+            print(f"📊 Before refresh - Grades: {total_grades_before}")
+            
+            # Compare the CSV files on disk with the manifest of what was last ingested
+            csv_files = [path for folder in ('uploads', 'static') for ext in GRADE_FILE_FORMATS
+                         for path in glob.glob(f'{folder}/*{ext}')]
+            changed, unchanged, removed = plan_source_refresh(csv_files)
+            print(f"📂 {len(csv_files)} CSV files: {len(changed)} new or changed, {len(unchanged)} unchanged, {len(removed)} removed")
+            
+            # Parse and validate the changed files concurrently; each worker returns a normalized frame
+            parsed_files = parse_files_parallel([change['path'] for change in changed], app.config['REFRESH_PARSE_WORKERS'])
+            report = ErrorReport(app.config['IMPORT_REPORT_DIR'], f"refresh_{datetime.utcnow():%Y%m%d%H%M%S}_errors.csv")
+            
+            loadable = []
+            file_stats = []
+            for change, parsed in zip(changed, parsed_files):
+                if parsed['error']:
+                    # Keep the file's previous rows; it is retried on the next refresh
+                    print(f"   ❌ Error processing {parsed['path']}: {parsed['error']}")
+                else:
+                    print(f"   📖 Parsed {parsed['rows']} rows from {parsed['path']} in {parsed['parse_seconds']}s ({parsed['rows_rejected']} rejected)")
+                    report.add(parsed['errors'], parsed['path'])
+                    loadable.append((change, parsed['frame']))
+                file_stats.append({
+                    'file': parsed['path'],
+                    'rows': parsed['rows'],
+                    'rows_rejected': parsed['rows_rejected'],
+                    'parse_seconds': parsed['parse_seconds'],
+                    'error': parsed['error']
+                })
             
             # NO SAMPLE DATA CREATION - Only use actual CSV files
             
+            # Rows of removed and re-ingested files go; rows from admin uploads (no source file) stay
+            stale_ids = [entry.id for entry in removed] + [change['entry'].id for change, _ in loadable if change['entry']]
+            deleted_grades = delete_grades(Grade.source_file_id.in_(stale_ids)) if stale_ids else 0
+            print(f"🗑️  Deleted {deleted_grades} grades from removed or changed CSV files")
+            for entry in removed:
+                db.session.delete(entry)
+            
+            # Single writer: entity maps are shared across files and everything lands in one transaction
+            ensure_natural_key_index()
+            lookups = load_entity_lookups()
+            totals = dict.fromkeys(LOAD_COUNTERS, 0)
+            for change, frame in loadable:
+                entry = change['entry'] or SourceManifest(path=change['path'])
+                db.session.add(entry)
+                db.session.flush()
+                
+                load_stats = bulk_load_grades(frame, lookups, source_file_id=entry.id)
+                for key in LOAD_COUNTERS:
+                    totals[key] += load_stats.get(key, 0)
+                
+                entry.size_bytes = change['size_bytes']
+                entry.mtime = change['mtime']
+                entry.content_hash = change['content_hash']
+                entry.row_count = len(frame)
+                entry.ingested_at = datetime.utcnow()
+                if on_progress:
+                    on_progress(totals['grades_added'] + totals['grades_updated'] + totals['grades_unchanged'])
+            
+            bump_data_version()
+            rebuild_recommendations()
             db.session.commit()
             
             total_grades_after = Grade.query.count()
             
-            print(f"📊 After refresh - Grades: {total_grades_after}, New students: {total_students_created}, New subjects: {total_subjects_created}")
+            print(f"📊 After refresh - Grades: {total_grades_after}, New students: {totals['students_created']}, New subjects: {totals['subjects_created']}")
             print("✅ Data refresh completed successfully!")
             
             return {
                 'success': True,
-                'grades_added': total_grades_added,
-                'students_created': total_students_created,
-                'subjects_created': total_subjects_created,
+                'grades_added': totals['grades_added'],
+                'grades_removed': deleted_grades,
+                'students_created': totals['students_created'],
+                'subjects_created': totals['subjects_created'],
+                'teachers_created': totals['teachers_created'],
+                'files_changed': len(loadable),
+                'files_unchanged': len(unchanged),
+                'files_removed': len(removed),
+                'files': file_stats,
+                'rows_rejected': sum(stats['rows_rejected'] for stats in file_stats),
+                'error_report': report.summary(),
                 'total_grades': total_grades_after
             }
             
@@ -428,266 +445,59 @@ def create_app():
     # Enhanced Analytics Functions - FIXED TO READ ALL TEACHER DATA
     def calculate_performance_trends(student_id=None, teacher_id=None, days=30):
         """Calculate performance trends based on external factors with real data"""
-        query = Grade.query
-        
-        if student_id:
-            query = query.filter(Grade.student_id == student_id)
-        if teacher_id:
-            query = query.filter(Grade.teacher_id == teacher_id)
-        
-        # Get recent grades
         cutoff_date = datetime.utcnow() - timedelta(days=days)
-        query = query.filter(Grade.exam_date >= cutoff_date)
-        
-        grades = query.order_by(Grade.exam_date).all()
-        
-        if not grades:
-            return get_fallback_trends()  # Now returns empty trends
-        
-        trends = {}
-        factors = ['day_of_week', 'teacher_name', 'topic']
-        
-        for factor in factors:
-            factor_values = {}
-            for grade in grades:
-                factor_value = getattr(grade, factor)
-                if factor_value:
-                    if factor_value not in factor_values:
-                        factor_values[factor_value] = []
-                    factor_values[factor_value].append(grade.score)
-            
-            factor_avgs = {}
-            for value, scores in factor_values.items():
-                if len(scores) > 0:
-                    factor_avgs[value] = {
-                        'average': round(sum(scores) / len(scores), 2),
-                        'count': len(scores),
-                        'min': min(scores),
-                        'max': max(scores)
-                    }
-            
-            trends[factor] = factor_avgs
-        
-        return trends
+        # Grouped in the database (or read from the aggregates) rather than looping over grade objects
+        trends = factor_trends(student_id, teacher_id, since=cutoff_date)
+        return trends if any(trends.values()) else get_fallback_trends()  # Now returns empty trends
 
     def generate_factor_impact_analysis(teacher_id=None, student_id=None):
-        """Generate factor impact analysis using real data"""
-        query = Grade.query
-        
-        if teacher_id:
-            query = query.filter(Grade.teacher_id == teacher_id)
-        if student_id:
-            query = query.filter(Grade.student_id == student_id)
-        
-        grades = query.all()
-        
-        if not grades:
+        """Generate factor impact analysis using real data, against the average of the same scope"""
+        impact_analysis = factor_impact(student_id, teacher_id)
+        if not any(impact_analysis.values()):
             return get_fallback_factor_analysis()  # Now returns empty analysis
-        
-        factors = ['day_of_week', 'teacher_name', 'topic']
-        impact_analysis = {}
-        overall_avg = db.session.query(func.avg(Grade.score)).scalar() or 0
-        
-        for factor in factors:
-            factor_impact = {}
-            # Get unique values for this factor from actual grades
-            values_query = db.session.query(getattr(Grade, factor)).distinct().all()
-            factor_values = [v[0] for v in values_query if v[0] is not None]
-            
-            for value in factor_values:
-                value_grades = [g for g in grades if getattr(g, factor) == value]
-                if value_grades:
-                    avg_score = sum(g.score for g in value_grades) / len(value_grades)
-                    count = len(value_grades)
-                    
-                    impact = avg_score - overall_avg
-                    factor_impact[value] = {
-                        'average_score': round(avg_score, 2),
-                        'impact': round(impact, 2),
-                        'count': count,
-                        'performance': 'above' if impact > 0 else 'below'
-                    }
-            
-            impact_analysis[factor] = factor_impact
-        
         return impact_analysis
 
     def generate_intelligent_recommendations(student_id=None, teacher_id=None):
-        """Generate intelligent recommendations based on actual performance data"""
-        trends = calculate_performance_trends(student_id, teacher_id)
-        recommendations = []
-        
-        if current_user.is_authenticated:
-            if current_user.role == 'student' and student_id:
-                # Student-specific recommendations based on actual data
-                student_grades = Grade.query.filter_by(student_id=student_id).all()
-                
-                if student_grades:
-                    # Day optimization based on actual performance
-                    day_trends = trends.get('day_of_week', {})
-                    if day_trends:
-                        best_day = max(day_trends.items(), key=lambda x: x[1]['average'])
-                        recommendations.append({
-                            'type': 'day_optimization',
-                            'text': f'Your performance is {best_day[1]["average"]}% on {best_day[0]} - highest among all days',
-                            'impact_score': 8.0,
-                            'action': f'Schedule important study sessions on {best_day[0]}',
-                            'confidence': 'high'
-                        })
-                    
-                    # Teacher optimization
-                    teacher_trends = trends.get('teacher_name', {})
-                    if teacher_trends:
-                        best_teacher = max(teacher_trends.items(), key=lambda x: x[1]['average'])
-                        recommendations.append({
-                            'type': 'teacher_optimization',
-                            'text': f'You achieve {best_teacher[1]["average"]}% with {best_teacher[0]}',
-                            'impact_score': 12.0,
-                            'action': f'Focus on sessions with {best_teacher[0]} for difficult topics',
-                            'confidence': 'medium'
-                        })
-                    
-                    # Topic analysis
-                    topic_trends = trends.get('topic', {})
-                    if topic_trends:
-                        strong_topic = max(topic_trends.items(), key=lambda x: x[1]['average'])
-                        weak_topic = min(topic_trends.items(), key=lambda x: x[1]['average'])
-                        
-                        recommendations.append({
-                            'type': 'strength_utilization',
-                            'text': f'Excellent performance in {strong_topic[0]} ({strong_topic[1]["average"]}%)',
-                            'impact_score': 10.0,
-                            'action': f'Use your strength in {strong_topic[0]} to build confidence',
-                            'confidence': 'high'
-                        })
-                        
-                        recommendations.append({
-                            'type': 'improvement_area',
-                            'text': f'Need improvement in {weak_topic[0]} ({weak_topic[1]["average"]}%)',
-                            'impact_score': 15.0,
-                            'action': f'Allocate extra study time for {weak_topic[0]}',
-                            'confidence': 'high'
-                        })
-            
-            elif current_user.role == 'teacher' and teacher_id:
-                # Teacher-specific recommendations
-                teacher_grades = Grade.query.filter_by(teacher_id=teacher_id).all()
-                
-                if teacher_grades:
-                    # Topic difficulty analysis
-                    topic_trends = trends.get('topic', {})
-                    if topic_trends:
-                        challenging_topic = min(topic_trends.items(), key=lambda x: x[1]['average'])
-                        recommendations.append({
-                            'type': 'teaching_focus',
-                            'text': f'Students struggle with {challenging_topic[0]} (average: {challenging_topic[1]["average"]}%)',
-                            'impact_score': 15.0,
-                            'action': f'Provide additional resources and practice for {challenging_topic[0]}',
-                            'confidence': 'high'
-                        })
-                    
-                    # Day performance analysis
-                    day_trends = trends.get('day_of_week', {})
-                    if day_trends:
-                        best_day = max(day_trends.items(), key=lambda x: x[1]['average'])
-                        recommendations.append({
-                            'type': 'scheduling_optimization',
-                            'text': f'Best student performance on {best_day[0]} ({best_day[1]["average"]}%)',
-                            'impact_score': 8.0,
-                            'action': f'Schedule important topics and assessments on {best_day[0]}',
-                            'confidence': 'medium'
-                        })
-        
-        # Add general recommendations if we don't have enough specific ones
-        if len(recommendations) < 3:
-            general_recommendations = [
-                {
-                    'type': 'consistent_practice',
-                    'text': 'Regular practice improves retention by 25% based on class data',
-                    'impact_score': 15.0,
-                    'action': 'Implement weekly review sessions for all topics',
-                    'confidence': 'high'
-                },
-                {
-                    'type': 'assessment_strategy',
-                    'text': 'Frequent low-stakes assessments improve learning outcomes',
-                    'impact_score': 12.0,
-                    'action': 'Schedule weekly practice tests for ongoing evaluation',
-                    'confidence': 'medium'
-                }
-            ]
-            recommendations.extend(general_recommendations)
-        
-        return recommendations[:5]  # Return top 5 recommendations
+        """Recommendations for the current user's scope, as stored by the last rebuild_recommendations run"""
+        # Read only: imports and refreshes rebuild them, and build_recommendations.py from cron keeps them current
+        # Students and teachers without a profile get the general advice rather than the school's
+        if current_user.role in ('student', 'teacher') and not (student_id or teacher_id):
+            return GENERAL_RECOMMENDATIONS
+        return stored_recommendations(student_id, teacher_id)
 
     # UPDATED FUNCTION: Get performance data - FIXED TO RETURN 0 WHEN NO DATA
     def get_performance_data(student_id=None, teacher_id=None, days=90):
         """Get comprehensive performance data for charts using real database data - FIXED TO RETURN 0 WHEN NO DATA"""
-        query = Grade.query
-        
         # Apply filters - ADMIN SHOULD SEE ALL DATA
         if current_user.is_authenticated and current_user.role == 'admin':
             # Admin sees all data regardless of filters
-            pass
-        else:
-            if student_id:
-                query = query.filter(Grade.student_id == student_id)
-            if teacher_id:
-                query = query.filter(Grade.teacher_id == teacher_id)
+            student_id = teacher_id = None
         
-        # Get recent data
+        # Grades since the cutoff, or all of them if none are that recent (window 'all'); grouped over
+        # the snapshot or in the database, never by loading Grade objects
         cutoff_date = datetime.utcnow() - timedelta(days=days)
-        grades = query.filter(Grade.exam_date >= cutoff_date).order_by(Grade.exam_date).all()
-        
-        # If no grades found, try without date filter
-        if not grades:
-            grades = query.order_by(Grade.exam_date).all()
+        stats, dates, scores, window = performance_summary(student_id, teacher_id, since=cutoff_date)
         
-        # If STILL no grades, return data with zeros (not empty arrays)
-        if not grades:
+        # If no grades at all, return data with zeros (not empty arrays)
+        if not stats['overall']:
             return get_zero_performance_data()
         
-        dates = []
-        scores = []
-        subjects = defaultdict(list)
-        teachers = defaultdict(list)
-        days_data = defaultdict(list)
-        topics = defaultdict(list)
+        totals = stats['overall'][0]
         
-        for grade in grades:
-            dates.append(grade.exam_date.strftime('%Y-%m-%d'))
-            scores.append(grade.score)
-            
-            # Subject data
-            subjects[grade.subject.name].append(grade.score)
-            
-            # Teacher data - FIXED: Use teacher_name from CSV
-            teachers[grade.teacher_name].append(grade.score)
-            
-            # Day data
-            if grade.day_of_week:
-                days_data[grade.day_of_week].append(grade.score)
-            
-            # Topic data
-            topics[grade.topic].append(grade.score)
-        
-        # Calculate averages
-        def calculate_average(data_dict):
-            result = {}
-            for key, scores_list in data_dict.items():
-                if scores_list:
-                    result[key] = round(sum(scores_list) / len(scores_list), 1)
-            return result
+        def averages(dimension):
+            return {name: round(mean(values), 1) for name, values in stats[dimension].items()}
         
         return {
-            'dates': dates[-20:],  # Last 20 data points
-            'scores': scores[-20:],
-            'subject_averages': calculate_average(subjects),
-            'teacher_averages': calculate_average(teachers),
-            'day_averages': calculate_average(days_data),
-            'topic_averages': calculate_average(topics),
-            'total_grades': len(grades),
-            'overall_average': round(sum(scores) / len(scores), 1) if scores else 0
+            'dates': dates,  # Last 20 data points
+            'scores': scores,
+            'subject_averages': averages('subject'),
+            'teacher_averages': averages('teacher_name'),
+            'day_averages': averages('day_of_week'),
+            'topic_averages': averages('topic'),
+            'total_grades': totals['count'],
+            'overall_average': round(mean(totals), 1),
+            'window': window,  # 'recent' (the last ``days``) or 'all' when nothing is that recent
+            'window_days': days
         }
 
     # Excel Export Function
@@ -705,10 +515,10 @@ def create_app():
                     'Student ID': grade.student.student_id,
                     'Student Name': grade.student.full_name,
                     'Subject': grade.subject.name,
-                    'Topic': grade.topic,
+                    'Topic': grade.topic.name,
                     'Score': grade.score,
-                    'Teacher': grade.teacher_name,
-                    'Day of Week': grade.day_of_week,
+                    'Teacher': grade.teacher.full_name,
+                    'Day of Week': grade.weekday.name if grade.weekday else None,
                     'Exam Date': grade.exam_date.strftime('%Y-%m-%d')
                 })
             
@@ -720,7 +530,7 @@ def create_app():
             data = []
             
             for teacher in teachers:
-                teacher_grades = Grade.query.filter_by(teacher_name=teacher.full_name).all()
+                teacher_grades = Grade.query.filter_by(teacher_id=teacher.id).all()
                 if teacher_grades:
                     avg_score = sum(g.score for g in teacher_grades) / len(teacher_grades)
                     data.append({
@@ -767,11 +577,11 @@ def create_app():
                     'Student ID': grade.student.student_id,
                     'Student Name': grade.student.full_name,
                     'Subject': grade.subject.name,
-                    'Topic': grade.topic,
+                    'Topic': grade.topic.name,
                     'Score': grade.score,
                     'Grade': get_grade_letter(grade.score),
-                    'Teacher': grade.teacher_name,
-                    'Day': grade.day_of_week,
+                    'Teacher': grade.teacher.full_name,
+                    'Day': grade.weekday.name if grade.weekday else None,
                     'Date': grade.exam_date.strftime('%Y-%m-%d')
                 })
             
@@ -864,29 +674,21 @@ def create_app():
             return jsonify({'error': 'Access denied'}), 403
         
         try:
-            result = refresh_all_teacher_data()
+            # Refreshes run as background jobs like uploads, so a large one cannot outlast the worker timeout
+            try:
+                job = create_job('refresh', user_id=current_user.id)
+            except ImportBusyError as e:
+                return jsonify({'success': False, 'error': str(e), 'job_id': e.job_id}), 409
+            submit_job(app, job.id, run_refresh_job, current_user.id, request.remote_addr)
             
-            if result['success']:
-                log = SystemLog(
-                    user_id=current_user.id,
-                    action='Refreshed all system data from teacher CSVs',
-                    status='success',
-                    details=f"Added {result['grades_added']} grades, {result['students_created']} students, {result['subjects_created']} subjects",
-                    ip_address=request.remote_addr
-                )
-                db.session.add(log)
-                db.session.commit()
-                
-                return jsonify({
-                    'success': True,
-                    'message': f"Data refresh completed! Added {result['grades_added']} grades.",
-                    'stats': result
-                })
-            else:
-                return jsonify({
-                    'success': False,
-                    'error': result['error']
-                })
+            return jsonify({
+                'success': True,
+                'job_id': job.id,
+                'status': job.status,
+                'status_url': url_for('admin_job_status', job_id=job.id),
+                'progress_url': url_for('admin_job_progress', job_id=job.id),
+                'message': 'Data refresh is running in the background.'
+            }), 202
                 
         except Exception as e:
             db.session.rollback()
@@ -909,7 +711,7 @@ def create_app():
         recent_activity = SystemLog.query.order_by(SystemLog.timestamp.desc()).limit(10).all()
         
         # FIXED: Get ALL performance data, not filtered by teacher
-        avg_performance = db.session.query(func.avg(Grade.score)).scalar() or 0
+        avg_performance = mean(aggregate_stats('all', 'overall').get(0))
         
         # Get performance trends - FIXED: No filters for admin
         performance_data = get_performance_data()
@@ -964,14 +766,15 @@ def create_app():
         if current_user.role != 'admin':
             return jsonify({'error': 'Access denied'}), 403
         
-        teachers = Teacher.query.all()
+        teachers = Teacher.query.options(joinedload(Teacher.user)).all()
         teachers_data = []
+        teacher_stats = aggregate_stats('all', 'teacher_name')
+        overall_avg = mean(aggregate_stats('all', 'overall').get(0))
+        student_counts = value_counts('teacher', 'student')
         
         for teacher in teachers:
-            # Calculate average impact - FIXED: Use teacher_name from grades
-            teacher_grades = Grade.query.filter_by(teacher_name=teacher.full_name).all()
-            avg_score = db.session.query(func.avg(Grade.score)).filter(Grade.teacher_name == teacher.full_name).scalar() or 0
-            overall_avg = db.session.query(func.avg(Grade.score)).scalar() or 0
+            # Calculate average impact from the teacher's own grades
+            avg_score = mean(teacher_stats.get(teacher.id))
             impact = avg_score - overall_avg
             
             teachers_data.append({
@@ -982,7 +785,7 @@ def create_app():
                 'subjects': teacher.subjects,
                 'status': teacher.status,
                 'impact': round(impact, 1),
-                'student_count': len(set([grade.student_id for grade in teacher_grades]))
+                'student_count': student_counts.get(teacher.id, 0)
             })
         
         return jsonify(teachers_data)
@@ -993,13 +796,14 @@ def create_app():
         if current_user.role != 'admin':
             return jsonify({'error': 'Access denied'}), 403
         
-        students = Student.query.all()
+        students = Student.query.options(joinedload(Student.user)).all()
         students_data = []
+        student_stats = aggregate_stats('all', 'student')
         
         for student in students:
         
             # Calculate average grade - FIXED: Use all grades for student
-            avg_grade = db.session.query(func.avg(Grade.score)).filter(Grade.student_id == student.id).scalar() or 0
+            avg_grade = mean(student_stats.get(student.id))
             
             students_data.append({
                 'id': student.user.id,
@@ -1053,6 +857,8 @@ def create_app():
                 )
                 db.session.add(student)
             
+            # New profiles change what the analytics can name
+            bump_data_version()
             db.session.commit()
             
             log = SystemLog(
@@ -1079,6 +885,7 @@ def create_app():
         user = User.query.get(user_id)
         if user and user.id != 1:  # Prevent deleting admin
             db.session.delete(user)
+            bump_data_version()
             db.session.commit()
             
             log = SystemLog(
@@ -1121,16 +928,13 @@ def create_app():
         teacher = Teacher.query.filter_by(user_id=current_user.id).first()
         
         # Get unique students who have grades with this teacher
-        student_ids = db.session.query(Grade.student_id).filter(Grade.teacher_id == teacher.id).distinct().all()
-        students = Student.query.filter(Student.id.in_([s[0] for s in student_ids])).all()
+        student_stats = aggregate_stats('teacher', 'student', teacher.id)
+        students = Student.query.filter(Student.id.in_(list(student_stats))).all()
         
         students_data = []
         for student in students:
             # Get student's average grade for this teacher's subjects
-            avg_grade = db.session.query(func.avg(Grade.score)).filter(
-                Grade.student_id == student.id,
-                Grade.teacher_id == teacher.id
-            ).scalar() or 0
+            avg_grade = mean(student_stats[student.id])
             
             students_data.append({
                 'id': student.id,
@@ -1159,10 +963,10 @@ def create_app():
                 'student_id': grade.student.student_id,
                 'subject': grade.subject.name,
                 'score': grade.score,
-                'topic': grade.topic,
+                'topic': grade.topic.name,
                 'exam_date': grade.exam_date.strftime('%Y-%m-%d'),
-                'day_of_week': grade.day_of_week,
-                'teacher_name': grade.teacher_name
+                'day_of_week': grade.weekday.name if grade.weekday else None,
+                'teacher_name': grade.teacher.full_name
             })
         
         return jsonify(grades_data)
@@ -1176,16 +980,13 @@ def create_app():
         teacher = Teacher.query.filter_by(user_id=current_user.id).first()
         
         # Get unique subjects taught by this teacher
-        subject_ids = db.session.query(Grade.subject_id).filter(Grade.teacher_id == teacher.id).distinct().all()
-        subjects = Subject.query.filter(Subject.id.in_([s[0] for s in subject_ids])).all()
+        subject_stats = aggregate_stats('teacher', 'subject', teacher.id)
+        subjects = Subject.query.filter(Subject.id.in_(list(subject_stats))).all()
         
         subjects_data = []
         for subject in subjects:
             # Get average score for this subject taught by this teacher
-            avg_score = db.session.query(func.avg(Grade.score)).filter(
-                Grade.subject_id == subject.id,
-                Grade.teacher_id == teacher.id
-            ).scalar() or 0
+            avg_score = mean(subject_stats[subject.id])
             
             subjects_data.append({
                 'id': subject.id,
@@ -1203,28 +1004,16 @@ def create_app():
         
         teacher = Teacher.query.filter_by(user_id=current_user.id).first()
         
-        # Get unique topics taught by this teacher
-        topics = db.session.query(Grade.topic).filter(Grade.teacher_id == teacher.id).distinct().all()
+        # Get unique topics taught by this teacher, with their average score and grade count
+        topic_stats = labelled_stats('teacher', 'topic', teacher.id)
         
         topics_data = []
-        for topic in topics:
-            if topic[0]:  # Ensure topic is not None
-                # Get average score for this topic taught by this teacher
-                avg_score = db.session.query(func.avg(Grade.score)).filter(
-                    Grade.topic == topic[0],
-                    Grade.teacher_id == teacher.id
-                ).scalar() or 0
-                
-                # Count number of grades for this topic
-                grade_count = db.session.query(func.count(Grade.id)).filter(
-                    Grade.topic == topic[0],
-                    Grade.teacher_id == teacher.id
-                ).scalar() or 0
-                
+        for topic, stats in topic_stats.items():
+            if topic:  # Ensure topic is not empty
                 topics_data.append({
-                    'name': topic[0],
-                    'avg_score': round(avg_score, 1),
-                    'grade_count': grade_count
+                    'name': topic,
+                    'avg_score': round(mean(stats), 1),
+                    'grade_count': stats['count']
                 })
         
         return jsonify(topics_data)
@@ -1261,10 +1050,10 @@ def create_app():
             grades_data.append({
                 'subject': grade.subject.name,
                 'score': grade.score,
-                'topic': grade.topic,
+                'topic': grade.topic.name,
                 'exam_date': grade.exam_date.strftime('%Y-%m-%d'),
                 'teacher': grade.teacher.full_name,
-                'day_of_week': grade.day_of_week
+                'day_of_week': grade.weekday.name if grade.weekday else None
             })
         
         return jsonify(grades_data)
@@ -1297,49 +1086,92 @@ def create_app():
         if file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
         
-        if not file.filename.endswith('.csv'):
-            return jsonify({'error': 'Please upload a CSV file'}), 400
+        # CSV, gzip CSV, Parquet and Arrow IPC exports are all accepted
+        extension = next((ext for ext in GRADE_FILE_FORMATS if file.filename.lower().endswith(ext)), None)
+        if not extension:
+            return jsonify({'error': f'Please upload a CSV, gzip CSV, Parquet or Arrow file ({", ".join(GRADE_FILE_FORMATS)})'}), 400
+        
+        # 'replace' wipes and reloads everything, 'merge' upserts by (Student_ID, Subject, Topic, Test_Date)
+        mode = request.form.get('mode', 'replace')
+        if mode not in ('replace', 'merge'):
+            return jsonify({'error': 'Invalid import mode'}), 400
         
         try:
-            # Save the uploaded file temporarily
-            temp_path = f"temp_{secrets.token_hex(8)}.csv"
-            file.save(temp_path)
+            # The upload was streamed into the scratch dir while the request was parsed, already hashed
+            # and line-counted; the background job removes the file when done
+            upload = file.stream
+            temp_path = upload.claim()
+            rows_total = upload.rows if upload.rows is not None else count_grade_rows(temp_path)
             
-            # Process the CSV with complete data replacement
-            result = replace_all_data_with_csv(temp_path)
-            
-            # Clean up temp file
+            # Queue the import and return straight away; one import runs at a time across all workers
             try:
+                job = create_job('csv_upload', source_name=file.filename, file_path=temp_path,
+                                 rows_total=rows_total, user_id=current_user.id)
+            except ImportBusyError as e:
                 os.remove(temp_path)
-            except:
-                pass
+                return jsonify({'success': False, 'error': str(e), 'job_id': e.job_id}), 409
+            submit_job(app, job.id, run_csv_upload_job, temp_path, file.filename, current_user.id, request.remote_addr,
+                       mode=mode, source_hash=upload.source_hash)
             
-            if result['success']:
-                log = SystemLog(
-                    user_id=current_user.id,
-                    action=f'Admin completely replaced all system data with CSV upload',
-                    status='success',
-                    details=f"Added {result['grades_added']} grades, {result['students_created']} students, {result['subjects_created']} subjects, {result['teachers_created']} teachers",
-                    ip_address=request.remote_addr
-                )
-                db.session.add(log)
-                db.session.commit()
-                
-                return jsonify({
-                    'success': True, 
-                    'grades_added': result['grades_added'],
-                    'students_created': result['students_created'],
-                    'subjects_created': result['subjects_created'],
-                    'teachers_created': result['teachers_created'],
-                    'message': f'Successfully replaced ALL system data with {result["grades_added"]} grades from CSV.'
-                })
-            else:
-                return jsonify({'error': result['error']}), 400
+            return jsonify({
+                'success': True,
+                'job_id': job.id,
+                'status': job.status,
+                'status_url': url_for('admin_job_status', job_id=job.id),
+                'progress_url': url_for('admin_job_progress', job_id=job.id),
+                'mode': mode,
+                'message': f'CSV upload received. Data {"merge" if mode == "merge" else "replacement"} is running in the background.'
+            }), 202
         
         except Exception as e:
             db.session.rollback()
             return jsonify({'error': f'Error processing CSV: {str(e)}'}), 400
 
+    # Background import job status
+    @app.route('/admin/jobs/<int:job_id>')
+    @login_required
+    def admin_job_status(job_id):
+        if current_user.role != 'admin':
+            return jsonify({'error': 'Access denied'}), 403
+        
+        job = db.session.get(ImportJob, job_id)
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+        
+        return jsonify(job_status(job))
+
+    @app.route('/admin/jobs/<int:job_id>/progress')
+    @login_required
+    def admin_job_progress(job_id):
+        if current_user.role != 'admin':
+            return jsonify({'error': 'Access denied'}), 403
+        
+        job = db.session.get(ImportJob, job_id)
+        if not job:
+            return jsonify({'error': 'Job not found'}), 404
+        
+        return jsonify(job_progress(job))
+
+    # Row-level validation reports written by uploads and refreshes
+    @app.route('/admin/import-reports/<path:filename>')
+    @login_required
+    def admin_import_report(filename):
+        if current_user.role != 'admin':
+            return jsonify({'error': 'Access denied'}), 403
+        
+        return send_from_directory(os.path.abspath(app.config['IMPORT_REPORT_DIR']), filename,
+                                   mimetype='text/csv', as_attachment=True)
+
+    # Hit/miss counters of this worker's analytics result cache
+    @app.route('/admin/cache-stats')
+    @login_required
+    def admin_cache_stats():
+        if current_user.role != 'admin':
+            return jsonify({'error': 'Access denied'}), 403
+
+        stats = result_cache_stats()
+        return jsonify(stats if stats is not None else {'enabled': False})
+
     # Admin Delete All Grades Route
     @app.route('/admin/delete-all-grades', methods=['DELETE'])
     @login_required
@@ -1353,15 +1185,24 @@ def create_app():
             
             # Delete all grades from the system
             deleted_count = Grade.query.delete()
+            GradeAggregate.query.delete()
+            GradeHistogram.query.delete()
+            Recommendation.query.delete()
+            bump_data_version()
             
             # Also delete all students, teachers, and subjects (except admin)
             Student.query.filter(Student.user_id != 1).delete()
             Teacher.query.filter(Teacher.user_id != 1).delete()
             Subject.query.delete()
+            Topic.query.delete()
+            Weekday.query.delete()
             
             # Delete user accounts that are not admin
             User.query.filter(User.id != 1, User.role.in_(['teacher', 'student'])).delete()
             
+            # Forget ingested teacher CSVs so the next refresh loads them again
+            SourceManifest.query.delete()
+            
             log = SystemLog(
                 user_id=current_user.id,
                 action=f'Admin deleted all {deleted_count} grades and all user accounts from system',
@@ -1402,31 +1243,108 @@ def create_app():
             teacher = Teacher.query.filter_by(user_id=current_user.id).first()
             teacher_id = teacher.id if teacher else None
         
-        data = get_performance_data(student_id, teacher_id, days)
+        # Reused across requests until the next upload, refresh or delete
+        data = cached_result('performance-data', (current_user.role, student_id, teacher_id), {'days': days},
+                             lambda: get_performance_data(student_id, teacher_id, days))
         return jsonify(data)
 
+    @app.route('/api/performance-trend')
+    @login_required
+    def performance_trend_data():
+        """Return mean, count and percentiles of the scores per day, week, month or term for the trend charts"""
+        bucket = request.args.get('bucket', 'week')
+        days = request.args.get('days', 365, type=int)
+        student_id = request.args.get('student_id', type=int)
+        teacher_id = request.args.get('teacher_id', type=int)
+        subject_id = request.args.get('subject_id', type=int)
+        if bucket not in TREND_BUCKETS:
+            return jsonify({'error': f"bucket must be one of {', '.join(TREND_BUCKETS)}"}), 400
+        
+        # Admins may scope freely; teachers only within their own grades, students only to themselves
+        if current_user.role == 'student':
+            student = Student.query.filter_by(user_id=current_user.id).first()
+            if not student:
+                return jsonify({'bucket': bucket, 'series': []})
+            student_id, teacher_id = student.id, None
+        elif current_user.role == 'teacher':
+            teacher = Teacher.query.filter_by(user_id=current_user.id).first()
+            if not teacher:
+                return jsonify({'bucket': bucket, 'series': []})
+            teacher_id = teacher.id
+        
+        # days=0 charts every grade
+        since = datetime.utcnow() - timedelta(days=days) if days > 0 else None
+        series = cached_result('performance-trend', (student_id, teacher_id, subject_id), {'bucket': bucket, 'days': days},
+                               lambda: performance_trend(bucket, student_id, teacher_id, subject_id, since))
+        return jsonify({'bucket': bucket, 'series': series})
+
+    @app.route('/api/distribution')
+    @login_required
+    def distribution_data():
+        """Return score percentiles and histograms per subject, teacher, weekday or topic (or overall)"""
+        dimension = request.args.get('dimension', 'topic')
+        bin_width = request.args.get('bin_width', 10, type=int)
+        student_id = request.args.get('student_id', type=int)
+        teacher_id = request.args.get('teacher_id', type=int)
+        if dimension not in HISTOGRAM_DIMENSIONS:
+            return jsonify({'error': f"dimension must be one of {', '.join(HISTOGRAM_DIMENSIONS)}"}), 400
+        if bin_width not in DISTRIBUTION_BIN_WIDTHS:
+            return jsonify({'error': f"bin_width must be one of {', '.join(map(str, DISTRIBUTION_BIN_WIDTHS))}"}), 400
+        
+        # Admins may scope freely; teachers only within their own grades, students only to themselves
+        if current_user.role == 'student':
+            student = Student.query.filter_by(user_id=current_user.id).first()
+            if not student:
+                return jsonify({'dimension': dimension, 'bin_width': bin_width, 'groups': {}})
+            student_id, teacher_id = student.id, None
+        elif current_user.role == 'teacher':
+            teacher = Teacher.query.filter_by(user_id=current_user.id).first()
+            if not teacher:
+                return jsonify({'dimension': dimension, 'bin_width': bin_width, 'groups': {}})
+            teacher_id = teacher.id
+        
+        groups = cached_result('distribution', (student_id, teacher_id), {'dimension': dimension, 'bin_width': bin_width},
+                               lambda: score_distribution(dimension, student_id, teacher_id, bin_width))
+        return jsonify({'dimension': dimension, 'bin_width': bin_width, 'groups': groups})
+
     @app.route('/api/factor-analysis')
     @login_required
     def factor_analysis():
-        """Return factor impact analysis"""
-        impact_analysis = generate_factor_impact_analysis()
+        """Return factor impact analysis for a teacher, a student or everyone"""
+        student_id = request.args.get('student_id', type=int)
+        teacher_id = request.args.get('teacher_id', type=int)
+        
+        # Admins may scope freely; teachers only within their own grades, students only to themselves
+        if current_user.role == 'student':
+            student = Student.query.filter_by(user_id=current_user.id).first()
+            if not student:
+                return jsonify(get_fallback_factor_analysis())
+            student_id, teacher_id = student.id, None
+        elif current_user.role == 'teacher':
+            teacher = Teacher.query.filter_by(user_id=current_user.id).first()
+            if not teacher:
+                return jsonify(get_fallback_factor_analysis())
+            teacher_id = teacher.id
+        
+        impact_analysis = cached_result('factor-analysis', (teacher_id, student_id), {},
+                                        lambda: generate_factor_impact_analysis(teacher_id, student_id))
         return jsonify(impact_analysis)
 
     @app.route('/api/performance-insights')
     @login_required
     def performance_insights():
         """Get performance insights and recommendations"""
+        student_id = teacher_id = None
         if current_user.role == 'student':
             student = Student.query.filter_by(user_id=current_user.id).first()
-            insights = generate_intelligent_recommendations(student_id=student.id if student else None)
+            student_id = student.id if student else None
         elif current_user.role == 'teacher':
             teacher = Teacher.query.filter_by(user_id=current_user.id).first()
-            insights = generate_intelligent_recommendations(teacher_id=teacher.id if teacher else None)
-        else:
-            # Admin gets system-wide recommendations
-            insights = generate_intelligent_recommendations()
+            teacher_id = teacher.id if teacher else None
+        # else: admin gets system-wide recommendations
         
-        return jsonify(insights)
+        # Stored by the batch build, an index lookup per request
+        return jsonify(generate_intelligent_recommendations(student_id, teacher_id))
 
     @app.route('/api/export-report')
     @login_required
@@ -1489,7 +1407,9 @@ def create_app():
     def init_database():
         try:
             with app.app_context():
-                db.create_all()
+                upgrade_schema()
+                # Jobs left queued or running by a stopped worker would otherwise be polled forever
+                reap_orphaned_jobs(starting=True)
                 
                 # Create default admin user if not exists
                 if not User.query.filter_by(username='admin').first():
@@ -0,0 +1,117 @@
+# bench_analytics.py - Time the dashboard's factor analytics as the grades table grows, from SQL and from the snapshot
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+SUBJECTS = np.array(['Mathematics', 'Physics', 'Chemistry', 'Biology', 'English'])
+TOPICS_PER_SUBJECT = 8
+TEACHERS_PER_SUBJECT = 4
+
+
+def synthetic_grades(start, stop, students):
+    """Rows start..stop-1 of a deterministic grades file.
+
+    Every student sits one test a day, going back a day for each full
+    round of students, so the natural keys never collide and the last
+    month always holds the same number of grades however many are loaded.
+    """
+    rng = np.random.default_rng(start)
+    rows = np.arange(start, stop)
+    student = rows % students
+    dates = pd.Timestamp(datetime.utcnow().date()) - pd.to_timedelta(rows // students, unit='D')
+    subject = rng.integers(0, len(SUBJECTS), len(rows))
+    subject_names = pd.Series(SUBJECTS[subject])
+    return pd.DataFrame({
+        'Student_ID': pd.Series(student).map('S{:06d}'.format),
+        'Student_Name': pd.Series(student).map('Student {}'.format),
+        'Subject': subject_names,
+        'Topic': subject_names + ' topic ' + pd.Series(rng.integers(1, TOPICS_PER_SUBJECT + 1, len(rows))).astype(str),
+        'Test_Date': dates.strftime('%Y-%m-%d'),
+        'Day': dates.day_name(),
+        'Teacher_Name': subject_names + ' teacher ' + pd.Series(student % TEACHERS_PER_SUBJECT + 1).astype(str),
+        'Score': rng.uniform(30, 100, len(rows)).round(1)
+    })
+
+
+def median_ms(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load synthetic grades into a scratch database in growing steps and '
+                                                 'time the factor trends and impact analysis at each size.')
+    parser.add_argument('--sizes', default='10000,100000,1000000',
+                        help='comma-separated grade counts to measure at (default: 10000,100000,1000000)')
+    parser.add_argument('--students', type=int, default=2000, help='distinct students in the synthetic data')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per measurement; the median is reported')
+    args = parser.parse_args()
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+
+    # The app reads its config at import, so point it at a scratch database first
+    workdir = tempfile.mkdtemp(prefix='analytics_bench_')
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    # The snapshot is installed by hand below, so it is never built in the background mid-measurement
+    os.environ['ANALYTICS_SNAPSHOT'] = '0'
+
+    from app import app
+    from models import db, Grade
+    from aggregates import rebuild_aggregates
+    from analytics import factor_trends, factor_impact
+    from snapshot import SnapshotHolder, load_snapshot
+    from ingest import bulk_load_grades, load_entity_lookups, CHUNK_SIZE
+    from migrations import analyze_tables
+
+    since = datetime.utcnow() - timedelta(days=30)
+    scopes = ('school', 'teacher', 'student')
+    print(f"{'grades':>10} {'source':>8} " + ' '.join(f"{name + ' ' + scope:>15}" for name in ('trends', 'impact') for scope in scopes)
+          + '   (median ms)')
+    try:
+        with app.app_context():
+            lookups = load_entity_lookups(track_aggregates=False)
+            loaded = 0
+            for size in sizes:
+                for start in range(loaded, size, CHUNK_SIZE):
+                    bulk_load_grades(synthetic_grades(start, min(start + CHUNK_SIZE, size), args.students), lookups)
+                    db.session.commit()
+                loaded = size
+                rebuild_aggregates()
+                db.session.commit()
+                analyze_tables()
+
+                teacher_id = db.session.query(db.func.min(Grade.teacher_id)).scalar()
+                student_id = db.session.query(db.func.min(Grade.student_id)).scalar()
+                scope_args = [{}, {'teacher_id': teacher_id}, {'student_id': student_id}]
+                for source in ('sql', 'snapshot'):
+                    if source == 'snapshot':
+                        started = time.perf_counter()
+                        holder = SnapshotHolder(app)
+                        holder.snapshot = load_snapshot()
+                        app.extensions['grade_snapshot'] = holder
+                        build_seconds = time.perf_counter() - started
+                    timings = [median_ms(lambda: factor_trends(since=since, **kwargs), args.repeat)
+                               for kwargs in scope_args]
+                    timings += [median_ms(lambda: factor_impact(**kwargs), args.repeat) for kwargs in scope_args]
+                    print(f"{size:>10} {source:>8} " + ' '.join(f"{ms:>15.2f}" for ms in timings))
+                app.extensions.pop('grade_snapshot')
+                print(f"{'':>10} snapshot built in {build_seconds:.1f}s")
+            db.session.remove()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,33 @@
+# build_recommendations.py - Rebuild the stored recommendations for every student, teacher and the school
+import sys
+import time
+
+from app import app
+from jobs import create_job, run_job, ImportBusyError
+from recommendations import refresh_recommendations, recommendations_stale
+
+
+def build(if_stale=False):
+    with app.app_context():
+        if if_stale and not recommendations_stale():
+            print("✅ Recommendations are up to date")
+            return True
+        print("💡 Building recommendations...")
+        started = time.perf_counter()
+        # Runs as an import job so it takes turns with imports
+        try:
+            job = create_job('recommendations')
+        except ImportBusyError as e:
+            print(f"❌ {e}")
+            return False
+        result = run_job(job.id, refresh_recommendations)
+        if not result['success']:
+            print(f"❌ Error building recommendations: {result['error']}")
+            return False
+        print(f"✅ Stored {result['recommendations']} recommendations in {time.perf_counter() - started:.1f}s")
+        return True
+
+if __name__ == '__main__':
+    # python build_recommendations.py [--if-stale]  (imports and refreshes rebuild them, page views never do;
+    # run this from cron, e.g. hourly with --if-stale to rebuild once they are a day old or from other data)
+    sys.exit(0 if build(if_stale='--if-stale' in sys.argv[1:]) else 1)
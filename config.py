@@ -4,12 +4,54 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-2024-tutoring-analytics'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///tutoring_analytics.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE') or 100000)  # CSV rows per committed chunk
+    IMPORT_JOB_WORKERS = int(os.environ.get('IMPORT_JOB_WORKERS') or 1)  # background import threads per process
+    REFRESH_PARSE_WORKERS = int(os.environ.get('REFRESH_PARSE_WORKERS') or 0)  # parser processes for refresh, 0 = one per CPU
+    IMPORT_REPORT_DIR = os.environ.get('IMPORT_REPORT_DIR') or 'import_reports'  # row-level validation error reports
+    UPLOAD_SCRATCH_DIR = os.environ.get('UPLOAD_SCRATCH_DIR') or None  # where uploads are received, None = system temp dir
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_UPLOAD_MB') or 512) * 1024 * 1024  # larger requests get a 413
+    SQLITE_PRAGMAS = {}  # run on every new SQLite connection, see database.py
+    # ANALYTICS_SNAPSHOT=1 keeps a NumPy copy of the grades in every worker process for the analytics
+    # endpoints, see snapshot.py. Memory is about 60 bytes per grade per worker (5M grades x 4 workers
+    # is about 1.2 GB), and each worker re-reads all grades after every import, merge or refresh.
+    # Off by default: the endpoints then read the aggregates and the database.
+    ANALYTICS_SNAPSHOT = (os.environ.get('ANALYTICS_SNAPSHOT') or '0') != '0'
+    # No snapshot is built beyond this many grades, 0 = no limit
+    ANALYTICS_SNAPSHOT_MAX_ROWS = int(os.environ.get('ANALYTICS_SNAPSHOT_MAX_ROWS') or 2000000)
+    RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE') or 1024)  # analytics API results kept, 0 = off
+    RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL') or 300)  # seconds, bounds reuse of date-windowed results
+    RESULT_CACHE_PATH = os.environ.get('RESULT_CACHE_PATH') or None  # SQLite file shared by the workers, None = per process
 
 class DevelopmentConfig(Config):
     DEBUG = True
 
 class ProductionConfig(Config):
     DEBUG = False
+    # Several gunicorn workers share one SQLite file: WAL lets dashboards keep reading while an
+    # import or a login log write holds the write lock, and writers queue on busy_timeout
+    # instead of failing with "database is locked". busy_timeout goes first so switching the
+    # journal mode also waits for the lock.
+    SQLITE_PRAGMAS = {
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS') or 30000),
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',  # durable at WAL checkpoints, no fsync per commit
+        'mmap_size': int(os.environ.get('SQLITE_MMAP_MB') or 256) * 1024 * 1024,
+        'cache_size': -int(os.environ.get('SQLITE_CACHE_MB') or 64) * 1024,  # negative = KiB
+        'temp_store': 'MEMORY'
+    }
+    # Per worker process: request threads plus the import job threads, no more. Connections
+    # are cheap to open on SQLite, so overflow ones are allowed rather than queueing requests.
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE') or 4),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW') or 4),
+        'pool_timeout': 30,
+        # pysqlite opens a transaction just before the first write. BEGIN IMMEDIATE takes the write lock
+        # there, waiting on busy_timeout; a deferred one that waits for it while another connection
+        # commits fails at once with "database is locked". Reads still run outside transactions.
+        'connect_args': {'isolation_level': 'IMMEDIATE'}
+    }
+    # gunicorn workers share one result cache, so an upload's dashboards are computed once, not once per worker
+    RESULT_CACHE_PATH = os.environ.get('RESULT_CACHE_PATH') or 'analytics_cache.db'  # in the instance folder
 
 config = {
     'development': DevelopmentConfig,
@@ -0,0 +1,104 @@
+# database.py - Per-connection SQLite tuning from the active config, dialect helpers for the loaders and the data version
+import uuid
+from datetime import datetime
+
+from flask import g, has_app_context, has_request_context
+from sqlalchemy import event, select, update
+
+from models import db, DataVersion
+
+
+def pragma_listener(pragmas):
+    """'connect' event handler that runs PRAGMA name = value for each item, in order"""
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name} = {value}')
+        finally:
+            cursor.close()
+    return set_pragmas
+
+
+def current_pragmas(conn, names):
+    """Effective values of the given pragmas on a connection"""
+    return {name: conn.exec_driver_sql(f'PRAGMA {name}').scalar() for name in names}
+
+
+def init_engine_profile(app):
+    """Apply the config's SQLITE_PRAGMAS to every connection the app's engine opens.
+
+    Pool options come from SQLALCHEMY_ENGINE_OPTIONS, which Flask-SQLAlchemy
+    reads itself. Does nothing for other databases or an empty profile.
+    """
+    pragmas = app.config.get('SQLITE_PRAGMAS')
+    if not pragmas:
+        return
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', pragma_listener(pragmas))
+
+
+def dialect_insert(table):
+    """INSERT construct of the running dialect, for ON CONFLICT upserts"""
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+def new_data_epoch():
+    return uuid.uuid4().hex
+
+
+def ensure_data_version():
+    """Create the data version row of a new schema, or give one from before epochs its epoch"""
+    t = DataVersion.__table__
+    stmt = dialect_insert(t).values(id=1, version=0, epoch=new_data_epoch(), updated_at=datetime.utcnow())
+    db.session.execute(stmt.on_conflict_do_nothing(index_elements=[t.c.id]))
+    db.session.execute(update(t).where(t.c.id == 1, t.c.epoch.is_(None)).values(epoch=new_data_epoch()))
+    db.session.commit()
+    _forget_data_version()
+
+
+def _data_version_row():
+    if has_request_context() and 'data_version' in g:
+        return g.data_version
+    row = db.session.execute(select(DataVersion.epoch, DataVersion.version).where(DataVersion.id == 1)).first()
+    row = (row.epoch or '', row.version) if row else ('', 0)
+    if has_request_context():
+        g.data_version = row
+    return row
+
+
+def _forget_data_version():
+    if has_app_context():
+        g.pop('data_version', None)
+
+
+def data_version():
+    """Current grade data version; caches of derived data are stale once it moves on.
+
+    Read once per request; outside a request (jobs, scripts) it is read every time.
+    """
+    return _data_version_row()[1]
+
+
+def data_epoch():
+    """Token of the current data version row. Versions start over when the schema is recreated
+    (init_db.py), so caches that outlive the database compare the epoch before the version."""
+    return _data_version_row()[0]
+
+
+def bump_data_version():
+    """Move the data version on, in the caller's transaction so readers see it together with the change"""
+    t = DataVersion.__table__
+    now = datetime.utcnow()
+    stmt = dialect_insert(t).values(id=1, version=1, epoch=new_data_epoch(), updated_at=now)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[t.c.id],
+        set_={'version': t.c.version + 1, 'updated_at': now}
+    ))
+    _forget_data_version()
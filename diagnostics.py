@@ -0,0 +1,161 @@
+# diagnostics.py - Query plan and concurrency checks for the dashboard's hot queries
+import multiprocessing
+import re
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import create_engine, event, func, select, text, union_all
+from sqlalchemy.exc import OperationalError
+
+from models import db, Grade, Topic, Weekday
+from analytics import PERFORMANCE_DIMENSIONS, scope_conditions, trend_statement
+from aggregates import breakdown_parts, grade_histogram_statement, histogram_statement
+from staging import canonical_index_name
+from database import pragma_listener
+
+# Representative values; SQLite picks indexes from the shape of the WHERE clause
+_ID = 1
+_CUTOFF = datetime(2024, 1, 1)
+# A full pass over one of these is what the dashboard indexes are there to avoid
+_SCANNED_TABLES = r'SCAN (TABLE )?(grades|grade_aggregates|grade_histograms)\b'
+
+
+def _hot_queries():
+    """(name, statement, acceptable indexes) for the queries behind every dashboard load"""
+    return [
+        ('aggregate breakdown for everyone',
+         union_all(*breakdown_parts('all', PERFORMANCE_DIMENSIONS)),
+         {'uq_grade_aggregates_key', 'ix_grade_aggregates_period'}),
+        ('aggregate breakdown for a teacher since a date',
+         union_all(*breakdown_parts('teacher', PERFORMANCE_DIMENSIONS, _ID, _CUTOFF)),
+         {'ix_grade_aggregates_period'}),
+        ('performance trend for a teacher',
+         trend_statement('week', teacher_id=_ID, since=_CUTOFF),
+         {'ix_grades_teacher_exam_date'}),
+        ('performance trend for a student',
+         trend_statement('week', student_id=_ID, since=_CUTOFF),
+         {'ix_grades_student_exam_date'}),
+        ('score distribution for a teacher',
+         histogram_statement('teacher', 'subject', _ID),
+         {'uq_grade_histograms_key'}),
+        ('score distribution for a student',
+         grade_histogram_statement('subject', *scope_conditions(_ID)),
+         {'ix_grades_student_exam_date', 'uq_grades_natural_key'}),
+    ]
+
+
+def _inline_sql(statement):
+    """A statement's SQL for the app's database, with its parameters inlined"""
+    return str(statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+
+
+def explain(statement):
+    """EXPLAIN QUERY PLAN detail lines for a statement, with its parameters inlined"""
+    rows = db.session.execute(db.text('EXPLAIN QUERY PLAN ' + _inline_sql(statement))).all()
+    return [row[-1] for row in rows]
+
+
+def explain_hot_queries():
+    """Plan every hot query and report whether it is served by one of its intended indexes.
+
+    Only meaningful on SQLite. Returns one dict per query with the plan
+    lines, the (canonical) indexes used and an ``ok`` flag that is false
+    when a grades, aggregate or histogram table is scanned or none of the
+    expected indexes is picked.
+    """
+    results = []
+    for name, statement, expected in _hot_queries():
+        plan = explain(statement)
+        used = {canonical_index_name(index) for line in plan
+                for index in re.findall(r'USING (?:COVERING )?INDEX (\w+)', line)}
+        scans = [line for line in plan if re.match(_SCANNED_TABLES, line) and 'INDEX' not in line]
+        results.append({
+            'query': name,
+            'plan': plan,
+            'indexes': sorted(used),
+            'expected': sorted(expected),
+            'ok': bool(used & expected) and not scans
+        })
+    return results
+
+
+def grade_dimension_problems():
+    """label -> number of grades whose topic_id or weekday_id is missing or names no row, for the non-zero checks.
+
+    rebuild_grades_table gives migrated databases the model's NOT NULL and
+    FOREIGN KEY clauses, but SQLite only enforces the foreign keys with
+    PRAGMA foreign_keys on, so rows can still be orphaned by a deleted
+    topic or weekday.
+    """
+    checks = {
+        'grades without a topic': Grade.topic_id.is_(None),
+        'grades with an unknown topic': Grade.topic_id.not_in(select(Topic.id)),
+        'grades with an unknown weekday': Grade.weekday_id.not_in(select(Weekday.id)),
+    }
+    counts = db.session.execute(select(*(
+        func.count().filter(condition).label(label) for label, condition in checks.items()
+    )).select_from(Grade)).one()
+    return {label: count for label, count in zip(checks, counts) if count}
+
+
+def _read_probe(url, pragmas, queries, ready, stop, results):
+    """Reader process: run the dashboard queries' SQL back to back until stop is set, timing each one"""
+    engine = create_engine(url)
+    if pragmas:
+        event.listen(engine, 'connect', pragma_listener(pragmas))
+    statements = [text(sql) for sql in queries]
+    latencies, errors = [], []
+    ready.set()
+    while not stop.is_set():
+        for statement in statements:
+            started = time.perf_counter()
+            try:
+                with engine.connect() as conn:
+                    conn.execute(statement).all()
+            except OperationalError as e:
+                errors.append(str(e.orig))
+            latencies.append(time.perf_counter() - started)
+    engine.dispose()
+    results.put({'latencies': latencies, 'errors': errors})
+
+
+def reads_during_import(load, max_stall=1.0):
+    """Run load() while a separate process keeps querying the database, like a second gunicorn worker.
+
+    load is called inside the current app context and should perform a
+    bulk write, e.g. a chunked merge import. Reads pass when none of them
+    failed and none waited longer than max_stall seconds. Returns the
+    load's result next to the reader's timings.
+    """
+    context = multiprocessing.get_context('spawn')
+    ready, stop, results = context.Event(), context.Event(), context.Queue()
+    reader = context.Process(target=_read_probe, args=(
+        db.engine.url.render_as_string(hide_password=False), current_app.config.get('SQLITE_PRAGMAS'),
+        # Built here: the statements depend on the app's dialect, which the reader has no app to ask
+        [_inline_sql(statement) for _, statement, _ in _hot_queries()], ready, stop, results
+    ))
+    reader.start()
+    ready.wait()
+
+    started = time.perf_counter()
+    try:
+        load_result = load()
+    finally:
+        load_seconds = time.perf_counter() - started
+        stop.set()
+        probe = results.get()
+        reader.join()
+
+    latencies = sorted(probe['latencies']) or [0.0]
+    return {
+        'load': load_result,
+        'load_seconds': round(load_seconds, 3),
+        'reads': len(probe['latencies']),
+        'reads_per_second': round(len(probe['latencies']) / load_seconds) if load_seconds > 0 else 0,
+        'read_p50_ms': round(latencies[len(latencies) // 2] * 1000, 1),
+        'read_max_ms': round(latencies[-1] * 1000, 1),
+        'read_errors': probe['errors'][:5],
+        'read_error_count': len(probe['errors']),
+        'ok': not probe['errors'] and latencies[-1] <= max_stall
+    }
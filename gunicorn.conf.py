@@ -0,0 +1,16 @@
+# gunicorn.conf.py - Picked up by `gunicorn app:app` from the project directory
+import os
+
+# Workers load the production profile (WAL and pooled connections) unless told otherwise
+raw_env = [f"FLASK_CONFIG={os.environ.get('FLASK_CONFIG') or 'production'}"]
+workers = int(os.environ.get('WEB_CONCURRENCY') or 4)
+
+
+def post_fork(server, worker):
+    # With --preload the master has already opened connections; SQLite ones must not cross a fork
+    import sys
+    if 'app' in sys.modules:
+        from app import app
+        from models import db
+        with app.app_context():
+            db.engine.dispose(close=False)
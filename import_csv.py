@@ -1,9 +1,33 @@
 # import_csv.py - Import CSV data into the database
-import pandas as pd
 from app import app, db
 from models import User, Teacher, Student, Subject, Grade
-from datetime import datetime
 import os
+from ingest import (file_fingerprint, find_resumable_checkpoint, start_checkpoint, stream_import, count_grade_rows,
+                    ensure_natural_key_index, load_entity_lookups, validated_loader, checkpoint_error_report)
+from recommendations import rebuild_recommendations
+from jobs import create_job, run_job
+
+def merge_csv_file(csv_file_path, on_progress=None):
+    """Merge a grades file through the same validated bulk loader as admin merge uploads"""
+    # Read CSV file in chunks so memory stays flat regardless of file size
+    print(f"Reading CSV file: {csv_file_path}")
+    ensure_natural_key_index()
+    source_hash = file_fingerprint(csv_file_path)
+    checkpoint = find_resumable_checkpoint(source_hash, 'merge')
+    if checkpoint:
+        print(f"⏩ Resuming interrupted import after row {checkpoint.rows_committed}")
+    else:
+        checkpoint = start_checkpoint(source_hash, os.path.basename(csv_file_path), 'merge',
+                                      app.config['IMPORT_CHUNK_SIZE'])
+        db.session.commit()
+    
+    # Bad rows are reported and skipped; new teachers, students and subjects are created in bulk
+    report = checkpoint_error_report(app.config['IMPORT_REPORT_DIR'], checkpoint)
+    stats = stream_import(csv_file_path, checkpoint, validated_loader(load_entity_lookups(), report, csv_file_path),
+                          on_progress=on_progress)
+    rebuild_recommendations()
+    db.session.commit()
+    return {'success': True, **stats, 'error_report': report.path if report.summary() else None}
 
 def import_csv_data(csv_file_path='sample_grades.csv'):
     with app.app_context():
@@ -13,104 +37,22 @@ def import_csv_data(csv_file_path='sample_grades.csv'):
                 print(f"❌ CSV file not found: {csv_file_path}")
                 return False
             
-            # Read CSV file
-            df = pd.read_csv(csv_file_path)
-            print(f"Reading CSV file: {csv_file_path}")
-            print(f" Found {len(df)} records")
-            
-            grades_added = 0
-            students_created = 0
-            subjects_created = 0
-            teachers_checked = 0
-            
-            # First, ensure we have all teachers from the CSV
-            unique_teachers = df['Teacher_Name'].unique()
-            print(f"Found {len(unique_teachers)} unique teachers in CSV")
-            
-            for teacher_name in unique_teachers:
-                teacher = Teacher.query.filter_by(full_name=teacher_name).first()
-                if not teacher:
-                    print(f"  Teacher '{teacher_name}' not found in database. Please ensure teachers exist before importing.")
-            
-            # Process each row in CSV
-            for index, row in df.iterrows():
-                # Find or create student
-                student = Student.query.filter_by(student_id=row['Student_ID']).first()
-                if not student:
-                    # Create new student user
-                    username = row['Student_Name'].replace(' ', '').lower()
-                    # Check if username already exists
-                    if User.query.filter_by(username=username).first():
-                        username = f"{username}{row['Student_ID'].lower()}"
-                    
-                    student_user = User(
-                        username=username,
-                        email=f"{username}@tutoring.com",
-                        role='student'
-                    )
-                    student_user.set_password('password321')
-                    db.session.add(student_user)
-                    db.session.flush()
-                    
-                    student = Student(
-                        user_id=student_user.id,
-                        student_id=row['Student_ID'],
-                        full_name=row['Student_Name'],
-                        grade_level='Form 4'
-                    )
-                    db.session.add(student)
-                    students_created += 1
-                    db.session.flush()
-                
-                # Find or create subject
-                subject = Subject.query.filter_by(name=row['Subject']).first()
-                if not subject:
-                    subject = Subject(name=row['Subject'], description=row['Subject'])
-                    db.session.add(subject)
-                    subjects_created += 1
-                    db.session.flush()
-                
-                # Find teacher - use the teacher name from CSV
-                teacher = Teacher.query.filter_by(full_name=row['Teacher_Name']).first()
-                if not teacher:
-                    # If teacher not found, use the first available teacher
-                    teacher = Teacher.query.first()
-                    if teacher:
-                        print(f"  Teacher '{row['Teacher_Name']}' not found. Using '{teacher.full_name}' instead.")
-                    else:
-                        print(f" No teachers found in database. Please run init_db.py first.")
-                        return False
-                
-                # Check if this grade already exists (avoid duplicates)
-                existing_grade = Grade.query.filter_by(
-                    student_id=student.id,
-                    subject_id=subject.id,
-                    topic=row['Topic'],
-                    exam_date=datetime.strptime(row['Test_Date'], '%Y-%m-%d')
-                ).first()
-                
-                if not existing_grade:
-                    # Create grade
-                    grade = Grade(
-                        student_id=student.id,
-                        teacher_id=teacher.id,
-                        subject_id=subject.id,
-                        score=float(row['Score']),
-                        topic=row['Topic'],
-                        exam_date=datetime.strptime(row['Test_Date'], '%Y-%m-%d'),
-                        day_of_week=row['Day'],
-                        teacher_name=row['Teacher_Name']
-                    )
-                    db.session.add(grade)
-                    grades_added += 1
-                else:
-                    print(f"  Grade already exists for {row['Student_Name']} - {row['Subject']} - {row['Topic']} - {row['Test_Date']}")
+            # Runs as an import job so it takes turns with uploads and refreshes in the web workers
+            job = create_job('cli_import', source_name=os.path.basename(csv_file_path),
+                             rows_total=count_grade_rows(csv_file_path))
+            stats = run_job(job.id, merge_csv_file, csv_file_path)
+            if not stats['success']:
+                print(f"❌ Error importing CSV: {stats['error']}")
+                return False
             
-            db.session.commit()
-            print(f"\n✅ CSV Import Complete!")
-            print(f" Students created: {students_created}")
-            print(f" Subjects created: {subjects_created}")
-            print(f"Grades added: {grades_added}")
+            print("\n✅ CSV Import Complete!")
+            print(f" Teachers created: {stats['teachers_created']}")
+            print(f" Students created: {stats['students_created']}")
+            print(f" Subjects created: {stats['subjects_created']}")
+            print(f"Grades added: {stats['grades_added']} ({stats['rows_per_second']} rows/sec over {stats['chunks']} chunks)")
+            print(f" Grades updated: {stats['grades_updated']}, unchanged: {stats['grades_unchanged']}")
+            if stats['rows_rejected']:
+                print(f"⚠️  Rejected {stats['rows_rejected']} invalid rows, see {stats['error_report']}")
             print(f" Total students in system: {Student.query.count()}")
             print(f"Total grades in system: {Grade.query.count()}")
             
@@ -0,0 +1,627 @@
+# ingest.py - Vectorized bulk loader for grade CSV data
+import gzip
+import hashlib
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from sqlalchemy import Column, DateTime, Integer, MetaData, Table, and_, delete, insert, select, func, or_, inspect
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Grade, GradeAggregate, ImportCheckpoint, SourceManifest
+from staging import live_tables, canonical_index_name
+from database import dialect_insert, bump_data_version
+from aggregates import GRADE_COLUMNS, apply_grade_changes
+from provisioning import AccountProvisioner
+from validation import REQUIRED_COLUMNS, ErrorReport, validate_columns, validate_grades_frame
+
+GRADE_BATCH_SIZE = 50000
+CHUNK_SIZE = 100000
+# Accepted upload/refresh file types, matched against the end of the file name
+GRADE_FILE_FORMATS = {'.csv': 'csv', '.csv.gz': 'csv', '.parquet': 'parquet', '.arrow': 'arrow', '.feather': 'arrow'}
+LOAD_COUNTERS = ('grades_added', 'grades_updated', 'grades_unchanged', 'students_created', 'subjects_created', 'teachers_created',
+                 'rows_rejected')
+
+# Grades are identified by (student, subject, topic, date); these columns may change between uploads
+NATURAL_KEY = ('student_id', 'subject_id', 'topic_id', 'exam_date')
+MERGE_COLUMNS = ('score', 'teacher_id', 'weekday_id')
+# Natural keys of the batch being upserted, for looking up the versions it replaces
+_BATCH_KEYS = Table(
+    'grade_batch_keys', MetaData(),
+    Column('position', Integer, primary_key=True),
+    Column('student_id', Integer),
+    Column('subject_id', Integer),
+    Column('topic_id', Integer),
+    Column('exam_date', DateTime),
+    prefixes=['TEMPORARY']
+)
+
+
+def normalize_grades_frame(df):
+    """Validate and type a raw grades frame: string ids, datetime64 dates, float scores"""
+    validate_columns(df)
+    df = df[REQUIRED_COLUMNS]
+    return df.assign(
+        Student_ID=df['Student_ID'].astype(str),
+        Test_Date=pd.to_datetime(df['Test_Date'], format='%Y-%m-%d'),
+        Score=df['Score'].astype(float)
+    )
+
+
+def _lookup(key_column, id_column):
+    """Map key -> id for a whole table, keeping the lowest id per key"""
+    rows = db.session.execute(select(key_column, id_column).order_by(id_column.desc())).all()
+    return {key: row_id for key, row_id in rows}
+
+
+def _fetch_ids(key_column, id_column, keys, chunk_size=500):
+    """Map key -> id for just the given keys, in IN-list sized chunks"""
+    id_map = {}
+    for start in range(0, len(keys), chunk_size):
+        rows = db.session.execute(
+            select(key_column, id_column).where(key_column.in_(keys[start:start + chunk_size]))
+        ).all()
+        id_map.update(rows)
+    return id_map
+
+
+def load_entity_lookups(tables=None, track_aggregates=True):
+    """Load the small key -> id maps kept resident for a whole import.
+
+    ``tables`` (see staging.staging_tables) points the whole load at another
+    set of tables; by default the live ones are used. Loads that rebuild
+    the aggregates afterwards pass ``track_aggregates=False`` to skip
+    maintaining them row batch by row batch.
+    """
+    t = tables or live_tables()
+    return {
+        'teachers': _lookup(t['teachers'].c.full_name, t['teachers'].c.id),
+        'students': _lookup(t['students'].c.student_id, t['students'].c.id),
+        'subjects': _lookup(t['subjects'].c.name, t['subjects'].c.id),
+        'topics': _lookup(t['topics'].c.name, t['topics'].c.id),
+        'weekdays': _lookup(t['weekdays'].c.name, t['weekdays'].c.id),
+        'accounts': AccountProvisioner(t['users']),
+        'tables': t,
+        'aggregates': t['grade_aggregates'] if track_aggregates else None
+    }
+
+
+def _ensure_teachers(df, lookups, now):
+    teacher_map = lookups['teachers']
+    teachers = lookups['tables']['teachers']
+    first_rows = df.drop_duplicates('Teacher_Name')
+    new_rows = first_rows[~first_rows['Teacher_Name'].isin(list(teacher_map))]
+    if len(new_rows) == 0:
+        return 0
+
+    names = new_rows['Teacher_Name'].tolist()
+    user_ids = lookups['accounts'].create_users(names, 'teacher', now)
+    db.session.execute(teachers.insert(), [
+        {'user_id': user_id, 'full_name': name, 'subjects': subject, 'join_date': now, 'status': 'active'}
+        for user_id, name, subject in zip(user_ids, names, new_rows['Subject'].tolist())
+    ])
+    teacher_map.update(_fetch_ids(teachers.c.full_name, teachers.c.id, names))
+    return len(names)
+
+
+def _ensure_students(df, lookups, now):
+    student_map = lookups['students']
+    students = lookups['tables']['students']
+    first_rows = df.drop_duplicates('Student_ID')
+    new_rows = first_rows[~first_rows['Student_ID'].isin(list(student_map))]
+    if len(new_rows) == 0:
+        return 0
+
+    names = new_rows['Student_Name'].tolist()
+    student_ids = new_rows['Student_ID'].tolist()
+    user_ids = lookups['accounts'].create_users(names, 'student', now)
+    db.session.execute(students.insert(), [
+        {'user_id': user_id, 'student_id': student_id, 'full_name': name, 'grade_level': 'Form 4', 'enrollment_date': now}
+        for user_id, student_id, name in zip(user_ids, student_ids, names)
+    ])
+    student_map.update(_fetch_ids(students.c.student_id, students.c.id, student_ids))
+    return len(names)
+
+
+def _ensure_subjects(subject_names, lookups):
+    subject_map = lookups['subjects']
+    subjects = lookups['tables']['subjects']
+    new_names = [name for name in subject_names if name not in subject_map]
+    if not new_names:
+        return 0
+
+    db.session.execute(subjects.insert(), [
+        {'name': name, 'description': name, 'difficulty_level': 'medium'} for name in new_names
+    ])
+    subject_map.update(_fetch_ids(subjects.c.name, subjects.c.id, new_names))
+    return len(new_names)
+
+
+def _ensure_names(names, lookups, kind):
+    """Insert the topics or weekdays (``kind``) among ``names`` that have no row yet"""
+    name_map = lookups[kind]
+    table = lookups['tables'][kind]
+    new_names = [name for name in names if name not in name_map]
+    if not new_names:
+        return 0
+
+    db.session.execute(table.insert(), [{'name': name} for name in new_names])
+    name_map.update(_fetch_ids(table.c.name, table.c.id, new_names))
+    return len(new_names)
+
+
+def ensure_natural_key_index():
+    """Create the grades natural-key unique index on databases that predate it.
+
+    Runs inside the session's transaction, so rows deleted earlier in the
+    same transaction no longer count as duplicates.
+    """
+    conn = db.session.connection()
+    existing = {canonical_index_name(i['name']) for i in inspect(conn).get_indexes(Grade.__tablename__)}
+    if 'uq_grades_natural_key' in existing:
+        return
+    index = next(i for i in Grade.__table__.indexes if i.name == 'uq_grades_natural_key')
+    try:
+        index.create(conn)
+    except IntegrityError:
+        raise ValueError("Existing grades contain duplicate (student, subject, topic, date) rows; "
+                         "remove them or do a full replacement before merging")
+
+
+def _grade_upsert_statement(table):
+    stmt = dialect_insert(table)
+    set_ = {name: stmt.excluded[name] for name in MERGE_COLUMNS}
+    # Uploads (no source file) keep the refresh file that owns a row
+    set_['source_file_id'] = func.coalesce(stmt.excluded.source_file_id, table.c.source_file_id)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c[name] for name in NATURAL_KEY],
+        set_=set_,
+        where=or_(*(table.c[name].is_distinct_from(stmt.excluded[name]) for name in MERGE_COLUMNS))
+    )
+
+
+def _current_versions(batch, table):
+    """Rows of ``table`` sharing a natural key with the batch, with the batch position they match"""
+    conn = db.session.connection()
+    _BATCH_KEYS.create(conn, checkfirst=True)
+    conn.execute(delete(_BATCH_KEYS))
+    conn.execute(insert(_BATCH_KEYS), batch[list(NATURAL_KEY)].assign(position=batch.index).to_dict('records'))
+    rows = conn.execute(
+        select(_BATCH_KEYS.c.position, *(table.c[name] for name in GRADE_COLUMNS))
+        .select_from(_BATCH_KEYS)
+        .join(table, and_(*(table.c[name] == _BATCH_KEYS.c[name] for name in NATURAL_KEY)))
+    ).all()
+    conn.execute(delete(_BATCH_KEYS))
+    return pd.DataFrame(rows, columns=['position'] + GRADE_COLUMNS).set_index('position')
+
+
+def _same(a, b):
+    return (a == b) | (a.isna() & b.isna())
+
+
+def upsert_grades(rows, table=None, aggregates=GradeAggregate.__table__):
+    """INSERT ... ON CONFLICT grade rows by natural key.
+
+    New keys are inserted, rows whose score/teacher/day changed are updated
+    and identical rows are not written at all. ``aggregates`` is updated
+    with the new rows and with the old and new versions of the changed
+    ones; pass None to leave it alone. Writes to the live grades table
+    move the data version on.
+    """
+    table = Grade.__table__ if table is None else table
+    if not rows:
+        return {'grades_added': 0, 'grades_updated': 0, 'grades_unchanged': 0}
+
+    max_id_before = db.session.execute(select(func.max(table.c.id))).scalar() or 0
+    if aggregates is not None:
+        # Within a batch the last row for a key is the one that sticks
+        batch = pd.DataFrame(rows).drop_duplicates(list(NATURAL_KEY), keep='last').reset_index(drop=True)
+        current = _current_versions(batch, table) if max_id_before else pd.DataFrame(columns=GRADE_COLUMNS)
+        matched = batch.loc[current.index]
+        unchanged = np.logical_and.reduce([_same(matched[name], current[name]).to_numpy() for name in MERGE_COLUMNS])
+
+    changed = db.session.execute(_grade_upsert_statement(table), rows).rowcount
+    added = db.session.execute(
+        select(func.count()).select_from(table).where(table.c.id > max_id_before)
+    ).scalar()
+
+    if aggregates is not None:
+        apply_grade_changes(batch.drop(index=current.index[unchanged])[GRADE_COLUMNS], current[~unchanged],
+                            table, aggregates)
+    if changed and table is Grade.__table__:
+        bump_data_version()
+    return {
+        'grades_added': added,
+        'grades_updated': max(changed - added, 0),
+        'grades_unchanged': len(rows) - changed
+    }
+
+
+def _codes_to_ids(values, id_map):
+    """Translate a column into database ids using one dict lookup per unique value; missing values become None"""
+    codes, uniques = pd.factorize(values)
+    # factorize codes missing values as -1, which picks the trailing None
+    ids = np.array([id_map[value] for value in uniques] + [None], dtype=object)
+    return ids[codes].tolist()
+
+
+def bulk_load_grades(df, lookups=None, batch_size=GRADE_BATCH_SIZE, source_file_id=None):
+    """Load a grades frame using bulk INSERTs instead of per-row ORM objects.
+
+    Teachers, students, subjects, topics and weekdays are resolved once per unique value,
+    missing users and profiles are inserted in bulk, and grade rows are
+    upserted by natural key with executemany in batches of ``batch_size``,
+    so the same loader serves full replacements and merges. Pass the same
+    ``lookups`` (see load_entity_lookups) across chunks of one import to
+    avoid reloading them; lookups built for the staging tables make the
+    load land there. ``source_file_id`` tags the rows with the manifest
+    entry of the refresh file they came from. The caller owns the
+    transaction; nothing is committed here.
+    """
+    started = time.perf_counter()
+    df = normalize_grades_frame(df)
+    exam_dates = list(df['Test_Date'].dt.to_pydatetime())
+    now = datetime.utcnow()
+    if lookups is None:
+        lookups = load_entity_lookups()
+
+    teachers_created = _ensure_teachers(df, lookups, now)
+    students_created = _ensure_students(df, lookups, now)
+    subjects_created = _ensure_subjects(df['Subject'].unique().tolist(), lookups)
+    # A blank Day means the grade has no weekday
+    days = df['Day'].where(df['Day'].astype(str).str.strip() != '')
+    _ensure_names(df['Topic'].unique().tolist(), lookups, 'topics')
+    _ensure_names(days.dropna().unique().tolist(), lookups, 'weekdays')
+
+    columns = {
+        'student_id': _codes_to_ids(df['Student_ID'], lookups['students']),
+        'teacher_id': _codes_to_ids(df['Teacher_Name'], lookups['teachers']),
+        'subject_id': _codes_to_ids(df['Subject'], lookups['subjects']),
+        'score': df['Score'].tolist(),
+        'topic_id': _codes_to_ids(df['Topic'], lookups['topics']),
+        'exam_date': exam_dates,
+        'weekday_id': _codes_to_ids(days, lookups['weekdays'])
+    }
+    keys = list(columns) + ['source_file_id', 'created_at']
+
+    total = len(df)
+    grade_stats = {'grades_added': 0, 'grades_updated': 0, 'grades_unchanged': 0}
+    for start in range(0, total, batch_size):
+        stop = start + batch_size
+        batch = zip(*(values[start:stop] for values in columns.values()))
+        batch_stats = upsert_grades([dict(zip(keys, row + (source_file_id, now))) for row in batch],
+                                    lookups['tables']['grades'], lookups['aggregates'])
+        for key, value in batch_stats.items():
+            grade_stats[key] += value
+
+    elapsed = time.perf_counter() - started
+    rows_per_second = round(total / elapsed) if elapsed > 0 else total
+    print(f"⚡ Bulk loaded {total} grades in {elapsed:.2f}s ({rows_per_second} rows/sec)")
+
+    return {
+        **grade_stats,
+        'students_created': students_created,
+        'subjects_created': subjects_created,
+        'teachers_created': teachers_created,
+        'elapsed_seconds': round(elapsed, 3),
+        'rows_per_second': rows_per_second
+    }
+
+
+def checkpoint_error_report(directory, checkpoint):
+    """ErrorReport of an import checkpoint, appending only to the report of the same checkpoint's earlier runs.
+
+    The start time is in the name as checkpoint ids start over when the
+    schema is recreated or a replacement clears the checkpoints.
+    """
+    return ErrorReport(directory, f"import_{checkpoint.id}_{checkpoint.started_at:%Y%m%d%H%M%S}_errors.csv",
+                       resume_before=checkpoint.rows_committed or 0)
+
+
+def validated_loader(lookups, report, source_name):
+    """load_chunk for stream_import: validate the chunk, report rejected rows, bulk load the rest"""
+    def load_chunk(df):
+        valid, errors = validate_grades_frame(df)
+        report.add(errors, source_name)
+        stats = bulk_load_grades(valid, lookups) if len(valid) else dict.fromkeys(LOAD_COUNTERS, 0)
+        stats['rows_rejected'] = len(df) - len(valid)
+        return stats
+    return load_chunk
+
+
+def parse_grade_file(path):
+    """Read, validate and normalize one grades file; runs inside a parser worker process.
+
+    Rows failing validation are dropped from ``frame`` and returned in ``errors``.
+    """
+    started = time.perf_counter()
+    try:
+        valid, errors = validate_grades_frame(read_grade_file(path))
+        frame = normalize_grades_frame(valid)
+        error = None
+    except Exception as e:
+        frame = errors = None
+        error = str(e)
+    return {
+        'path': path,
+        'frame': frame,
+        'errors': errors,
+        'rows': len(frame) if frame is not None else 0,
+        'rows_rejected': errors['line'].nunique() if errors is not None else 0,
+        'parse_seconds': round(time.perf_counter() - started, 3),
+        'error': error
+    }
+
+
+def parse_files_parallel(paths, max_workers=None):
+    """Parse several grade files concurrently, returning parse_grade_file results in input order"""
+    if not paths:
+        return []
+    workers = min(max_workers or os.cpu_count() or 1, len(paths))
+    if workers <= 1:
+        return [parse_grade_file(path) for path in paths]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(parse_grade_file, paths))
+
+
+def file_fingerprint(path, block_size=1 << 20):
+    """sha256 of a file, read in fixed-size blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def plan_source_refresh(paths):
+    """Compare refresh files on disk against the manifest.
+
+    Files whose size and mtime match their manifest entry are taken as
+    unchanged without reading them; otherwise the content hash decides.
+    Returns (changed, unchanged, removed): changed holds dicts with the
+    new path/size/mtime/hash and the old manifest entry (or None), the
+    other two hold manifest entries.
+    """
+    manifest = {entry.path: entry for entry in SourceManifest.query.all()}
+    changed = []
+    unchanged = []
+
+    for path in paths:
+        stat = os.stat(path)
+        entry = manifest.pop(path, None)
+        if entry and entry.size_bytes == stat.st_size and entry.mtime == stat.st_mtime:
+            unchanged.append(entry)
+            continue
+
+        content_hash = file_fingerprint(path)
+        if entry and entry.content_hash == content_hash:
+            # Touched but identical; remember the new stat so it is not hashed again
+            entry.size_bytes = stat.st_size
+            entry.mtime = stat.st_mtime
+            unchanged.append(entry)
+            continue
+
+        changed.append({
+            'path': path,
+            'size_bytes': stat.st_size,
+            'mtime': stat.st_mtime,
+            'content_hash': content_hash,
+            'entry': entry
+        })
+
+    return changed, unchanged, list(manifest.values())
+
+
+def grade_file_format(path):
+    """'csv', 'parquet' or 'arrow' from the file name; gzip CSVs count as 'csv'"""
+    name = str(path).lower()
+    for extension, file_format in GRADE_FILE_FORMATS.items():
+        if name.endswith(extension):
+            return file_format
+    raise ValueError(f"Unsupported file type. Supported: {', '.join(GRADE_FILE_FORMATS)}")
+
+
+def _csv_options():
+    # Everything arrives as text so a stray value can't break type inference mid-file;
+    # validation converts Test_Date and Score column-wise
+    return pacsv.ConvertOptions(column_types={column: pa.string() for column in REQUIRED_COLUMNS},
+                                strings_can_be_null=True)
+
+
+def _open_arrow_ipc(path):
+    """Reader for an Arrow IPC file, falling back to the streaming format"""
+    try:
+        return pa.ipc.open_file(pa.memory_map(path))
+    except pa.ArrowInvalid:
+        return pa.ipc.open_stream(pa.memory_map(path))
+
+
+def _record_batches(path):
+    file_format = grade_file_format(path)
+    if file_format == 'parquet':
+        yield from pq.ParquetFile(path).iter_batches()
+    elif file_format == 'arrow':
+        reader = _open_arrow_ipc(path)
+        if isinstance(reader, pa.ipc.RecordBatchFileReader):
+            for i in range(reader.num_record_batches):
+                yield reader.get_batch(i)
+        else:
+            yield from reader
+    else:
+        # Multithreaded block parsing; .gz is decompressed on the fly
+        yield from pacsv.open_csv(path, convert_options=_csv_options())
+
+
+def _arrow_to_frame(table):
+    # Arrow dates and timestamps become datetime64 columns rather than Python objects
+    return table.to_pandas(date_as_object=False)
+
+
+def read_grade_file(path):
+    """Whole grades file (CSV, gzip CSV, Parquet or Arrow IPC) as one DataFrame"""
+    if grade_file_format(path) == 'csv':
+        return _arrow_to_frame(pacsv.read_csv(path, convert_options=_csv_options()))
+    return _arrow_to_frame(pa.Table.from_batches(list(_record_batches(path))))
+
+
+def count_grade_rows(path, block_size=1 << 20):
+    """Data row count for progress reporting.
+
+    Parquet and Arrow files are counted from their metadata; plain CSVs by
+    counting lines (minus the header) without parsing, gzip CSVs after
+    streaming decompression.
+    """
+    file_format = grade_file_format(path)
+    if file_format == 'parquet':
+        return pq.ParquetFile(path).metadata.num_rows
+    if file_format == 'arrow':
+        return sum(batch.num_rows for batch in _record_batches(path))
+
+    lines = 0
+    last = b''
+    opener = gzip.open if str(path).lower().endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            lines += block.count(b'\n')
+            last = block
+    if last and not last.endswith(b'\n'):
+        lines += 1
+    return max(lines - 1, 0)
+
+
+def iter_grade_chunks(path, chunk_size=CHUNK_SIZE, skip_rows=0):
+    """Yield the file as DataFrames of at most chunk_size rows, after skipping skip_rows data rows"""
+    pending = []
+    pending_rows = 0
+    for batch in _record_batches(path):
+        if skip_rows:
+            skipped = min(skip_rows, batch.num_rows)
+            batch = batch.slice(skipped)
+            skip_rows -= skipped
+            if batch.num_rows == 0:
+                continue
+        pending.append(batch)
+        pending_rows += batch.num_rows
+        while pending_rows >= chunk_size:
+            table = pa.Table.from_batches(pending)
+            yield _arrow_to_frame(table.slice(0, chunk_size))
+            rest = table.slice(chunk_size)
+            pending = rest.to_batches()
+            pending_rows = rest.num_rows
+    if pending_rows:
+        yield _arrow_to_frame(pa.Table.from_batches(pending))
+
+
+def find_resumable_checkpoint(source_hash, mode):
+    """Latest failed import of this exact file, if there is one to resume"""
+    return ImportCheckpoint.query.filter(
+        ImportCheckpoint.source_hash == source_hash,
+        ImportCheckpoint.mode == mode,
+        ImportCheckpoint.status == 'failed'
+    ).order_by(ImportCheckpoint.id.desc()).first()
+
+
+def _refuse_while_running(mode):
+    running = ImportCheckpoint.query.filter_by(mode=mode, status='running').first()
+    if running:
+        raise ValueError(f"Another {mode} import ({running.source_name}) is still running")
+
+
+def start_checkpoint(source_hash, source_name, mode, chunk_size=CHUNK_SIZE):
+    """Register a new import; older failed imports of the same mode stop being resumable.
+
+    Raises ValueError while another import of the mode is running, rather
+    than take its checkpoint (and, for replacements, its staging tables)
+    from under it. jobs.reap_orphaned_jobs fails the checkpoints of
+    imports whose process died.
+    """
+    _refuse_while_running(mode)
+    ImportCheckpoint.query.filter_by(mode=mode, status='failed').update({'status': 'abandoned'},
+                                                                        synchronize_session=False)
+
+    checkpoint = ImportCheckpoint(
+        source_hash=source_hash,
+        source_name=source_name,
+        mode=mode,
+        chunk_size=chunk_size,
+        rows_committed=0,
+        chunks_committed=0,
+        status='running'
+    )
+    db.session.add(checkpoint)
+    return checkpoint
+
+
+def finish_checkpoint(checkpoint, error=None):
+    """Mark an import completed, or failed with ``error``, in the caller's transaction"""
+    checkpoint.status = 'failed' if error else 'completed'
+    checkpoint.error = error
+    checkpoint.updated_at = datetime.utcnow()
+
+
+def stream_import(csv_file_path, checkpoint, load_chunk, counters=LOAD_COUNTERS, on_progress=None, finish=True):
+    """Feed a grades file to load_chunk one chunk at a time, committing after each.
+
+    Progress is written to ``checkpoint`` in the same transaction as the
+    chunk's rows, so a failed import resumes from the last committed chunk.
+    Only one chunk plus whatever load_chunk keeps resident is in memory.
+    The numeric stats returned by load_chunk are summed across chunks, and
+    on_progress, if given, is called with the committed row count. With
+    ``finish=False`` the checkpoint is left running for the caller to
+    complete with finish_checkpoint once its own steps after the load are
+    done, so no other import of the mode can start in between.
+    """
+    started = time.perf_counter()
+    resumed_from = checkpoint.rows_committed or 0
+    totals = dict.fromkeys(counters, 0)
+    if checkpoint.status != 'running':
+        # A resumed import is running again; no other import may start or resume it meanwhile
+        _refuse_while_running(checkpoint.mode)
+        checkpoint.status = 'running'
+        checkpoint.error = None
+        db.session.commit()
+
+    try:
+        for chunk in iter_grade_chunks(csv_file_path, checkpoint.chunk_size, resumed_from):
+            # Index rows by their position in the file, so row-level errors can name their line
+            chunk.index = pd.RangeIndex(checkpoint.rows_committed, checkpoint.rows_committed + len(chunk))
+            stats = load_chunk(chunk)
+            for key, value in stats.items():
+                if key not in ('elapsed_seconds', 'rows_per_second'):
+                    totals[key] = totals.get(key, 0) + value
+
+            checkpoint.rows_committed += len(chunk)
+            checkpoint.chunks_committed += 1
+            checkpoint.updated_at = datetime.utcnow()
+            db.session.commit()
+            print(f"   📦 Committed chunk {checkpoint.chunks_committed} ({checkpoint.rows_committed} rows)")
+            if on_progress:
+                on_progress(checkpoint.rows_committed)
+    except Exception as e:
+        db.session.rollback()
+        checkpoint.status = 'failed'
+        checkpoint.error = str(e)
+        checkpoint.updated_at = datetime.utcnow()
+        db.session.commit()
+        raise
+
+    if finish:
+        finish_checkpoint(checkpoint)
+        db.session.commit()
+
+    elapsed = time.perf_counter() - started
+    rows_processed = checkpoint.rows_committed - resumed_from
+    totals.update({
+        'rows_processed': rows_processed,
+        'resumed_from_row': resumed_from,
+        'chunks': checkpoint.chunks_committed,
+        'elapsed_seconds': round(elapsed, 3),
+        'rows_per_second': round(rows_processed / elapsed) if elapsed > 0 else rows_processed
+    })
+    return totals
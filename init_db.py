@@ -1,6 +1,7 @@
 # init_db.py - Fixed database initialization - ONLY CREATES ADMIN
 from app import create_app
 from models import db, User, Teacher, Student, Subject, Grade
+from database import ensure_data_version
 
 def init_sample_data():
     app = create_app()
@@ -10,6 +11,8 @@ def init_sample_data():
             print("🔄 Initializing database...")
             db.drop_all()
             db.create_all()
+            # A new epoch, so cached results of the old data are not served at the restarted versions
+            ensure_data_version()
             
             print("Creating admin user only...")
             
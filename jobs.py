@@ -0,0 +1,221 @@
+# jobs.py - Background job runner for long-running admin imports
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import select, update
+
+from models import db, ImportJob, ImportLock, ImportCheckpoint
+from database import dialect_insert
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+class ImportBusyError(RuntimeError):
+    """Raised by create_job while another import holds the import lock"""
+
+    def __init__(self, job_id):
+        super().__init__(f'Import job {job_id} is still running; try again once it has finished')
+        self.job_id = job_id
+
+
+def init_job_runner(app):
+    """Attach the thread pool that runs background jobs for this process"""
+    app.extensions['job_executor'] = ThreadPoolExecutor(
+        max_workers=app.config['IMPORT_JOB_WORKERS'],
+        thread_name_prefix='import-job'
+    )
+
+
+def _acquire_import_lock(job_id):
+    """Point the lock row at job_id in the session's transaction unless another job holds it"""
+    t = ImportLock.__table__
+    now = datetime.utcnow()
+    stmt = dialect_insert(t).values(id=1, job_id=job_id, acquired_at=now)
+    return db.session.execute(stmt.on_conflict_do_update(
+        index_elements=[t.c.id],
+        set_={'job_id': job_id, 'acquired_at': now},
+        where=t.c.job_id.is_(None)
+    )).rowcount == 1
+
+
+def _release_import_lock(job_id):
+    db.session.execute(
+        update(ImportLock).where(ImportLock.id == 1, ImportLock.job_id == job_id).values(job_id=None, acquired_at=None)
+    )
+
+
+def create_job(job_type, source_name=None, file_path=None, rows_total=None, user_id=None):
+    """Persist a queued job so any worker can report on it, taking the import lock for it.
+
+    Each gunicorn worker has its own executor, so the lock row is what keeps
+    two imports from writing at once: while another job holds it nothing is
+    persisted and ImportBusyError is raised. The job keeps the lock until
+    run_job has recorded its outcome.
+    """
+    reap_orphaned_jobs()
+    job = ImportJob(
+        job_type=job_type,
+        status='queued',
+        source_name=source_name,
+        file_path=file_path,
+        rows_total=rows_total,
+        rows_processed=0,
+        user_id=user_id,
+        worker_pid=os.getpid()
+    )
+    db.session.add(job)
+    db.session.flush()
+    if not _acquire_import_lock(job.id):
+        holder = db.session.execute(select(ImportLock.job_id).where(ImportLock.id == 1)).scalar()
+        db.session.rollback()
+        raise ImportBusyError(holder)
+    db.session.commit()
+    return job
+
+
+def submit_job(app, job_id, func, *args, **kwargs):
+    """Run func(*args, on_progress=..., **kwargs) in the background for an existing job.
+
+    func must return a result dict with a 'success' key, like the import
+    functions in app.py do.
+    """
+    app.extensions['job_executor'].submit(_run_job, app, job_id, func, args, kwargs)
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def reap_orphaned_jobs(starting=False):
+    """Fail queued or running jobs whose process is gone, e.g. after a worker restart, and free the lock.
+
+    A job runs on the executor of the process that queued it, so once that
+    process has died nothing will finish it. At startup (``starting``) this
+    process has no jobs yet, so any recorded under its pid were left by an
+    earlier process that had the same one. With no import left running,
+    checkpoints still marked running are failed too, which lets a re-upload
+    of the file resume them. Returns the number of jobs failed.
+    """
+    jobs = ImportJob.query.filter(ImportJob.status.in_(ACTIVE_STATUSES)).all()
+    orphaned = [job for job in jobs if job.worker_pid is None or (starting and job.worker_pid == os.getpid())
+                or not _process_alive(job.worker_pid)]
+    now = datetime.utcnow()
+    for job in orphaned:
+        print(f"⚠️  Import job {job.id} was left {job.status} by a stopped worker, marking it failed")
+        job.status = 'failed'
+        job.error = 'The worker running this import stopped before it finished'
+        job.finished_at = job.updated_at = now
+        _release_import_lock(job.id)
+        if job.file_path:
+            try:
+                os.remove(job.file_path)
+            except OSError:
+                pass
+    if len(orphaned) == len(jobs):
+        ImportCheckpoint.query.filter_by(status='running').update(
+            {'status': 'failed', 'error': 'Interrupted', 'updated_at': now}, synchronize_session=False
+        )
+    db.session.commit()
+    return len(orphaned)
+
+
+def update_job_progress(job_id, rows_processed):
+    ImportJob.query.filter_by(id=job_id).update({
+        'rows_processed': rows_processed,
+        'updated_at': datetime.utcnow()
+    })
+    db.session.commit()
+
+
+def run_job(job_id, func, *args, **kwargs):
+    """Run func(*args, on_progress=..., **kwargs) for a job in the current app context.
+
+    Records the outcome and releases the import lock in one commit, then
+    removes the job's input file. Returns func's result; refreshes run
+    this way inside their request.
+    """
+    job = db.session.get(ImportJob, job_id)
+    job.status = 'running'
+    job.started_at = job.updated_at = datetime.utcnow()
+    db.session.commit()
+
+    try:
+        result = func(*args, on_progress=lambda rows: update_job_progress(job_id, rows), **kwargs)
+    except Exception as e:
+        db.session.rollback()
+        result = {'success': False, 'error': str(e)}
+
+    job = db.session.get(ImportJob, job_id)
+    job.status = 'completed' if result.get('success') else 'failed'
+    job.result = json.dumps(result, default=str)
+    job.error = result.get('error')
+    job.finished_at = job.updated_at = datetime.utcnow()
+    if job.status == 'completed' and job.rows_total is not None:
+        job.rows_processed = max(job.rows_processed or 0, job.rows_total)
+    _release_import_lock(job_id)
+    db.session.commit()
+
+    if job.file_path:
+        try:
+            os.remove(job.file_path)
+        except OSError:
+            pass
+    return result
+
+
+def _run_job(app, job_id, func, args, kwargs):
+    with app.app_context():
+        run_job(job_id, func, *args, **kwargs)
+
+
+def job_progress(job):
+    """Rows processed, throughput and ETA for a job"""
+    processed = job.rows_processed or 0
+    elapsed = 0
+    if job.started_at:
+        elapsed = ((job.finished_at or datetime.utcnow()) - job.started_at).total_seconds()
+    rows_per_second = round(processed / elapsed) if elapsed > 0 else 0
+
+    percent = None
+    eta_seconds = None
+    if job.rows_total:
+        percent = round(min(processed / job.rows_total, 1) * 100, 1)
+        if job.status == 'running' and rows_per_second:
+            eta_seconds = round(max(job.rows_total - processed, 0) / rows_per_second)
+        elif job.status == 'completed':
+            eta_seconds = 0
+
+    return {
+        'job_id': job.id,
+        'status': job.status,
+        'rows_processed': processed,
+        'rows_total': job.rows_total,
+        'percent': percent,
+        'rows_per_second': rows_per_second,
+        'elapsed_seconds': round(elapsed, 1),
+        'eta_seconds': eta_seconds
+    }
+
+
+def job_status(job):
+    """Full job record for the status endpoint"""
+    return {
+        'job_id': job.id,
+        'job_type': job.job_type,
+        'status': job.status,
+        'source_name': job.source_name,
+        'created_at': job.created_at.strftime('%Y-%m-%d %H:%M:%S') if job.created_at else None,
+        'started_at': job.started_at.strftime('%Y-%m-%d %H:%M:%S') if job.started_at else None,
+        'finished_at': job.finished_at.strftime('%Y-%m-%d %H:%M:%S') if job.finished_at else None,
+        'error': job.error,
+        'result': json.loads(job.result) if job.result else None,
+        'progress': job_progress(job)
+    }
@@ -0,0 +1,42 @@
+# migrate_db.py - Upgrade an existing database to the current schema and check the grades and hot query plans
+import sys
+
+from app import app
+from diagnostics import explain_hot_queries, grade_dimension_problems
+from migrations import upgrade_schema, analyze_tables
+
+
+def migrate(check_plans=False):
+    with app.app_context():
+        print("🛠️  Upgrading database schema...")
+        result = upgrade_schema()
+        print(f"   Columns added: {result['columns'] or 'none'}")
+        print(f"   Columns encoded as dimension ids: {result['encoded'] or 'none'}")
+        print(f"   Grade constraints restored: {result['constraints'] or 'none'}")
+        print(f"   Indexes created: {result['indexes'] or 'none'}")
+        
+        problems = grade_dimension_problems()
+        print(f"   Grade topic/weekday ids: {', '.join(f'{count} {label}' for label, count in problems.items()) or 'ok'}")
+        
+        print("📈 Refreshing planner statistics (ANALYZE)...")
+        analyze_tables()
+        
+        if not check_plans:
+            return True
+        
+        print("\n🔍 EXPLAIN QUERY PLAN for the dashboard's hot queries:")
+        all_ok = not problems
+        for result in explain_hot_queries():
+            mark = '✅' if result['ok'] else '❌'
+            print(f"{mark} {result['query']}: {', '.join(result['indexes']) or 'no index'}")
+            for line in result['plan']:
+                print(f"      {line}")
+            if not result['ok']:
+                print(f"      expected one of: {', '.join(result['expected'])}")
+                all_ok = False
+        return all_ok
+
+if __name__ == '__main__':
+    # python migrate_db.py [--check]
+    ok = migrate(check_plans='--check' in sys.argv[1:])
+    sys.exit(0 if ok else 1)
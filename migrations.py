@@ -0,0 +1,201 @@
+# migrations.py - Bring databases created by older versions up to the current schema
+import re
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.schema import CreateTable
+
+from models import db, Grade, GradeAggregate, Topic, Weekday
+from staging import STAGING_SUFFIX, canonical_index_name, supports_staging, discard_staging_tables
+from aggregates import backfill_aggregates, rebuild_aggregates
+from database import ensure_data_version
+from recommendations import backfill_recommendations
+
+# Free-text grade columns replaced by dimension ids: column -> (dimension table, id column).
+# teacher_name has no table of its own; it repeated teachers.full_name, which teacher_id already points at.
+ENCODED_GRADE_COLUMNS = {
+    'topic': (Topic.__table__, 'topic_id'),
+    'day_of_week': (Weekday.__table__, 'weekday_id'),
+    'teacher_name': (None, None)
+}
+
+
+def add_missing_columns():
+    """ALTER TABLE ... ADD COLUMN for model columns an existing table lacks"""
+    inspector = inspect(db.engine)
+    added = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                added.append(f'{table.name}.{column.name}')
+            except SQLAlchemyError as e:
+                # Another worker may have added it first
+                print(f"⚠️  Could not add column {table.name}.{column.name}: {e}")
+    return added
+
+
+def encode_grade_dimensions():
+    """Move grades off the free-text topic, day_of_week and teacher_name columns.
+
+    Run after add_missing_columns has added the id columns: the distinct
+    values are inserted into topics and weekdays, every grade is pointed at
+    its rows, and the text columns are dropped together with the indexes
+    built on them. The aggregates, whose values were those strings, are
+    recreated empty for backfill_aggregates to rebuild, and any staged
+    replacement is discarded since its tables have the old shape. Returns
+    the columns that were encoded.
+    """
+    inspector = inspect(db.engine)
+    existing = {column['name'] for column in inspector.get_columns('grades')}
+    legacy = [name for name in ENCODED_GRADE_COLUMNS if name in existing]
+    if not legacy:
+        return []
+    legacy_indexes = [index['name'] for index in inspector.get_indexes('grades')
+                      if set(index['column_names']) & set(legacy)]
+    
+    print(f"🔢 Encoding grade columns as dimension ids: {', '.join(legacy)}")
+    try:
+        with db.engine.begin() as conn:
+            for name in legacy:
+                table, id_column = ENCODED_GRADE_COLUMNS[name]
+                if table is None:
+                    continue
+                conn.execute(text(
+                    f'INSERT INTO {table.name} (name) SELECT DISTINCT g.{name} FROM grades g '
+                    f"WHERE TRIM(g.{name}) <> '' AND NOT EXISTS (SELECT 1 FROM {table.name} d WHERE d.name = g.{name})"
+                ))
+                conn.execute(text(
+                    f'UPDATE grades SET {id_column} = (SELECT d.id FROM {table.name} d WHERE d.name = grades.{name}) '
+                    f'WHERE {id_column} IS NULL'
+                ))
+            for index in legacy_indexes:
+                conn.execute(text(f'DROP INDEX {index}'))
+            for name in legacy:
+                conn.execute(text(f'ALTER TABLE grades DROP COLUMN {name}'))
+            GradeAggregate.__table__.drop(conn)
+            GradeAggregate.__table__.create(conn)
+    except SQLAlchemyError as e:
+        # Another worker may have encoded them first
+        print(f"⚠️  Could not encode grade columns: {e}")
+        return []
+    if supports_staging():
+        discard_staging_tables()
+    return legacy
+
+
+def grades_constraint_drift():
+    """NOT NULL and FOREIGN KEY constraints models.Grade declares that the live grades table lacks.
+
+    Columns added by add_missing_columns, such as topic_id and weekday_id
+    on a database encoded by encode_grade_dimensions, come without them.
+    """
+    inspector = inspect(db.engine)
+    live = {column['name']: column for column in inspector.get_columns('grades')}
+    foreign_keys = {tuple(key['constrained_columns']) for key in inspector.get_foreign_keys('grades')}
+    drift = []
+    for column in Grade.__table__.columns:
+        if column.name not in live or column.primary_key:
+            continue
+        if not column.nullable and live[column.name]['nullable']:
+            drift.append(f'{column.name} NOT NULL')
+        if column.foreign_keys and (column.name,) not in foreign_keys:
+            drift.append(f'{column.name} FOREIGN KEY')
+    return drift
+
+
+def rebuild_grades_table():
+    """Recreate grades with the model's DDL when its constraints have drifted, so migrated and fresh schemas match.
+
+    SQLite cannot add a constraint to an existing column, so the rows are
+    copied into a staging table created from the model's DDL, which is
+    renamed over grades; create_missing_indexes then rebuilds the indexes.
+    A grade without a topic cannot be kept under topic_id's NOT NULL and is
+    dropped; a weekday_id pointing at no weekday is cleared. Returns the
+    constraints that were missing.
+    """
+    drift = grades_constraint_drift()
+    if not drift or not supports_staging():
+        return []
+    # The model's DDL, indexes left out since the live grades table still holds their names
+    ddl = re.sub(r'^\s*CREATE TABLE\s+["`\[]?grades["`\]]?', f'CREATE TABLE "grades{STAGING_SUFFIX}"',
+                 str(CreateTable(Grade.__table__).compile(dialect=db.engine.dialect)), count=1)
+    columns = [column.name for column in Grade.__table__.columns]
+    values = ['CASE WHEN weekday_id IN (SELECT id FROM weekdays) THEN weekday_id END' if name == 'weekday_id' else name
+              for name in columns]
+    print(f"🧱 Rebuilding grades for the model's constraints: {', '.join(drift)}")
+    try:
+        with db.engine.begin() as conn:
+            dropped, cleared = conn.execute(text(
+                'SELECT SUM(topic_id IS NULL OR topic_id NOT IN (SELECT id FROM topics)), '
+                'SUM(weekday_id NOT IN (SELECT id FROM weekdays)) FROM grades'
+            )).one()
+            conn.exec_driver_sql(f'DROP TABLE IF EXISTS "grades{STAGING_SUFFIX}"')
+            conn.exec_driver_sql(ddl)
+            conn.exec_driver_sql(
+                f'INSERT INTO "grades{STAGING_SUFFIX}" ({", ".join(columns)}) SELECT {", ".join(values)} FROM grades '
+                f'WHERE topic_id IN (SELECT id FROM topics)'
+            )
+            conn.exec_driver_sql('DROP TABLE grades')
+            conn.exec_driver_sql(f'ALTER TABLE "grades{STAGING_SUFFIX}" RENAME TO grades')
+    except SQLAlchemyError as e:
+        # Another worker may have rebuilt it first
+        print(f"⚠️  Could not rebuild grades: {e}")
+        return []
+    # The staged replacement's grades table, if any, was replaced above
+    discard_staging_tables()
+    if dropped or cleared:
+        print(f"⚠️  Dropped {dropped or 0} grades without a topic, cleared {cleared or 0} unknown weekdays")
+        rebuild_aggregates()
+        db.session.commit()
+    return drift
+
+
+def create_missing_indexes():
+    """Create model indexes that an existing database does not have yet"""
+    inspector = inspect(db.engine)
+    created = []
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        # A table swapped in by a staged replacement carries the alternate index names
+        existing = {canonical_index_name(index['name']) for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            try:
+                with db.engine.begin() as conn:
+                    index.create(conn, checkfirst=True)
+                created.append(index.name)
+            except SQLAlchemyError as e:
+                print(f"⚠️  Could not create index {index.name}: {e}")
+    return created
+
+
+def analyze_tables():
+    """Refresh the query planner's statistics so it can choose between the grade indexes"""
+    with db.engine.begin() as conn:
+        conn.execute(text('ANALYZE'))
+
+
+def upgrade_schema():
+    """Create missing tables, columns and indexes; safe to run on every start"""
+    db.create_all()
+    added = add_missing_columns()
+    ensure_data_version()
+    encoded = encode_grade_dimensions()
+    rebuilt = rebuild_grades_table()
+    created = create_missing_indexes()
+    backfill_aggregates()
+    backfill_recommendations()
+    if added or encoded or rebuilt or created:
+        print(f"🛠️  Schema upgraded - columns: {added or 'none'}, encoded: {encoded or 'none'}, "
+              f"constraints: {rebuilt or 'none'}, indexes: {created or 'none'}")
+    return {'columns': added, 'encoded': encoded, 'constraints': rebuilt, 'indexes': created}
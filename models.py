@@ -69,21 +69,100 @@ class Subject(db.Model):
     # Relationships
     grades = db.relationship('Grade', backref='subject', lazy=True)
 
+# Distinct CSV values that grades refer to by id instead of repeating the text on every row
+class Topic(db.Model):
+    __tablename__ = 'topics'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), unique=True, nullable=False)
+    
+    # Relationships
+    grades = db.relationship('Grade', backref='topic', lazy=True)
+
+class Weekday(db.Model):
+    __tablename__ = 'weekdays'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(10), unique=True, nullable=False)  # as written in the CSV's Day column
+    
+    # Relationships
+    grades = db.relationship('Grade', backref='weekday', lazy=True)
+
 class Grade(db.Model):
     __tablename__ = 'grades'
+    __table_args__ = (
+        # Natural key of a CSV row; merge imports upsert against it
+        db.Index('uq_grades_natural_key', 'student_id', 'subject_id', 'topic_id', 'exam_date', unique=True),
+        # Dashboard filters: per-teacher/per-student date windows,
+        # per-teacher topic, student and subject breakdowns (checked by migrate_db.py --check)
+        db.Index('ix_grades_teacher_exam_date', 'teacher_id', 'exam_date'),
+        db.Index('ix_grades_student_exam_date', 'student_id', 'exam_date'),
+        db.Index('ix_grades_teacher_topic', 'teacher_id', 'topic_id'),
+        db.Index('ix_grades_teacher_student', 'teacher_id', 'student_id'),
+        db.Index('ix_grades_subject_teacher', 'subject_id', 'teacher_id'),
+        # Recomputing a day's min/max in grade_aggregates after scores are removed
+        db.Index('ix_grades_exam_date', 'exam_date'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('students.id'), nullable=False)
     teacher_id = db.Column(db.Integer, db.ForeignKey('teachers.id'), nullable=False)
     subject_id = db.Column(db.Integer, db.ForeignKey('subjects.id'), nullable=False)
     score = db.Column(db.Float, nullable=False)
-    topic = db.Column(db.String(100), nullable=False)
+    topic_id = db.Column(db.Integer, db.ForeignKey('topics.id'), nullable=False)
     exam_date = db.Column(db.DateTime, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
-    # External factors from CSV
-    day_of_week = db.Column(db.String(10))
-    teacher_name = db.Column(db.String(100))
+    # External factors from CSV; the teacher is teacher_id
+    weekday_id = db.Column(db.Integer, db.ForeignKey('weekdays.id'))
+    
+    # Teacher CSV file the row was refreshed from (NULL for admin uploads)
+    source_file_id = db.Column(db.Integer, db.ForeignKey('source_manifest.id'), index=True)
+
+class GradeAggregate(db.Model):
+    __tablename__ = 'grade_aggregates'
+    __table_args__ = (
+        db.Index('uq_grade_aggregates_key', 'scope', 'scope_id', 'dimension', 'value', 'period', unique=True),
+        # Date-windowed reads only touch the exam days inside the window
+        db.Index('ix_grade_aggregates_period', 'scope', 'scope_id', 'dimension', 'period'),
+    )
+    
+    # Running score statistics per group of grades, maintained by the loader (see aggregates.py)
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(20), nullable=False)  # 'all', 'teacher'
+    scope_id = db.Column(db.Integer, nullable=False, default=0)  # teacher id, 0 for 'all'
+    dimension = db.Column(db.String(20), nullable=False)  # 'overall', 'subject', 'teacher_name', 'day_of_week', 'topic', 'student'
+    value = db.Column(db.Integer, nullable=False)  # subject/teacher/weekday/topic/student id, 0 for 'overall'
+    period = db.Column(db.String(10), nullable=False, default='')  # exam day YYYY-MM-DD, '' for all-time rows
+    score_sum = db.Column(db.Float, nullable=False, default=0)
+    score_count = db.Column(db.Integer, nullable=False, default=0)
+    score_sum_sq = db.Column(db.Float, nullable=False, default=0)
+    score_min = db.Column(db.Float)
+    score_max = db.Column(db.Float)
+
+class GradeHistogram(db.Model):
+    __tablename__ = 'grade_histograms'
+    __table_args__ = (
+        db.Index('uq_grade_histograms_key', 'scope', 'scope_id', 'dimension', 'value', 'bin', unique=True),
+    )
+    
+    # All-time score counts per group and score bin, maintained with the aggregates (see aggregates.py)
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(20), nullable=False)  # 'all', 'teacher'
+    scope_id = db.Column(db.Integer, nullable=False, default=0)  # teacher id, 0 for 'all'
+    dimension = db.Column(db.String(20), nullable=False)  # one of HISTOGRAM_DIMENSIONS
+    value = db.Column(db.Integer, nullable=False)  # subject/teacher/weekday/topic id, 0 for 'overall'
+    bin = db.Column(db.Integer, nullable=False)  # 0 to HISTOGRAM_BINS - 1
+    grade_count = db.Column(db.Integer, nullable=False, default=0)
+
+class DataVersion(db.Model):
+    __tablename__ = 'data_version'
+    
+    # One row (id 1) whose version goes up with every change to the grade data, see database.py
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    epoch = db.Column(db.String(32))  # random token, new whenever the schema is created; versions restart with it
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class SystemLog(db.Model):
     __tablename__ = 'system_logs'
@@ -98,13 +177,83 @@ class SystemLog(db.Model):
 
 class Recommendation(db.Model):
     __tablename__ = 'recommendations'
+    __table_args__ = (
+        # A student's, a teacher's or (both NULL) the school's rows, in the order they are served
+        db.Index('ix_recommendations_student', 'student_id', 'id'),
+        db.Index('ix_recommendations_teacher', 'teacher_id', 'id'),
+    )
     
+    # Written in bulk by recommendations.rebuild_recommendations
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('students.id'))
     teacher_id = db.Column(db.Integer, db.ForeignKey('teachers.id'))
     recommendation_type = db.Column(db.String(50), nullable=False)
     recommendation_text = db.Column(db.Text, nullable=False)
+    action = db.Column(db.Text)
+    confidence = db.Column(db.String(20))  # 'high', 'medium'
     impact_score = db.Column(db.Float)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_applied = db.Column(db.Boolean, default=False)
     result_after_application = db.Column(db.Float)
+
+class RecommendationBuild(db.Model):
+    __tablename__ = 'recommendation_build'
+    
+    # One row (id 1) saying which grade data the stored recommendations were built from, and when
+    id = db.Column(db.Integer, primary_key=True)
+    data_version = db.Column(db.Integer, nullable=False)
+    built_at = db.Column(db.DateTime, nullable=False)
+    row_count = db.Column(db.Integer, default=0)
+
+class ImportCheckpoint(db.Model):
+    __tablename__ = 'import_checkpoints'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    source_hash = db.Column(db.String(64), nullable=False, index=True)  # sha256 of the source file
+    source_name = db.Column(db.String(255))
+    mode = db.Column(db.String(20), nullable=False)  # 'replace', 'merge'
+    chunk_size = db.Column(db.Integer, nullable=False)
+    rows_committed = db.Column(db.Integer, default=0)
+    chunks_committed = db.Column(db.Integer, default=0)
+    status = db.Column(db.String(20), default='running')  # 'running', 'failed', 'completed', 'abandoned'
+    error = db.Column(db.Text)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ImportJob(db.Model):
+    __tablename__ = 'import_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    job_type = db.Column(db.String(30), nullable=False)  # 'csv_upload', 'refresh', 'cli_import', 'recommendations'
+    status = db.Column(db.String(20), default='queued')  # 'queued', 'running', 'completed', 'failed'
+    source_name = db.Column(db.String(255))
+    file_path = db.Column(db.String(500))  # temporary input file, removed when the job finishes
+    rows_total = db.Column(db.Integer)
+    rows_processed = db.Column(db.Integer, default=0)
+    result = db.Column(db.Text)  # JSON
+    error = db.Column(db.Text)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    worker_pid = db.Column(db.Integer)  # process whose executor runs the job, see jobs.reap_orphaned_jobs
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+class ImportLock(db.Model):
+    __tablename__ = 'import_lock'
+    
+    # One row (id 1) naming the job that may write grade data, see jobs.py
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey('import_jobs.id'))  # NULL when no import is running
+    acquired_at = db.Column(db.DateTime)
+
+class SourceManifest(db.Model):
+    __tablename__ = 'source_manifest'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    path = db.Column(db.String(500), unique=True, nullable=False)
+    size_bytes = db.Column(db.Integer)
+    mtime = db.Column(db.Float)
+    content_hash = db.Column(db.String(64))  # sha256 of the file as last ingested
+    row_count = db.Column(db.Integer, default=0)  # grade rows the file produced
+    ingested_at = db.Column(db.DateTime, default=datetime.utcnow)
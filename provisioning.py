@@ -0,0 +1,85 @@
+# provisioning.py - Allocate and bulk create the user accounts behind CSV-imported teachers and students
+from datetime import datetime
+
+from sqlalchemy import select
+
+from models import db, User
+
+DEFAULT_PASSWORD = 'password321'
+EMAIL_DOMAIN = 'tutoring.com'
+
+
+def base_username(name):
+    """Default login name for a CSV-provisioned account"""
+    return str(name).replace(' ', '').replace('.', '').replace(',', '').lower()
+
+
+class AccountProvisioner:
+    """Hands out unique usernames and emails from in-memory sets and inserts accounts in bulk.
+
+    The existing usernames and emails are read once when the provisioner is
+    created; keep one instance for a whole import so every batch probes
+    memory instead of the database. ``users_table`` lets an import target
+    the staging copy of the users table.
+    """
+
+    def __init__(self, users_table=None):
+        self.users = User.__table__ if users_table is None else users_table
+        rows = db.session.execute(select(self.users.c.username, self.users.c.email)).all()
+        self.usernames = {username for username, _ in rows}
+        self.emails = {email for _, email in rows}
+        self._password_hashes = {}
+        # Last suffix tried per base name; taken names are never freed, so probing resumes there
+        self._next_suffix = {}
+
+    def allocate(self, names):
+        """Reserve a free (username, email) pair for every name, in order"""
+        accounts = []
+        for name in names:
+            base = base_username(name)
+            counter = self._next_suffix.get(base, 0)
+            username = f"{base}{counter}" if counter else base
+            while username in self.usernames or f"{username}@{EMAIL_DOMAIN}" in self.emails:
+                counter += 1
+                username = f"{base}{counter}"
+            self._next_suffix[base] = counter
+            email = f"{username}@{EMAIL_DOMAIN}"
+            self.usernames.add(username)
+            self.emails.add(email)
+            accounts.append((username, email))
+        return accounts
+
+    def password_hash(self, password=DEFAULT_PASSWORD):
+        """Salted hash of a shared batch password, computed once per provisioner"""
+        if password not in self._password_hashes:
+            user = User()
+            user.set_password(password)
+            self._password_hashes[password] = user.password_hash
+        return self._password_hashes[password]
+
+    def create_users(self, names, role, now=None, password=DEFAULT_PASSWORD):
+        """Bulk insert one account per name and return their ids in the same order"""
+        if not names:
+            return []
+        now = now or datetime.utcnow()
+        accounts = self.allocate(names)
+        password_hash = self.password_hash(password)
+        db.session.execute(self.users.insert(), [
+            {
+                'username': username,
+                'email': email,
+                'password_hash': password_hash,
+                'role': role,
+                'created_at': now,
+                'is_active': True
+            }
+            for username, email in accounts
+        ])
+
+        usernames = [username for username, _ in accounts]
+        user_ids = {}
+        for start in range(0, len(usernames), 500):
+            user_ids.update(db.session.execute(
+                select(self.users.c.username, self.users.c.id).where(self.users.c.username.in_(usernames[start:start + 500]))
+            ).all())
+        return [user_ids[username] for username in usernames]
@@ -0,0 +1,206 @@
+# recommendations.py - Batch build of the stored recommendations for every student, every teacher and the school
+from datetime import datetime, timedelta
+
+import pandas as pd
+from sqlalchemy import delete, func, insert, select
+
+from models import db, Grade, GradeAggregate, Recommendation, RecommendationBuild
+from aggregates import DIMENSIONS, dimension_names, first_period
+from database import dialect_insert, data_version
+
+# Recent grades the recommendations are worked out from
+RECOMMENDATION_WINDOW_DAYS = 30
+# Stored recommendations older than this are stale for build_recommendations.py --if-stale; their window has moved
+RECOMMENDATION_MAX_AGE = timedelta(days=1)
+# Most recommendations served per scope; general ones fill in below MIN_SPECIFIC_RECOMMENDATIONS
+RECOMMENDATION_LIMIT = 5
+MIN_SPECIFIC_RECOMMENDATIONS = 3
+# Owner kind -> (factor, pick, type, impact_score, confidence, text, action), in the order they are served.
+# pick is 'best' or 'worst' average; text and action are formatted with {name} and {average}.
+RULES = {
+    'student': [
+        ('day_of_week', 'best', 'day_optimization', 8.0, 'high',
+         'Your performance is {average}% on {name} - highest among all days', 'Schedule important study sessions on {name}'),
+        ('teacher_name', 'best', 'teacher_optimization', 12.0, 'medium',
+         'You achieve {average}% with {name}', 'Focus on sessions with {name} for difficult topics'),
+        ('topic', 'best', 'strength_utilization', 10.0, 'high',
+         'Excellent performance in {name} ({average}%)', 'Use your strength in {name} to build confidence'),
+        ('topic', 'worst', 'improvement_area', 15.0, 'high',
+         'Need improvement in {name} ({average}%)', 'Allocate extra study time for {name}')
+    ],
+    # Teachers and the school as a whole (seen by admins) get the same advice about their grades
+    'teacher': [
+        ('topic', 'worst', 'teaching_focus', 15.0, 'high',
+         'Students struggle with {name} (average: {average}%)', 'Provide additional resources and practice for {name}'),
+        ('day_of_week', 'best', 'scheduling_optimization', 8.0, 'medium',
+         'Best student performance on {name} ({average}%)', 'Schedule important topics and assessments on {name}')
+    ]
+}
+GENERAL_RECOMMENDATIONS = [
+    {
+        'type': 'consistent_practice',
+        'text': 'Regular practice improves retention by 25% based on class data',
+        'impact_score': 15.0,
+        'action': 'Implement weekly review sessions for all topics',
+        'confidence': 'high'
+    },
+    {
+        'type': 'assessment_strategy',
+        'text': 'Frequent low-stakes assessments improve learning outcomes',
+        'impact_score': 12.0,
+        'action': 'Schedule weekly practice tests for ongoing evaluation',
+        'confidence': 'medium'
+    }
+]
+
+
+def _factor_averages(owner, value, factor, sums, *conditions):
+    """Frame of owner, name and average score (rounded as factor_trends does) per owner and factor name.
+
+    Grouped by id in the database, which keeps it on the grade indexes,
+    then by name here: ids sharing a name count together, as the live
+    trends merge them.
+    """
+    rows = db.session.execute(select(owner, value, *sums).where(*conditions).group_by(owner, value)).all()
+    names = dimension_names(factor)
+    frame = pd.DataFrame({
+        'owner': [row[0] for row in rows],
+        'name': [names.get(row[1], str(row[1])) for row in rows],
+        'total': [row[2] for row in rows],
+        'count': [row[3] for row in rows]
+    }).groupby(['owner', 'name'], as_index=False, sort=False)[['total', 'count']].sum()
+    frame['average'] = [round(total / count, 2) for total, count in zip(frame['total'].tolist(), frame['count'].tolist())]
+    return frame[['owner', 'name', 'average']]
+
+
+def _student_averages(factor, since):
+    g = Grade.__table__
+    value = g.c[DIMENSIONS[factor]]
+    # Grouping by value + 0 keeps SQLite on the window's range of ix_grades_student_exam_date rather than
+    # walking all of ix_grades_teacher_student for its (student_id, teacher_id) order
+    return _factor_averages(g.c.student_id, value + 0, factor, (func.sum(g.c.score), func.count()),
+                            g.c.exam_date >= since, value.is_not(None))
+
+
+def _teacher_averages(factor, since, scope='teacher'):
+    """Per-teacher averages from the aggregates; scope 'all' gives the school's, under owner 0"""
+    t = GradeAggregate.__table__
+    return _factor_averages(t.c.scope_id, t.c.value, factor, (func.sum(t.c.score_sum), func.sum(t.c.score_count)),
+                            t.c.scope == scope, t.c.dimension == factor, t.c.period >= first_period(since))
+
+
+def _picks(averages, pick):
+    """The row with each owner's best or worst average; ties go to the first name in alphabetical order"""
+    averages = averages.sort_values(['owner', 'name'], kind='stable').reset_index(drop=True)
+    grouped = averages.groupby('owner', sort=False)['average']
+    return averages.loc[grouped.idxmax() if pick == 'best' else grouped.idxmin()]
+
+
+def _recommendation_rows(kind, averages_for, student_ids=False, teacher_ids=False):
+    """Recommendation rows for every owner of a kind, each owner's in rule order"""
+    parts = []
+    factors = {}
+    for position, (factor, pick, rec_type, impact, confidence, text, action) in enumerate(RULES[kind]):
+        if factor not in factors:
+            factors[factor] = averages_for(factor)
+        picked = _picks(factors[factor], pick)
+        names, averages = picked['name'].tolist(), picked['average'].tolist()
+        parts.append(pd.DataFrame({
+            'owner': picked['owner'].tolist(),
+            'position': position,
+            'recommendation_type': rec_type,
+            'recommendation_text': [text.format(name=name, average=average) for name, average in zip(names, averages)],
+            'action': [action.format(name=name, average=average) for name, average in zip(names, averages)],
+            'impact_score': impact,
+            'confidence': confidence
+        }))
+    rows = pd.concat(parts, ignore_index=True).sort_values(['owner', 'position'], kind='stable')
+    owners = [int(owner) for owner in rows['owner'].tolist()]
+    return [
+        {
+            'student_id': owner if student_ids else None,
+            'teacher_id': owner if teacher_ids else None,
+            'recommendation_type': rec_type,
+            'recommendation_text': text,
+            'action': action,
+            'impact_score': impact,
+            'confidence': confidence
+        }
+        for owner, rec_type, text, action, impact, confidence in zip(
+            owners, rows['recommendation_type'].tolist(), rows['recommendation_text'].tolist(),
+            rows['action'].tolist(), rows['impact_score'].tolist(), rows['confidence'].tolist()
+        )
+    ]
+
+
+def rebuild_recommendations(now=None):
+    """Replace the stored recommendations with ones for every student, every teacher and the school.
+
+    Each factor is one grouped query over the window's grades (students)
+    or aggregates (teachers, the school) and every owner's best or worst
+    value is picked in one vectorized pass, so the cost does not grow with
+    the number of owners. Rows are stored owner by owner in rule order,
+    the order they are served in, and the build is recorded against the
+    current data version. The caller owns the transaction. Returns the
+    number of rows stored.
+    """
+    now = now or datetime.utcnow()
+    since = now - timedelta(days=RECOMMENDATION_WINDOW_DAYS)
+    rows = (_recommendation_rows('student', lambda factor: _student_averages(factor, since), student_ids=True)
+            + _recommendation_rows('teacher', lambda factor: _teacher_averages(factor, since), teacher_ids=True)
+            + _recommendation_rows('teacher', lambda factor: _teacher_averages(factor, since, 'all')))
+    db.session.execute(delete(Recommendation))
+    if rows:
+        for row in rows:
+            row['created_at'] = now
+        db.session.execute(insert(Recommendation.__table__), rows)
+    t = RecommendationBuild.__table__
+    build = {'data_version': data_version(), 'built_at': now, 'row_count': len(rows)}
+    db.session.execute(dialect_insert(t).values(id=1, **build).on_conflict_do_update(index_elements=[t.c.id],
+                                                                                      set_=build))
+    return len(rows)
+
+
+def recommendations_stale(max_age=RECOMMENDATION_MAX_AGE):
+    """True when the stored recommendations were built from other grade data, or over max_age ago (None: any age)"""
+    build = db.session.get(RecommendationBuild, 1)
+    if build is None or build.data_version != data_version():
+        return True
+    return max_age is not None and build.built_at < datetime.utcnow() - max_age
+
+
+def refresh_recommendations(on_progress=None):
+    """Import-job body (see jobs.py) that rebuilds and commits the stored recommendations"""
+    stored = rebuild_recommendations()
+    db.session.commit()
+    return {'success': True, 'recommendations': stored}
+
+
+def backfill_recommendations():
+    """Build the recommendations unless the stored ones were built from the current grade data.
+
+    The build is recorded even when it stores nothing (no grade in the
+    window), so this does not run again on every start.
+    """
+    if recommendations_stale(max_age=None):
+        print("💡 Building recommendations...")
+        rebuild_recommendations()
+        db.session.commit()
+
+
+def stored_recommendations(student_id=None, teacher_id=None):
+    """A student's, a teacher's or (with neither) the school's stored recommendations, general ones filling in"""
+    r = Recommendation
+    rows = db.session.execute(
+        select(r.recommendation_type, r.recommendation_text, r.impact_score, r.action, r.confidence)
+        .where(r.student_id == student_id if student_id else r.student_id.is_(None),
+               r.teacher_id == teacher_id if teacher_id else r.teacher_id.is_(None))
+        .order_by(r.id).limit(RECOMMENDATION_LIMIT)
+    ).all()
+    recommendations = [
+        {'type': rec_type, 'text': text, 'impact_score': impact, 'action': action, 'confidence': confidence}
+        for rec_type, text, impact, action, confidence in rows
+    ]
+    if len(recommendations) < MIN_SPECIFIC_RECOMMENDATIONS:
+        recommendations.extend(GENERAL_RECOMMENDATIONS)
+    return recommendations[:RECOMMENDATION_LIMIT]
@@ -0,0 +1,236 @@
+# result_cache.py - Caches of analytics endpoint results, keyed by the data epoch and version they were computed at
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+from database import data_epoch, data_version
+
+
+class ResultCache:
+    """Endpoint results kept least-recently-used first out, each for at most ttl_seconds, with hit/miss counters.
+
+    Keys carry the data epoch and version, so a write makes every older
+    entry unreachable; those then age out of the LRU order. The TTL bounds how
+    long results that depend on today's date (trailing windows) are reused.
+    """
+
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()  # key -> (expiry on the monotonic clock, result), least recently used first
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def get(self, key):
+        """(True, result) for a live entry, else (False, None)"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                del self.entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return False, None
+
+    def put(self, key, result):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl_seconds, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, epoch, version, compute):
+        found, result = self.get((key, epoch, version))
+        if not found:
+            result = compute()
+            self.put((key, epoch, version), result)
+        return result
+
+    def stats(self):
+        """Counters for the admin cache stats endpoint"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': 'process',
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+
+class SharedResultCache:
+    """Results in a SQLite file that every worker process on the host opens, one row per key.
+
+    A row holds the data epoch and version its payload (JSON) was computed
+    at; a newer version overwrites it, so a write reaches all workers at
+    once through data_version() and each result exists once. The file
+    outlives the database: when the schema is recreated, versions start
+    over under a new epoch, and rows of any other epoch count as stale. The first worker to miss a
+    key leases it and computes while the others wait for its payload, so
+    after an upload the dashboards are computed once rather than once per
+    worker. Counters are per process.
+    """
+
+    LEASE_SECONDS = 30  # a worker that dies mid-computation holds a key no longer than this
+    POLL_SECONDS = 0.05
+    TOUCH_SECONDS = 10  # least-recently-used order is kept to this resolution, sparing a write per hit
+
+    def __init__(self, path, max_entries, ttl_seconds):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.waits = self.evictions = 0
+        conn = self._connect()
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(results)')]
+        if columns and 'epoch' not in columns:
+            # Written before entries carried an epoch; nothing in it can be trusted
+            conn.execute('DROP TABLE results')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, epoch TEXT NOT NULL, version INTEGER NOT NULL, '
+            'payload TEXT, expires_at REAL NOT NULL, used_at REAL NOT NULL)'
+        )
+
+    def _connect(self):
+        """This thread's connection; a forked worker opens its own rather than share its parent's"""
+        if getattr(self.local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            self.local.conn, self.local.pid = conn, os.getpid()
+        return self.local.conn
+
+    def _count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _claim(self, conn, key, epoch, version, now):
+        """Lease the key for this process unless a live result or lease at this version, or a newer one, exists"""
+        cursor = conn.execute(
+            'INSERT INTO results (key, epoch, version, payload, expires_at, used_at) VALUES (?, ?, ?, NULL, ?, ?) '
+            'ON CONFLICT (key) DO UPDATE SET epoch = excluded.epoch, version = excluded.version, payload = NULL, '
+            'expires_at = excluded.expires_at, used_at = excluded.used_at '
+            'WHERE results.epoch != excluded.epoch OR results.version < excluded.version '
+            'OR (results.version = excluded.version AND results.expires_at <= ?)',
+            (key, epoch, version, now + self.LEASE_SECONDS, now, now)
+        )
+        return cursor.rowcount == 1
+
+    def get_or_compute(self, key, epoch, version, compute):
+        conn = self._connect()
+        key = json.dumps(key)
+        waited = False
+        while True:
+            now = time.time()
+            row = conn.execute('SELECT version, payload, expires_at, used_at, epoch FROM results WHERE key = ?',
+                               (key,)).fetchone()
+            if row and row[4] != epoch:
+                row = None
+            if row and row[0] > version:
+                # This request read the data version before a write; its result is not worth keeping
+                self._count('misses')
+                return compute()
+            if row and row[0] == version and row[2] > now:
+                if row[1] is not None:
+                    if row[3] < now - self.TOUCH_SECONDS:
+                        conn.execute('UPDATE results SET used_at = ? WHERE key = ?', (now, key))
+                    self._count('waits' if waited else 'hits')
+                    return json.loads(row[1])
+                # Another worker is computing it
+                waited = True
+                time.sleep(self.POLL_SECONDS)
+                continue
+            if self._claim(conn, key, epoch, version, now):
+                break
+        self._count('misses')
+        try:
+            result = compute()
+        except Exception:
+            conn.execute('DELETE FROM results WHERE key = ? AND epoch = ? AND version = ? AND payload IS NULL',
+                         (key, epoch, version))
+            raise
+        now = time.time()
+        conn.execute('UPDATE results SET payload = ?, expires_at = ?, used_at = ? '
+                     'WHERE key = ? AND epoch = ? AND version = ?',
+                     (json.dumps(result), now + self.ttl_seconds, now, key, epoch, version))
+        self._trim(conn)
+        return result
+
+    def _trim(self, conn):
+        """Drop the least recently used rows beyond max_entries"""
+        excess = conn.execute('SELECT COUNT(*) FROM results').fetchone()[0] - self.max_entries
+        if excess > 0:
+            conn.execute('DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY used_at LIMIT ?)',
+                         (excess,))
+            with self.lock:
+                self.evictions += excess
+
+    def stats(self):
+        """Counters for the admin cache stats endpoint"""
+        entries = self._connect().execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        with self.lock:
+            lookups = self.hits + self.waits + self.misses
+            return {
+                'backend': 'shared',
+                'path': self.path,
+                'entries': entries,
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'waits': self.waits,  # answered by another worker's computation
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.waits) / lookups, 3) if lookups else 0,
+                'evictions': self.evictions
+            }
+
+
+def init_result_cache(app):
+    """Attach the result cache, sized by RESULT_CACHE_SIZE; 0 leaves caching off.
+
+    With RESULT_CACHE_PATH set (relative paths are in the instance folder)
+    the workers share a SharedResultCache; otherwise each keeps its own.
+    """
+    size, ttl = app.config.get('RESULT_CACHE_SIZE'), app.config.get('RESULT_CACHE_TTL')
+    if not size:
+        return
+    path = app.config.get('RESULT_CACHE_PATH')
+    if path:
+        os.makedirs(app.instance_path, exist_ok=True)
+        app.extensions['result_cache'] = SharedResultCache(os.path.join(app.instance_path, path), size, ttl)
+    else:
+        app.extensions['result_cache'] = ResultCache(size, ttl)
+
+
+def cached_result(endpoint, scope, params, compute):
+    """compute() for an endpoint, scope and params, reused until the data epoch or version moves on or it expires.
+
+    The result is shared between requests, so callers must not modify it;
+    from the shared cache it comes back through JSON, as the endpoints
+    return it anyway.
+    """
+    cache = current_app.extensions.get('result_cache')
+    if cache is None:
+        return compute()
+    return cache.get_or_compute((endpoint, scope, tuple(sorted(params.items()))), data_epoch(), data_version(),
+                                compute)
+
+
+def result_cache_stats():
+    """The current app's ResultCache counters, or None when caching is off"""
+    cache = current_app.extensions.get('result_cache')
+    return cache.stats() if cache is not None else None
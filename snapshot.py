@@ -0,0 +1,314 @@
+# snapshot.py - In-memory NumPy copy of the grades that the analytics endpoints group over
+import threading
+from datetime import date
+
+import numpy as np
+from flask import current_app
+from sqlalchemy import Integer, cast, extract, func, select
+
+from models import db, Grade
+from database import data_version
+from aggregates import (SCOPES, DIMENSIONS, ALL_TIME_DIMENSIONS, LABELS, TERM_MONTHS, TREND_PERCENTILES, dimension_names,
+                        first_period, merge_by_name)
+
+FETCH_SIZE = 200000
+EPOCH = date(1970, 1, 1)
+# Snapshot column -> dtype; a missing weekday is stored as 0, real ids start at 1
+COLUMNS = {
+    'day': np.int32,
+    'score': np.float64,
+    'teacher_id': np.int32,
+    'student_id': np.int32,
+    'subject_id': np.int32,
+    'topic_id': np.int32,
+    'weekday_id': np.int32
+}
+# Columns whose grades can be picked out row by row, for a student's stats and the latest scores of any scope
+ROW_SCOPES = ('teacher_id', 'student_id')
+
+
+def day_number(day):
+    """Days since 1970-01-01 of a date or 'YYYY-MM-DD' string, as the snapshot stores exam dates"""
+    if isinstance(day, str):
+        day = date.fromisoformat(day)
+    return (day - EPOCH).days
+
+
+def exam_day_column():
+    """SQL expression for Grade.exam_date as a day number"""
+    if db.engine.dialect.name == 'sqlite':
+        return cast(func.julianday(Grade.exam_date) - 2440587.5, Integer)
+    return cast(func.floor(extract('epoch', Grade.exam_date) / 86400), Integer)
+
+
+def bucket_days(days, bucket):
+    """Day number of the first day of the TREND_BUCKETS period each day number falls in"""
+    if bucket == 'day':
+        return days
+    if bucket == 'week':
+        return days - (days + 3) % 7  # 1970-01-01 was a Thursday
+    months = days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+    if bucket == 'term':
+        months -= months % 12 % TERM_MONTHS
+    return months.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+
+
+def stats_dict(count, total, sum_sq, low, high, first):
+    """value -> stats dict, as aggregate_stats returns, for the values >= first that have grades"""
+    present = np.flatnonzero(count[first:]) + first
+    return {
+        value: {'sum': s, 'count': c, 'sum_sq': q, 'min': lo, 'max': hi}
+        for value, c, s, q, lo, hi in zip(present.tolist(), count[present].astype(np.int64).tolist(),
+                                          total[present].tolist(), sum_sq[present].tolist(),
+                                          low[present].tolist(), high[present].tolist())
+    }
+
+
+def combine(codes, size, count, total, sum_sq, low, high):
+    """Per-value count, sum, sum of squares, min and max over groups labelled with codes.
+
+    Rows can be passed as groups of one, with count None.
+    """
+    lows = np.full(size, np.inf)
+    highs = np.full(size, -np.inf)
+    np.minimum.at(lows, codes, low)
+    np.maximum.at(highs, codes, high)
+    return (np.bincount(codes, weights=count, minlength=size), np.bincount(codes, weights=total, minlength=size),
+            np.bincount(codes, weights=sum_sq, minlength=size), lows, highs)
+
+
+class GradeGroups:
+    """The grades of one aggregate scope and dimension grouped by (scope_id, exam day, value), in that order.
+
+    An in-memory counterpart of the grade_aggregates rows: a window of one
+    scope is a contiguous run of groups, found by binary search.
+    """
+
+    def __init__(self, scope_ids, day_index, days, codes, size, scores):
+        self.days = days
+        self.size = size
+        keys = (scope_ids.astype(np.int64) * days + day_index) * size + codes
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        scores = scores[order]
+        starts = np.flatnonzero(np.diff(keys, prepend=-1))
+        self.keys = keys[starts]
+        self.codes = self.keys % size
+        self.count = np.diff(np.append(starts, len(keys))).astype(np.float64)
+        self.total = np.add.reduceat(scores, starts) if len(starts) else np.zeros(0)
+        self.sum_sq = np.add.reduceat(scores * scores, starts) if len(starts) else np.zeros(0)
+        self.low = np.minimum.reduceat(scores, starts) if len(starts) else np.zeros(0)
+        self.high = np.maximum.reduceat(scores, starts) if len(starts) else np.zeros(0)
+
+    def stats(self, scope_id, first_day):
+        """count, sum, sum of squares, min and max per value for one scope from a day index on"""
+        lo, hi = np.searchsorted(self.keys, [(scope_id * self.days + first_day) * self.size,
+                                             (scope_id + 1) * self.days * self.size])
+        part = slice(lo, hi)
+        return combine(self.codes[part], self.size, self.count[part], self.total[part], self.sum_sq[part],
+                       self.low[part], self.high[part])
+
+
+class GradeSnapshot:
+    """The grades table as NumPy columns at one data version, rows in (exam day, id) order.
+
+    Everyone's and each teacher's stats come from GradeGroups, so they cost
+    the number of days and values in the window rather than the number of
+    grades. A student's grades are few and are grouped row by row, found
+    through a row order sorted by student that keeps them in day order.
+    """
+
+    def __init__(self, version, columns, names):
+        self.version = version
+        self.columns = columns
+        self.names = names
+        day = columns['day']
+        scores = columns['score']
+        new_day = np.diff(day, prepend=day[:1] - 1) != 0
+        self.days = day[new_day]
+        day_index = np.cumsum(new_day) - 1
+        self.sizes = {dimension: int(columns[column].max()) + 1 if column and len(scores) else 1
+                      for dimension, column in DIMENSIONS.items()}
+        self.groups = {}
+        for scope, scope_column in SCOPES.items():
+            scope_ids = columns[scope_column] if scope_column else np.zeros(len(scores), dtype=np.int32)
+            for dimension in DIMENSIONS:
+                # Like the aggregates, dimensions nothing windows by date are grouped over all days at once
+                all_time = dimension in ALL_TIME_DIMENSIONS
+                self.groups[scope, dimension] = GradeGroups(
+                    scope_ids, 0 if all_time else day_index, 1 if all_time else max(len(self.days), 1),
+                    self._codes(dimension), self.sizes[dimension], scores
+                )
+        self.orders = {}
+        for column in ROW_SCOPES:
+            order = np.argsort(columns[column], kind='stable').astype(np.int32)
+            self.orders[column] = (order, columns[column][order], day[order])
+
+    def _codes(self, dimension, rows=slice(None)):
+        column = DIMENSIONS[dimension]
+        if column:
+            return self.columns[column][rows]
+        return np.zeros(len(self.columns['score'][rows]), dtype=np.int32)
+
+    def rows(self, student_id=None, teacher_id=None, since=None, last=None):
+        """Row indices of a scope's grades from the datetime since on, in exam-day order; only the last few if given"""
+        # Search keys take the arrays' int32 dtype, or NumPy would convert the whole array to compare
+        start = np.int32(day_number(first_period(since))) if since is not None else None
+        if not student_id and not teacher_id:
+            size = len(self.columns['day'])
+            first = np.searchsorted(self.columns['day'], start) if start is not None else 0
+            return np.arange(max(first, size - last) if last else first, size)
+        column, scope_id = ('student_id', student_id) if student_id else ('teacher_id', teacher_id)
+        order, ids, days = self.orders[column]
+        lo, hi = np.searchsorted(ids, np.array([scope_id, scope_id + 1], dtype=ids.dtype))
+        if start is not None:
+            lo += np.searchsorted(days[lo:hi], start)
+        rows = order[lo:hi]
+        if student_id and teacher_id:
+            rows = rows[self.columns['teacher_id'][rows] == teacher_id]
+        return rows[-last:] if last else rows
+
+    def stats(self, dimension, student_id=None, teacher_id=None, since=None):
+        """value (an id, 0 for 'overall') -> stats dict, as aggregate_stats returns for the same scope"""
+        first = 1 if DIMENSIONS[dimension] else 0
+        if student_id:
+            rows = self.rows(student_id, teacher_id, since)
+            scores = self.columns['score'][rows]
+            return stats_dict(*combine(self._codes(dimension, rows), self.sizes[dimension], None, scores,
+                                       scores * scores, scores, scores), first)
+        groups = self.groups['teacher' if teacher_id else 'all', dimension]
+        first_day = 0
+        if since is not None and dimension not in ALL_TIME_DIMENSIONS:
+            first_day = np.searchsorted(self.days, np.int32(day_number(first_period(since))))
+        return stats_dict(*groups.stats(teacher_id or 0, first_day), first)
+
+    def scope_stats(self, dimensions, student_id=None, teacher_id=None, since=None):
+        """dimension -> stats for one scope, keyed by display name for the dimensions in LABELS"""
+        result = {}
+        for dimension in dimensions:
+            stats = self.stats(dimension, student_id, teacher_id, since)
+            result[dimension] = merge_by_name(stats, self.names[dimension]) if dimension in LABELS else stats
+        return result
+
+    def recent(self, limit, student_id=None, teacher_id=None, since=None):
+        """(dates as 'YYYY-MM-DD', scores) of a scope's last grades, oldest first"""
+        rows = self.rows(student_id, teacher_id, since, last=limit)
+        dates = self.columns['day'][rows].astype('datetime64[D]').astype(str)
+        return dates.tolist(), self.columns['score'][rows].tolist()
+
+    def trend(self, bucket, student_id=None, teacher_id=None, subject_id=None, since=None):
+        """Per-bucket count, mean, min, max and TREND_PERCENTILES of a scope's scores, as performance_trend returns"""
+        rows = self.rows(student_id, teacher_id, since)
+        if subject_id:
+            rows = rows[self.columns['subject_id'][rows] == subject_id]
+        starts = bucket_days(self.columns['day'][rows], bucket)
+        scores = self.columns['score'][rows]
+        # By score, then stably by bucket: two plain sorts, quicker than np.lexsort on a million grades
+        order = np.argsort(scores)
+        order = order[np.argsort(starts[order], kind='stable')]
+        starts, scores = starts[order], scores[order]
+        first = np.flatnonzero(np.diff(starts, prepend=starts[:1] - 1))
+        count = np.diff(np.append(first, len(starts)))
+        means = np.add.reduceat(scores, first) / count if len(first) else np.zeros(0)
+        points = {
+            'start': starts[first].astype('datetime64[D]').astype(str).tolist(),
+            'count': count.tolist(),
+            'mean': [round(value, 2) for value in means.tolist()],
+            'min': scores[first].tolist(),
+            'max': scores[first + count - 1].tolist()
+        }
+        for percentile in TREND_PERCENTILES:
+            # Nearest rank: the lowest score with at least percentile% of its bucket at or below it
+            points[f'p{percentile}'] = scores[first + (count * percentile + 99) // 100 - 1].tolist()
+        return [dict(zip(points, values)) for values in zip(*points.values())]
+
+
+def load_snapshot(fetch_size=FETCH_SIZE):
+    """Read the grades into a GradeSnapshot; None if they changed while being read.
+
+    Rows are fetched straight from the DBAPI cursor in id order, which
+    skips building a result row object per grade and the database sort,
+    and are put into day order with a stable sort here.
+    """
+    version = data_version()
+    query = select(
+        exam_day_column(), Grade.score, Grade.teacher_id, Grade.student_id, Grade.subject_id, Grade.topic_id,
+        func.coalesce(Grade.weekday_id, 0)
+    ).order_by(Grade.id)
+    cursor = db.session.connection().execute(query).cursor
+    parts = []
+    while True:
+        chunk = cursor.fetchmany(fetch_size)
+        if not chunk:
+            break
+        parts.append(np.array(chunk, dtype=np.float64))
+    table = np.concatenate(parts) if parts else np.empty((0, len(COLUMNS)))
+    table = table[np.argsort(table[:, 0], kind='stable')]
+    columns = {name: table[:, i].astype(dtype) for i, (name, dtype) in enumerate(COLUMNS.items())}
+    names = {dimension: dimension_names(dimension) for dimension in LABELS}
+    if data_version() != version:
+        return None
+    return GradeSnapshot(version, columns, names)
+
+
+class SnapshotHolder:
+    """The app's current GradeSnapshot, rebuilt on a background thread when the data version moves on.
+
+    With more than max_rows grades (0 = no limit) none is built and the
+    analytics read the database, so a large dataset cannot take each
+    worker's memory.
+    """
+
+    def __init__(self, app, max_rows=0):
+        self.app = app
+        self.max_rows = max_rows
+        self.snapshot = None
+        self.refused_version = None  # data version found too large to snapshot
+        self.building = False
+        self.lock = threading.Lock()
+
+    def current(self):
+        """The snapshot if it matches the data version, else None after starting a rebuild"""
+        snapshot = self.snapshot
+        version = data_version()
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        if self.refused_version == version:
+            return None
+        with self.lock:
+            if self.building:
+                return None
+            self.building = True
+        threading.Thread(target=self._rebuild, name='grade-snapshot', daemon=True).start()
+        return None
+
+    def _rebuild(self):
+        try:
+            with self.app.app_context():
+                version = data_version()
+                rows = db.session.execute(select(func.count()).select_from(Grade)).scalar()
+                if self.max_rows and rows > self.max_rows:
+                    print(f"⚠️  {rows} grades exceed ANALYTICS_SNAPSHOT_MAX_ROWS ({self.max_rows}), "
+                          f"serving analytics from the database")
+                    self.snapshot = None
+                    self.refused_version = version
+                    return
+                snapshot = load_snapshot()
+            if snapshot is not None:
+                self.snapshot = snapshot
+        except Exception as e:
+            print(f"⚠️  Could not build the analytics snapshot: {e}")
+        finally:
+            self.building = False
+
+
+def init_snapshot(app):
+    """Register the snapshot holder when ANALYTICS_SNAPSHOT is on; it is first built on demand"""
+    if app.config.get('ANALYTICS_SNAPSHOT'):
+        app.extensions['grade_snapshot'] = SnapshotHolder(app, app.config.get('ANALYTICS_SNAPSHOT_MAX_ROWS') or 0)
+
+
+def current_snapshot():
+    """The current app's up-to-date GradeSnapshot, or None while there is none (use the database then)"""
+    holder = current_app.extensions.get('grade_snapshot')
+    return holder.current() if holder is not None else None
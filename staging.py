@@ -0,0 +1,160 @@
+# staging.py - Build a replacement dataset in shadow tables and swap it in with renames
+import re
+
+from sqlalchemy import MetaData
+
+from models import db
+
+# Everything a full replacement rewrites, in dependency order
+STAGED_TABLES = ('users', 'teachers', 'students', 'subjects', 'topics', 'weekdays', 'grades', 'grade_aggregates',
+                 'grade_histograms')
+STAGING_SUFFIX = '__staging'
+RETIRED_SUFFIX = '__retired'
+# SQLite index names are global, so a staged table's indexes alternate between two names
+ALT_INDEX_SUFFIX = '__b'
+
+
+def supports_staging():
+    """Renaming tables inside one transaction is only relied on for SQLite"""
+    return db.engine.dialect.name == 'sqlite'
+
+
+def canonical_index_name(name):
+    """Model index name for an index that may carry the alternate suffix"""
+    return name[:-len(ALT_INDEX_SUFFIX)] if name.endswith(ALT_INDEX_SUFFIX) else name
+
+
+def live_tables():
+    """Table objects the loader writes to by default"""
+    return {name: db.metadata.tables[name] for name in STAGED_TABLES}
+
+
+def staging_tables():
+    """Table objects for the shadow copies, shaped like the live tables for the loader"""
+    metadata = MetaData()
+    return {name: table.to_metadata(metadata, name=name + STAGING_SUFFIX) for name, table in live_tables().items()}
+
+
+def _sqlite_objects(conn, object_type):
+    rows = conn.exec_driver_sql('SELECT name, sql FROM sqlite_master WHERE type = ?', (object_type,))
+    return dict(rows.all())
+
+
+def staging_tables_exist():
+    conn = db.session.connection()
+    existing = _sqlite_objects(conn, 'table')
+    return all(name + STAGING_SUFFIX in existing for name in STAGED_TABLES)
+
+
+def _drop_tables(suffix):
+    conn = db.session.connection()
+    for name in reversed(STAGED_TABLES):
+        conn.exec_driver_sql(f'DROP TABLE IF EXISTS "{name}{suffix}"')
+
+
+def _create_staging_indexes(conn, tables, unique):
+    """Create the model's unique or non-unique indexes on the shadow tables, under free names"""
+    index_names = set(_sqlite_objects(conn, 'index'))
+    for name in STAGED_TABLES:
+        built = {canonical_index_name(index_name) for index_name in conn.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ?", (name + STAGING_SUFFIX,)
+        ).scalars()}
+        staged_indexes = {tuple(column.name for column in index.columns): index for index in tables[name].indexes}
+        for model_index in db.metadata.tables[name].indexes:
+            if bool(model_index.unique) != unique or model_index.name in built:
+                continue
+            index = staged_indexes[tuple(column.name for column in model_index.columns)]
+            index.name = model_index.name + ALT_INDEX_SUFFIX if model_index.name in index_names else model_index.name
+            index.create(conn)
+
+
+def create_staging_tables():
+    """(Re)create empty shadow tables and seed them with the accounts a replacement keeps.
+
+    Table DDL is copied from the live schema so foreign keys keep naming the
+    live tables. Only the unique indexes the upserts rely on are created
+    here; build_staging_indexes adds the rest once the data is in, which is
+    much cheaper than maintaining them row by row. Admins and any user
+    outside the teacher/student roles are carried over, matching what the
+    in-place replacement used to keep.
+    """
+    conn = db.session.connection()
+    _drop_tables(STAGING_SUFFIX)
+    table_ddl = _sqlite_objects(conn, 'table')
+    tables = staging_tables()
+
+    for name in STAGED_TABLES:
+        ddl = re.sub(r'^CREATE TABLE\s+["`\[]?' + name + r'["`\]]?', f'CREATE TABLE "{name}{STAGING_SUFFIX}"',
+                     table_ddl[name], count=1)
+        conn.exec_driver_sql(ddl)
+    _create_staging_indexes(conn, tables, unique=True)
+
+    conn.exec_driver_sql(
+        f"INSERT INTO users{STAGING_SUFFIX} SELECT * FROM users WHERE id = 1 OR role NOT IN ('teacher', 'student')"
+    )
+    for name in ('teachers', 'students'):
+        conn.exec_driver_sql(
+            f'INSERT INTO {name}{STAGING_SUFFIX} SELECT * FROM {name} WHERE user_id = 1 OR user_id IS NULL'
+        )
+    return tables
+
+
+def discard_staging_tables():
+    """Drop shadow tables left by an interrupted replacement, e.g. once a schema change makes them stale"""
+    _drop_tables(STAGING_SUFFIX)
+    db.session.commit()
+
+
+def build_staging_indexes():
+    """Create the secondary indexes on the loaded shadow tables, ahead of the swap"""
+    _create_staging_indexes(db.session.connection(), staging_tables(), unique=False)
+
+
+def validate_staging():
+    """Raise ValueError if the staged data has rows pointing at missing parents"""
+    conn = db.session.connection()
+    s = STAGING_SUFFIX
+    checks = {
+        'grades without a student': f'SELECT COUNT(*) FROM grades{s} g LEFT JOIN students{s} p ON p.id = g.student_id WHERE p.id IS NULL',
+        'grades without a teacher': f'SELECT COUNT(*) FROM grades{s} g LEFT JOIN teachers{s} p ON p.id = g.teacher_id WHERE p.id IS NULL',
+        'grades without a subject': f'SELECT COUNT(*) FROM grades{s} g LEFT JOIN subjects{s} p ON p.id = g.subject_id WHERE p.id IS NULL',
+        'grades without a topic': f'SELECT COUNT(*) FROM grades{s} g LEFT JOIN topics{s} p ON p.id = g.topic_id WHERE p.id IS NULL',
+        'grades without a weekday': f'SELECT COUNT(*) FROM grades{s} g LEFT JOIN weekdays{s} p ON p.id = g.weekday_id WHERE g.weekday_id IS NOT NULL AND p.id IS NULL',
+        'teachers without a user': f'SELECT COUNT(*) FROM teachers{s} t LEFT JOIN users{s} u ON u.id = t.user_id WHERE t.user_id IS NOT NULL AND u.id IS NULL',
+        'students without a user': f'SELECT COUNT(*) FROM students{s} t LEFT JOIN users{s} u ON u.id = t.user_id WHERE t.user_id IS NOT NULL AND u.id IS NULL',
+    }
+    problems = []
+    for label, sql in checks.items():
+        count = conn.exec_driver_sql(sql).scalar()
+        if count:
+            problems.append(f'{count} {label}')
+    if problems:
+        raise ValueError(f"Staged data failed validation: {', '.join(problems)}")
+
+
+def swap_staging_tables():
+    """Rename the shadow tables over the live ones inside the session's transaction.
+
+    legacy_alter_table stops SQLite from rewriting other tables' REFERENCES
+    clauses to follow the retired tables. The caller commits, then calls
+    drop_retired_tables outside the swap so freeing pages does not hold
+    the write lock.
+    """
+    conn = db.session.connection()
+    # pysqlite only opens a transaction implicitly before DML; without one each rename would commit on its own
+    if not conn.connection.dbapi_connection.in_transaction:
+        conn.exec_driver_sql('BEGIN IMMEDIATE')
+    conn.exec_driver_sql('PRAGMA legacy_alter_table = ON')
+    try:
+        for name in STAGED_TABLES:
+            conn.exec_driver_sql(f'DROP TABLE IF EXISTS "{name}{RETIRED_SUFFIX}"')
+            conn.exec_driver_sql(f'ALTER TABLE "{name}" RENAME TO "{name}{RETIRED_SUFFIX}"')
+        for name in STAGED_TABLES:
+            conn.exec_driver_sql(f'ALTER TABLE "{name}{STAGING_SUFFIX}" RENAME TO "{name}"')
+    finally:
+        conn.exec_driver_sql('PRAGMA legacy_alter_table = OFF')
+
+
+def drop_retired_tables():
+    _drop_tables(RETIRED_SUFFIX)
+    db.session.commit()
@@ -0,0 +1,121 @@
+# conftest.py - Scratch database, app and grade data shared by the tests
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+
+# The app reads its config at import, so point it at a scratch database first
+WORKDIR = tempfile.mkdtemp(prefix='grade_analytics_tests_')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(WORKDIR, 'test.db')
+os.environ['IMPORT_REPORT_DIR'] = os.path.join(WORKDIR, 'import_reports')
+os.environ['UPLOAD_SCRATCH_DIR'] = WORKDIR
+# The profile the gunicorn workers load: WAL, busy_timeout and the shared result cache
+os.environ['FLASK_CONFIG'] = 'production'
+os.environ['RESULT_CACHE_PATH'] = os.path.join(WORKDIR, 'analytics_cache.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import MetaData, select
+
+from app import app as flask_app
+from migrations import upgrade_schema
+from models import db, User, GradeAggregate, GradeHistogram
+
+ADMIN_PASSWORD = 'password321'
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+def reset_database():
+    db.session.remove()
+    # Reflect rather than use the models so leftover staging and retired tables go too
+    metadata = MetaData()
+    metadata.reflect(bind=db.engine)
+    metadata.drop_all(bind=db.engine)
+    upgrade_schema()
+    admin = User(username='admin', email='admin@tutoring.com', role='admin')
+    admin.set_password(ADMIN_PASSWORD)
+    db.session.add(admin)
+    db.session.commit()
+
+
+@pytest.fixture
+def app():
+    flask_app.config['TESTING'] = True
+    with flask_app.app_context():
+        reset_database()
+        yield flask_app
+        db.session.remove()
+
+
+@pytest.fixture
+def admin_client(app):
+    client = app.test_client()
+    response = client.post('/login', data={'username': 'admin', 'password': ADMIN_PASSWORD})
+    assert response.status_code == 302
+    return client
+
+
+def make_grades(students=6, subjects=('Maths', 'Physics'), topics=('Algebra', 'Mechanics'), tests=4,
+                teachers=('Ms Smith', 'Mr Jones'), start=None, score_offset=0):
+    """A valid grades frame: every student sits every subject and topic on ``tests`` weekly test dates"""
+    start = start or date.today() - timedelta(days=7 * tests)
+    rows = []
+    for s in range(students):
+        for j, subject in enumerate(subjects):
+            for k, topic in enumerate(topics):
+                for t in range(tests):
+                    test_date = start + timedelta(days=7 * t + j)
+                    rows.append({
+                        'Student_ID': f'S{s:03d}',
+                        'Student_Name': f'Student {s}',
+                        'Subject': subject,
+                        'Topic': topic,
+                        'Test_Date': test_date.isoformat(),
+                        'Day': test_date.strftime('%A'),
+                        'Teacher_Name': teachers[(s + j) % len(teachers)],
+                        'Score': float((40 + 7 * s + 11 * j + 5 * k + 3 * t + score_offset) % 101)
+                    })
+    return pd.DataFrame(rows)
+
+
+def write_grades(df, path):
+    df.to_csv(path, index=False)
+    return str(path)
+
+
+def aggregate_rows():
+    """Every aggregate and histogram row as comparable tuples, ids left out"""
+    aggregates = sorted(
+        (row.scope, row.scope_id, row.dimension, row.value, row.period, round(row.score_sum, 6),
+         round(row.score_sum_sq, 6), row.score_count, row.score_min, row.score_max)
+        for row in db.session.execute(select(GradeAggregate)).scalars()
+    )
+    histograms = sorted(
+        (row.scope, row.scope_id, row.dimension, row.value, row.bin, row.grade_count)
+        for row in db.session.execute(select(GradeHistogram)).scalars()
+    )
+    return aggregates, histograms
+
+
+def upload_grades(client, path, mode):
+    with open(path, 'rb') as f:
+        return client.post('/admin/upload-csv', data={'csv_file': (f, os.path.basename(path)), 'mode': mode},
+                           content_type='multipart/form-data')
+
+
+def wait_for_job(client, job_id, timeout=60):
+    """Poll an import job until it leaves queued/running and return its status"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = client.get(f'/admin/jobs/{job_id}').get_json()
+        if status['status'] not in ('queued', 'running'):
+            return status
+        time.sleep(0.05)
+    raise AssertionError(f'Job {job_id} still running after {timeout}s')
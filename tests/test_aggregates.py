@@ -0,0 +1,37 @@
+from conftest import aggregate_rows, make_grades, write_grades
+from aggregates import delete_grades, rebuild_aggregates
+from import_csv import merge_csv_file
+from ingest import bulk_load_grades
+from models import db, Grade
+
+
+def assert_matches_rebuild():
+    maintained = aggregate_rows()
+    rebuild_aggregates()
+    db.session.commit()
+    assert maintained == aggregate_rows()
+
+
+def test_aggregates_after_merge_match_full_rebuild(app, tmp_path):
+    bulk_load_grades(make_grades())
+    db.session.commit()
+
+    # Overlapping keys with new scores (moving group minimums and maximums), new students and a new teacher
+    merged = make_grades(students=9, teachers=('Ms Smith', 'Mr Jones', 'Dr Patel'), score_offset=37)
+    result = merge_csv_file(write_grades(merged, tmp_path / 'merge.csv'))
+    assert result['success']
+    assert result['grades_updated'] > 0
+    assert result['grades_added'] > 0
+
+    assert_matches_rebuild()
+
+
+def test_aggregates_after_delete_match_full_rebuild(app):
+    bulk_load_grades(make_grades())
+    db.session.commit()
+
+    # A minority of rows, so the grades are retracted rather than the aggregates rebuilt
+    assert delete_grades(Grade.score >= 90) * 2 < len(make_grades())
+    db.session.commit()
+
+    assert_matches_rebuild()
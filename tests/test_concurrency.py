@@ -0,0 +1,91 @@
+import threading
+import time
+
+from sqlalchemy import func, select
+
+from conftest import aggregate_rows, make_grades, write_grades
+from aggregates import rebuild_aggregates
+from database import current_pragmas
+from diagnostics import reads_during_import
+from import_csv import merge_csv_file
+from jobs import ImportBusyError, create_job, run_job
+from models import db, Grade, ImportJob, ImportLock
+
+
+def test_app_runs_on_the_production_profile(app):
+    pragmas = current_pragmas(db.session.connection(), ['journal_mode', 'busy_timeout'])
+    assert pragmas['journal_mode'] == 'wal'
+    assert pragmas['busy_timeout'] > 0
+
+
+def test_reads_keep_going_during_a_chunked_import(app, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'IMPORT_CHUNK_SIZE', 100)
+    grades = make_grades(students=60)
+    path = write_grades(grades, tmp_path / 'big.csv')
+
+    def load():
+        job = create_job('cli_import', source_name='big.csv')
+        return run_job(job.id, merge_csv_file, path)
+
+    result = reads_during_import(load, max_stall=2.0)
+    assert result['load']['success']
+    assert result['load']['chunks'] >= 10
+    assert result['reads'] > 0
+    assert result['read_error_count'] == 0, result['read_errors']
+    assert result['ok'], result
+
+
+def test_concurrent_imports_take_turns_on_the_lock(app, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'IMPORT_CHUNK_SIZE', 50)
+    files = [make_grades(students=8, score_offset=0),
+             make_grades(students=12, score_offset=17),
+             make_grades(students=10, teachers=('Dr Patel',), score_offset=29)]
+    paths = [write_grades(grades, tmp_path / f'part{n}.csv') for n, grades in enumerate(files)]
+    results, overlaps, busy = [], [], []
+    start = threading.Barrier(len(paths))
+
+    def guarded_merge(path, job_id, on_progress=None):
+        # Only the lock holder may be writing, and no other job may be running alongside it
+        holder = db.session.execute(select(ImportLock.job_id)).scalar()
+        running = db.session.execute(
+            select(func.count(ImportJob.id)).where(ImportJob.status == 'running')).scalar()
+        if holder != job_id or running != 1:
+            overlaps.append((job_id, holder, running))
+        return merge_csv_file(path, on_progress=on_progress)
+
+    def import_when_free(path):
+        with app.app_context():
+            start.wait()
+            while True:
+                try:
+                    job = create_job('cli_import', source_name=path)
+                    break
+                except ImportBusyError as e:
+                    busy.append(e.job_id)
+                    db.session.remove()
+                    time.sleep(0.02)
+            job_id = job.id
+            results.append(run_job(job_id, guarded_merge, path, job_id))
+            db.session.remove()
+
+    db.session.remove()
+    threads = [threading.Thread(target=import_when_free, args=(path,)) for path in paths]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=120)
+
+    assert not overlaps
+    assert busy, 'the imports never had to wait for each other'
+    assert len(results) == len(paths) and all(result['success'] for result in results), \
+        [result.get('error') for result in results]
+    natural_keys = ['Student_ID', 'Subject', 'Topic', 'Test_Date']
+    expected = len(set().union(*(set(map(tuple, grades[natural_keys].values)) for grades in files)))
+    assert db.session.execute(select(func.count(Grade.id))).scalar() == expected
+    assert db.session.execute(select(ImportLock.job_id)).scalar() is None
+    statuses = db.session.execute(select(ImportJob.status)).scalars().all()
+    assert statuses == ['completed'] * len(paths)
+
+    maintained = aggregate_rows()
+    rebuild_aggregates()
+    assert maintained == aggregate_rows()
@@ -0,0 +1,29 @@
+from conftest import make_grades
+from diagnostics import explain_hot_queries
+from ingest import bulk_load_grades
+from models import db
+
+
+def test_dashboard_queries_are_served_by_their_indexes(app):
+    bulk_load_grades(make_grades())
+    db.session.commit()
+    db.session.execute(db.text('ANALYZE'))
+
+    results = explain_hot_queries()
+    assert {result['query'] for result in results} >= {
+        'aggregate breakdown for a teacher since a date', 'performance trend for a teacher',
+        'score distribution for a teacher'
+    }
+    assert [result['query'] for result in results if not result['ok']] == []
+
+
+def test_a_missing_index_is_reported(app):
+    db.session.execute(db.text('DROP INDEX uq_grade_histograms_key'))
+    db.session.commit()
+    # Pooled connections cache prepared EXPLAINs, which never notice a schema change
+    db.session.remove()
+    db.engine.dispose()
+
+    failed = [result for result in explain_hot_queries() if not result['ok']]
+    assert [result['query'] for result in failed] == ['score distribution for a teacher']
+    assert any(line.startswith('SCAN grade_histograms') for line in failed[0]['plan'])
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from sqlalchemy import select
+
+from conftest import make_grades
+from aggregates import HISTOGRAM_BINS, aggregate_histograms, histogram_percentiles, score_bins
+from analytics import DISTRIBUTION_PERCENTILES, score_distribution
+from ingest import bulk_load_grades
+from models import db, Student, Teacher
+from validation import SCORE_MAX, SCORE_MIN
+
+BIN_WIDTH = (SCORE_MAX - SCORE_MIN) / HISTOGRAM_BINS
+
+
+@pytest.fixture
+def grades(app):
+    df = make_grades(students=20, subjects=('Maths', 'Physics', 'Chemistry'), tests=6,
+                     teachers=('Ms Smith', 'Mr Jones', 'Dr Patel'))
+    df['Score'] = np.random.default_rng(7).uniform(SCORE_MIN, SCORE_MAX, len(df)).round(1)
+    bulk_load_grades(df)
+    db.session.commit()
+    return df
+
+
+def exact_percentiles(scores):
+    return np.percentile(scores, DISTRIBUTION_PERCENTILES, method='inverted_cdf')
+
+
+def assert_close(estimated, scores):
+    # Each estimate lies in the bin of the exact percentile; the API also rounds to 0.1
+    assert np.all(np.abs(np.asarray(estimated, dtype=float) - exact_percentiles(scores)) <= BIN_WIDTH + 0.05)
+
+
+def teacher_ids():
+    return dict(db.session.execute(select(Teacher.full_name, Teacher.id)).all())
+
+
+def test_stored_histograms_reproduce_raw_percentiles(grades):
+    assert_close(histogram_percentiles(aggregate_histograms('all', 'overall')[0], DISTRIBUTION_PERCENTILES),
+                 grades['Score'])
+    for name, teacher_id in teacher_ids().items():
+        counts = aggregate_histograms('teacher', 'overall', teacher_id)[0]
+        assert_close(histogram_percentiles(counts, DISTRIBUTION_PERCENTILES),
+                     grades.loc[grades['Teacher_Name'] == name, 'Score'])
+
+
+def test_merged_histograms_are_the_histogram_of_the_merged_scores(grades):
+    ids = teacher_ids()
+    merged = aggregate_histograms('teacher', 'overall', ids['Ms Smith'])[0] \
+        + aggregate_histograms('teacher', 'overall', ids['Dr Patel'])[0]
+    scores = grades.loc[grades['Teacher_Name'].isin(['Ms Smith', 'Dr Patel']), 'Score']
+    assert merged.tolist() == np.bincount(score_bins(scores.to_numpy()), minlength=HISTOGRAM_BINS).tolist()
+    assert_close(histogram_percentiles(merged, DISTRIBUTION_PERCENTILES), scores)
+
+
+def test_distribution_endpoint_groups_match_raw_percentiles(grades):
+    distribution = score_distribution('subject')
+    assert set(distribution) == set(grades['Subject'])
+    for subject, group in distribution.items():
+        scores = grades.loc[grades['Subject'] == subject, 'Score']
+        assert group['count'] == len(scores)
+        assert_close(list(group['percentiles'].values()), scores)
+
+
+def test_student_distribution_matches_their_raw_percentiles(grades):
+    student_id = db.session.execute(select(Student.id).where(Student.student_id == 'S004')).scalar()
+    group = score_distribution('overall', student_id=student_id)['overall']
+    scores = grades.loc[grades['Student_ID'] == 'S004', 'Score']
+    assert group['count'] == len(scores)
+    assert_close(list(group['percentiles'].values()), scores)
@@ -0,0 +1,58 @@
+from sqlalchemy import func, select
+
+from conftest import make_grades
+from ingest import bulk_load_grades, upsert_grades
+from models import db, Grade
+
+
+def grade_rows():
+    columns = [column for column in Grade.__table__.columns if column.name != 'id']
+    return [dict(row._mapping) for row in db.session.execute(select(*columns)).all()]
+
+
+def test_reloading_the_same_rows_changes_nothing(app):
+    df = make_grades()
+    first = bulk_load_grades(df)
+    db.session.commit()
+    assert first['grades_added'] == len(df)
+
+    second = bulk_load_grades(df)
+    db.session.commit()
+    assert second['grades_added'] == 0
+    assert second['grades_updated'] == 0
+    assert second['grades_unchanged'] == len(df)
+    assert db.session.execute(select(func.count(Grade.id))).scalar() == len(df)
+
+
+def test_upsert_updates_a_changed_score_in_place(app):
+    df = make_grades()
+    bulk_load_grades(df)
+    db.session.commit()
+    ids_before = set(db.session.execute(select(Grade.id)).scalars())
+
+    changed = df.copy()
+    changed.loc[0, 'Score'] = (changed.loc[0, 'Score'] + 13) % 101
+    stats = bulk_load_grades(changed)
+    db.session.commit()
+    assert stats['grades_added'] == 0
+    assert stats['grades_updated'] == 1
+    assert stats['grades_unchanged'] == len(df) - 1
+    assert set(db.session.execute(select(Grade.id)).scalars()) == ids_before
+    assert changed.loc[0, 'Score'] in db.session.execute(select(Grade.score)).scalars().all()
+
+
+def test_upsert_grades_matches_rows_on_the_natural_key(app):
+    bulk_load_grades(make_grades())
+    db.session.commit()
+    rows = grade_rows()
+
+    stats = upsert_grades(rows)
+    db.session.commit()
+    assert stats == {'grades_added': 0, 'grades_updated': 0, 'grades_unchanged': len(rows)}
+
+    # Same student, subject, topic and date with a new score is the same grade
+    rows[0]['score'] = (rows[0]['score'] + 1) % 101
+    stats = upsert_grades(rows)
+    db.session.commit()
+    assert stats == {'grades_added': 0, 'grades_updated': 1, 'grades_unchanged': len(rows) - 1}
+    assert db.session.execute(select(func.count(Grade.id))).scalar() == len(rows)
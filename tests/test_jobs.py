@@ -0,0 +1,34 @@
+from sqlalchemy import select
+
+from conftest import make_grades, upload_grades, write_grades
+from jobs import create_job, reap_orphaned_jobs, run_job
+from models import db, ImportJob, ImportLock
+
+
+def lock_holder():
+    return db.session.execute(select(ImportLock.job_id)).scalar()
+
+
+def test_upload_is_refused_while_another_import_holds_the_lock(app, admin_client, tmp_path):
+    job = create_job('cli_import', source_name='other.csv')
+    job_id = job.id
+
+    response = upload_grades(admin_client, write_grades(make_grades(), tmp_path / 'busy.csv'), 'merge')
+    assert response.status_code == 409
+    assert response.get_json()['job_id'] == job_id
+
+    db.session.remove()
+    assert run_job(job_id, lambda on_progress=None: {'success': True})['success']
+    assert lock_holder() is None
+    assert create_job('cli_import').id != job_id
+
+
+def test_jobs_of_a_stopped_worker_are_failed_and_release_the_lock(app):
+    job = create_job('cli_import', source_name='orphan.csv')
+    job_id = job.id
+    job.worker_pid = None
+    db.session.commit()
+
+    assert reap_orphaned_jobs() == 1
+    assert db.session.get(ImportJob, job_id).status == 'failed'
+    assert lock_holder() is None
@@ -0,0 +1,85 @@
+from sqlalchemy import inspect, select
+
+from conftest import aggregate_rows, make_grades
+from aggregates import rebuild_aggregates
+from diagnostics import grade_dimension_problems
+from ingest import bulk_load_grades
+from migrations import grades_constraint_drift, upgrade_schema
+from models import db, Grade, Student, Subject, Topic, Weekday
+
+
+def grade_rows():
+    """Every grade by natural key and names, so rows compare across re-encoded ids"""
+    return sorted(db.session.execute(
+        select(Student.student_id, Subject.name, Topic.name, Grade.exam_date, Weekday.name, Grade.score)
+        .join(Student, Student.id == Grade.student_id).join(Subject, Subject.id == Grade.subject_id)
+        .join(Topic, Topic.id == Grade.topic_id).outerjoin(Weekday, Weekday.id == Grade.weekday_id)
+    ).all())
+
+
+def execute(*statements):
+    for statement in statements:
+        db.session.execute(db.text(statement))
+    db.session.commit()
+
+
+def assert_matches_model():
+    inspector = inspect(db.engine)
+    columns = {column['name']: column for column in inspector.get_columns('grades')}
+    foreign_keys = {tuple(key['constrained_columns']): key['referred_table']
+                    for key in inspector.get_foreign_keys('grades')}
+    assert grades_constraint_drift() == []
+    assert not columns['topic_id']['nullable']
+    assert foreign_keys[('topic_id',)] == 'topics'
+    assert foreign_keys[('weekday_id',)] == 'weekdays'
+    assert grade_dimension_problems() == {}
+
+
+def test_legacy_text_columns_are_encoded_into_the_model_schema(app):
+    bulk_load_grades(make_grades())
+    db.session.commit()
+    expected = grade_rows()
+    # The shape before topics and weekdays had tables: free text on every grade, no constraints
+    execute(
+        'CREATE TABLE grades_legacy AS SELECT g.id, g.student_id, g.teacher_id, g.subject_id, g.score, '
+        't.name AS topic, w.name AS day_of_week, g.exam_date, g.created_at '
+        'FROM grades g JOIN topics t ON t.id = g.topic_id LEFT JOIN weekdays w ON w.id = g.weekday_id',
+        "INSERT INTO grades_legacy (student_id, teacher_id, subject_id, score, topic, exam_date) "
+        "SELECT student_id, teacher_id, subject_id, 50, ' ', '2020-01-06 00:00:00.000000' FROM grades LIMIT 1",
+        'DROP TABLE grades', 'ALTER TABLE grades_legacy RENAME TO grades', 'DELETE FROM topics', 'DELETE FROM weekdays'
+    )
+    db.session.remove()
+
+    result = upgrade_schema()
+    assert set(result['encoded']) == {'topic', 'day_of_week'}
+    assert 'topic_id NOT NULL' in result['constraints']
+    assert_matches_model()
+    # The grade with a blank topic cannot be kept
+    assert grade_rows() == expected
+
+
+def test_columns_added_without_constraints_are_rebuilt(app):
+    bulk_load_grades(make_grades())
+    db.session.commit()
+    # What an ADD COLUMN migration leaves behind, plus a grade pointing at a deleted weekday
+    execute(
+        'CREATE TABLE grades_added AS SELECT * FROM grades', 'DROP TABLE grades',
+        'ALTER TABLE grades_added RENAME TO grades',
+        'UPDATE grades SET weekday_id = 999 WHERE id = (SELECT MIN(id) FROM grades)'
+    )
+    assert grade_dimension_problems() == {'grades with an unknown weekday': 1}
+    db.session.remove()
+
+    result = upgrade_schema()
+    assert 'topic_id FOREIGN KEY' in result['constraints']
+    assert_matches_model()
+    assert db.session.execute(select(Grade.weekday_id).order_by(Grade.id).limit(1)).scalar() is None
+    assert len(db.session.execute(select(Grade.id)).all()) == len(make_grades())
+    assert set(index['name'] for index in inspect(db.engine).get_indexes('grades')) >= {
+        index.name for index in Grade.__table__.indexes
+    }
+    # The cleared weekday has left the day-of-week aggregates
+    maintained = aggregate_rows()
+    rebuild_aggregates()
+    db.session.commit()
+    assert maintained == aggregate_rows()
@@ -0,0 +1,76 @@
+from datetime import timedelta
+
+from sqlalchemy import func, select
+
+from conftest import make_grades, upload_grades, wait_for_job, write_grades
+from build_recommendations import build
+from database import bump_data_version
+from ingest import bulk_load_grades
+from models import db, ImportJob, ImportLock, Recommendation, RecommendationBuild
+from recommendations import backfill_recommendations, rebuild_recommendations, recommendations_stale
+
+
+def load_with_recommendations():
+    bulk_load_grades(make_grades())
+    rebuild_recommendations()
+    db.session.commit()
+
+
+def age_build(days):
+    build_row = db.session.get(RecommendationBuild, 1)
+    build_row.built_at -= timedelta(days=days)
+    db.session.commit()
+    return build_row.built_at
+
+
+def job_count():
+    return db.session.execute(select(func.count(ImportJob.id))).scalar()
+
+
+def test_dashboard_reads_never_start_a_rebuild(app, admin_client):
+    load_with_recommendations()
+    age_build(2)
+    bump_data_version()
+    db.session.commit()
+    assert recommendations_stale()
+
+    response = admin_client.get('/api/performance-insights')
+    assert response.status_code == 200
+    assert response.get_json()
+    assert job_count() == 0
+    assert db.session.execute(select(ImportLock.job_id)).scalar() is None
+
+
+def test_imports_rebuild_recommendations(app, admin_client, tmp_path):
+    response = upload_grades(admin_client, write_grades(make_grades(), tmp_path / 'grades.csv'), 'merge')
+    assert wait_for_job(admin_client, response.get_json()['job_id'])['status'] == 'completed'
+
+    db.session.remove()
+    assert not recommendations_stale()
+    assert db.session.execute(select(func.count(Recommendation.id))).scalar() > 0
+
+
+def test_backfill_skips_a_build_of_the_current_data(app):
+    load_with_recommendations()
+    built_at = age_build(2)
+
+    backfill_recommendations()
+    assert db.session.get(RecommendationBuild, 1).built_at == built_at
+
+    bump_data_version()
+    db.session.commit()
+    backfill_recommendations()
+    assert db.session.get(RecommendationBuild, 1).built_at > built_at
+
+
+def test_build_if_stale_rebuilds_only_day_old_recommendations(app):
+    load_with_recommendations()
+
+    assert build(if_stale=True)
+    assert job_count() == 0
+
+    age_build(2)
+    assert build(if_stale=True)
+    db.session.remove()
+    assert db.session.execute(select(ImportJob.job_type, ImportJob.status)).all() == [('recommendations', 'completed')]
+    assert not recommendations_stale()
@@ -0,0 +1,76 @@
+import os
+
+import pandas as pd
+from sqlalchemy import func, select
+
+from conftest import make_grades, upload_grades, wait_for_job, write_grades
+from ingest import parse_files_parallel, parse_grade_file
+from jobs import create_job, run_job
+from models import db, Grade
+
+
+def refresh(client):
+    response = client.post('/admin/refresh-data')
+    assert response.status_code == 202
+    status = wait_for_job(client, response.get_json()['job_id'])
+    assert status['status'] == 'completed', status
+    db.session.remove()
+    return status['result']
+
+
+def grade_count():
+    return db.session.execute(select(func.count(Grade.id))).scalar()
+
+
+def teacher_files(directory):
+    os.makedirs(directory / 'uploads')
+    os.makedirs(directory / 'static')
+    smith = make_grades(students=5, teachers=('Ms Smith',))
+    jones = make_grades(students=4, subjects=('Biology',), teachers=('Mr Jones',))
+    return (write_grades(smith, directory / 'uploads' / 'smith.csv'),
+            write_grades(jones, directory / 'static' / 'jones.csv'), smith, jones)
+
+
+def test_refresh_runs_in_the_background_and_skips_unchanged_files(app, admin_client, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(app.config, 'REFRESH_PARSE_WORKERS', 2)
+    smith_path, jones_path, smith, jones = teacher_files(tmp_path)
+
+    first = refresh(admin_client)
+    assert first['files_changed'] == 2
+    assert first['grades_added'] == len(smith) + len(jones)
+
+    again = refresh(admin_client)
+    assert again['files_changed'] == 0
+    assert again['files_unchanged'] == 2
+    assert again['grades_added'] == 0
+
+    # A removed teacher file takes its grades along; an admin upload's grades stay
+    upload = make_grades(students=3, subjects=('Art',), teachers=('Dr Patel',))
+    response = upload_grades(admin_client, write_grades(upload, tmp_path / 'upload.csv'), 'merge')
+    assert wait_for_job(admin_client, response.get_json()['job_id'])['status'] == 'completed'
+    os.remove(jones_path)
+    removed = refresh(admin_client)
+    assert removed['files_removed'] == 1
+    assert removed['grades_removed'] == len(jones)
+    assert grade_count() == len(smith) + len(upload)
+
+
+def test_refresh_is_refused_while_another_import_holds_the_lock(app, admin_client):
+    job_id = create_job('cli_import', source_name='other.csv').id
+
+    response = admin_client.post('/admin/refresh-data')
+    assert response.status_code == 409
+    assert response.get_json()['job_id'] == job_id
+
+    db.session.remove()
+    run_job(job_id, lambda on_progress=None: {'success': True})
+
+
+def test_parallel_parsing_matches_parsing_one_file_at_a_time(tmp_path):
+    smith_path, jones_path, _, _ = teacher_files(tmp_path)
+    parallel = parse_files_parallel([smith_path, jones_path], max_workers=2)
+    serial = [parse_grade_file(path) for path in (smith_path, jones_path)]
+    for a, b in zip(parallel, serial):
+        assert a['error'] is None and a['rows'] == b['rows'] and a['rows_rejected'] == b['rows_rejected']
+        pd.testing.assert_frame_equal(a['frame'], b['frame'])
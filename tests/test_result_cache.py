@@ -0,0 +1,58 @@
+import sqlite3
+
+from conftest import make_grades, reset_database
+from analytics import score_distribution
+from database import bump_data_version, data_version
+from ingest import bulk_load_grades
+from models import db
+from result_cache import SharedResultCache, result_cache_stats
+
+
+def distribution(client):
+    return client.get('/api/distribution?dimension=overall').get_json()['groups']
+
+
+def load_at_version(df, version):
+    bulk_load_grades(df)
+    while data_version() < version:
+        bump_data_version()
+    db.session.commit()
+    assert data_version() == version
+
+
+def test_recreated_schema_does_not_serve_the_old_data(app, admin_client):
+    load_at_version(make_grades(), 5)
+    old = distribution(admin_client)
+
+    # Versions start over with the schema, so the new data reaches the version the old result was cached at
+    reset_database()
+    load_at_version(make_grades(students=2, score_offset=50), 5)
+    new = distribution(admin_client)
+    assert new != old
+    assert new == score_distribution('overall', None, None, 10)
+
+
+def test_cache_is_used_after_versions_restart_lower(app, admin_client):
+    load_at_version(make_grades(), 8)
+    distribution(admin_client)
+
+    reset_database()
+    load_at_version(make_grades(students=2), 2)
+    distribution(admin_client)
+    hits = result_cache_stats()['hits']
+    distribution(admin_client)
+    assert result_cache_stats()['hits'] == hits + 1
+
+
+def test_cache_file_from_before_epochs_is_discarded(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE results (key TEXT PRIMARY KEY, version INTEGER NOT NULL, payload TEXT, '
+                 'expires_at REAL NOT NULL, used_at REAL NOT NULL)')
+    conn.execute("INSERT INTO results VALUES ('\"k\"', 1, '\"old\"', 1e12, 0)")
+    conn.commit()
+    conn.close()
+
+    cache = SharedResultCache(path, 10, 60)
+    assert cache.get_or_compute('k', 'epoch', 1, lambda: 'new') == 'new'
+    assert cache.get_or_compute('k', 'epoch', 1, lambda: 'recomputed') == 'new'
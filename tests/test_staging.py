@@ -0,0 +1,34 @@
+from sqlalchemy import func, select
+
+from conftest import aggregate_rows, make_grades, upload_grades, wait_for_job, write_grades
+from aggregates import rebuild_aggregates
+from ingest import bulk_load_grades
+from models import db, Grade, ImportLock, Student
+from staging import RETIRED_SUFFIX, STAGING_SUFFIX
+
+
+def table_names():
+    return set(db.session.connection().exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE type = 'table'").scalars())
+
+
+def test_replace_upload_swaps_in_the_staged_data(app, admin_client, tmp_path):
+    bulk_load_grades(make_grades(students=3, subjects=('History',), topics=('Tudors',)))
+    db.session.commit()
+
+    replacement = make_grades()
+    response = upload_grades(admin_client, write_grades(replacement, tmp_path / 'replace.csv'), 'replace')
+    assert response.status_code == 202
+    status = wait_for_job(admin_client, response.get_json()['job_id'])
+    assert status['status'] == 'completed', status
+
+    db.session.remove()
+    assert db.session.execute(select(func.count(Grade.id))).scalar() == len(replacement)
+    assert db.session.execute(select(func.count(Student.id))).scalar() == replacement['Student_ID'].nunique()
+    assert not [name for name in table_names() if name.endswith((STAGING_SUFFIX, RETIRED_SUFFIX))]
+    assert db.session.execute(select(ImportLock.job_id)).scalar() is None
+
+    # The swapped-in aggregates were built alongside the staged grades
+    maintained = aggregate_rows()
+    rebuild_aggregates()
+    assert maintained == aggregate_rows()
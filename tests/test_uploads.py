@@ -0,0 +1,49 @@
+import gzip
+import tracemalloc
+import zlib
+
+from uploads import INFLATE_BLOCK, UploadSink
+
+ROW = b'S001,Student 1,Maths,Algebra,2026-10-05,Monday,Ms Smith,71\n'
+
+
+def gzip_blocks(rows, block_rows=20000):
+    """A gzip CSV of a header and rows data rows, compressed without holding it inflated"""
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    yield compressor.compress(b'Student_ID,Student_Name,Subject,Topic,Test_Date,Day,Teacher_Name,Score\n')
+    for start in range(0, rows, block_rows):
+        yield compressor.compress(ROW * min(block_rows, rows - start))
+    yield compressor.flush()
+
+
+def receive(tmp_path, name, data, piece=64 * 1024):
+    sink = UploadSink(str(tmp_path), name)
+    for start in range(0, len(data), piece):
+        sink.write(data[start:start + piece])
+    sink.claim()
+    return sink
+
+
+def test_counts_rows_of_csv_and_gzip_uploads(tmp_path):
+    data = b'Student_ID,Score\n' + ROW * 1000
+    assert receive(tmp_path, 'grades.csv', data).rows == 1000
+    sink = receive(tmp_path, 'grades.csv.gz', gzip.compress(data))
+    assert sink.rows == 1000
+    with gzip.open(sink.path) as f:
+        assert f.read() == data
+
+
+def test_gzip_upload_is_inflated_a_block_at_a_time(tmp_path):
+    # About 60 MB of CSV from under 200 KB of gzip; inflated in one go a 64 KB part would take tens of MB
+    rows = 1000000
+    compressed = b''.join(gzip_blocks(rows))
+    assert len(compressed) < INFLATE_BLOCK
+
+    tracemalloc.start()
+    try:
+        sink = receive(tmp_path, 'bomb.csv.gz', compressed)
+        assert sink.rows == rows
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 4 * INFLATE_BLOCK
@@ -0,0 +1,69 @@
+import os
+
+import pandas as pd
+
+from conftest import make_grades, reset_database, upload_grades, wait_for_job, write_grades
+from validation import ErrorReport, validate_grades_frame
+
+
+def with_bad_rows(df, rows):
+    df = df.astype({'Score': object})
+    df.loc[rows, 'Score'] = 'absent'
+    return df
+
+
+def report_lines(app, name):
+    return pd.read_csv(os.path.join(app.config['IMPORT_REPORT_DIR'], name))['line'].tolist()
+
+
+def merge(client, df, path):
+    response = upload_grades(client, write_grades(df, path), 'merge')
+    status = wait_for_job(client, response.get_json()['job_id'])
+    assert status['status'] == 'completed', status
+    return status['result']
+
+
+def test_validation_reports_rejected_rows_by_line():
+    df = make_grades(students=1)
+    df.loc[2, 'Score'] = 140
+    df.loc[3, 'Day'] = 'Funday'
+    df.loc[4, 'Test_Date'] = '17/10/2026'
+    valid, errors = validate_grades_frame(df)
+    assert len(valid) == len(df) - 3
+    assert errors['line'].tolist() == [4, 5, 6]
+
+
+def test_new_report_replaces_one_left_at_the_same_name(tmp_path):
+    old = ErrorReport(str(tmp_path), 'import_1_errors.csv')
+    old.add(pd.DataFrame({'line': [2, 3], 'column': 'Score', 'value': 'x', 'error': 'not a number'}), 'old.csv')
+
+    report = ErrorReport(str(tmp_path), 'import_1_errors.csv')
+    assert not os.path.exists(report.path)
+    assert report.summary() is None
+
+
+def test_resumed_report_keeps_only_committed_lines(tmp_path):
+    earlier = ErrorReport(str(tmp_path), 'import_1_errors.csv')
+    earlier.add(pd.DataFrame({'line': range(2, 12), 'column': 'Score', 'value': 'x', 'error': 'not a number'}),
+                'grades.csv')
+
+    # Five rows were committed; lines 7 onwards are validated again on resume
+    report = ErrorReport(str(tmp_path), 'import_1_errors.csv', resume_before=5)
+    assert report.rows == 5
+    assert report.summary() == 'import_1_errors.csv'
+    assert pd.read_csv(report.path)['line'].tolist() == [2, 3, 4, 5, 6]
+
+
+def test_imports_never_point_at_an_earlier_imports_report(app, admin_client, tmp_path):
+    first = merge(admin_client, with_bad_rows(make_grades(), [0, 5]), tmp_path / 'first.csv')
+    assert first['rows_rejected'] == 2
+    assert report_lines(app, first['error_report']) == [2, 7]
+
+    # Checkpoint ids start over with the schema
+    reset_database()
+    clean = merge(admin_client, make_grades(), tmp_path / 'clean.csv')
+    assert clean['error_report'] is None
+
+    reset_database()
+    second = merge(admin_client, with_bad_rows(make_grades(), [3]), tmp_path / 'second.csv')
+    assert report_lines(app, second['error_report']) == [5]
@@ -0,0 +1,124 @@
+# uploads.py - Receive uploaded grade files straight into a scratch file, hashing and counting as they arrive
+import hashlib
+import os
+import tempfile
+import zlib
+
+from flask import Request, current_app, jsonify, request
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from ingest import GRADE_FILE_FORMATS
+
+# Most bytes a gzip upload is inflated to at a time while its lines are counted; the limit on the
+# request applies to the compressed size, and a small part can inflate a thousandfold
+INFLATE_BLOCK = 1 << 20
+
+
+class UploadSink:
+    """Writable target for one multipart file part.
+
+    Werkzeug writes the part here block by block while parsing the request,
+    so the upload lands on disk once, in UPLOAD_SCRATCH_DIR, with its sha256
+    and (for CSV and gzip CSV) data row count computed on the way in. Gzip
+    parts are inflated INFLATE_BLOCK bytes at a time just to count lines
+    and are stored compressed. Unless claim()ed, the file is deleted when the request ends.
+    """
+
+    def __init__(self, directory, filename):
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        name = (filename or '').lower()
+        suffix = next((ext for ext in GRADE_FILE_FORMATS if name.endswith(ext)), '')
+        self.file = tempfile.NamedTemporaryFile(prefix='upload_', suffix=suffix, dir=directory or None, delete=False)
+        self.path = self.file.name
+        self.size = 0
+        self.claimed = False
+        self._digest = hashlib.sha256()
+        self._counts_lines = GRADE_FILE_FORMATS.get(suffix) == 'csv'
+        self._inflate = zlib.decompressobj(16 + zlib.MAX_WBITS) if suffix == '.csv.gz' else None
+        self._lines = 0
+        self._last_byte = b''
+
+    def write(self, data):
+        self.file.write(data)
+        self.size += len(data)
+        self._digest.update(data)
+        if self._counts_lines:
+            if self._inflate:
+                self._count_inflated_lines(data)
+            else:
+                self._count_lines(data)
+        return len(data)
+
+    def _count_inflated_lines(self, data):
+        while True:
+            inflated = self._inflate.decompress(data, INFLATE_BLOCK)
+            self._count_lines(inflated)
+            data = self._inflate.unconsumed_tail
+            # A full block may leave output pending even once the input is used up
+            if not data and len(inflated) < INFLATE_BLOCK:
+                break
+
+    def _count_lines(self, data):
+        if data:
+            self._lines += data.count(b'\n')
+            self._last_byte = data[-1:]
+
+    def __getattr__(self, name):
+        # read/seek/tell/flush and friends go to the underlying file
+        return getattr(self.file, name)
+
+    @property
+    def source_hash(self):
+        """sha256 of the received bytes, the same value ingest.file_fingerprint gives for the file"""
+        return self._digest.hexdigest()
+
+    @property
+    def rows(self):
+        """Data rows counted while receiving, or None for formats counted from their metadata"""
+        if not self._counts_lines:
+            return None
+        if self._inflate:
+            self._count_lines(self._inflate.flush())
+        lines = self._lines + (1 if self._last_byte and self._last_byte != b'\n' else 0)
+        return max(lines - 1, 0)
+
+    def claim(self):
+        """Keep the file past the end of the request and return its path"""
+        self.file.close()
+        self.claimed = True
+        return self.path
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class UploadRequest(Request):
+    """Request whose file parts stream into UploadSinks instead of Werkzeug's default spool"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        sink = UploadSink(current_app.config['UPLOAD_SCRATCH_DIR'], filename)
+        self.upload_sinks = getattr(self, 'upload_sinks', []) + [sink]
+        return sink
+
+
+def _discard_unclaimed_uploads(exc=None):
+    for sink in getattr(request, 'upload_sinks', []):
+        if not sink.claimed:
+            sink.discard()
+
+
+def _upload_too_large(e):
+    limit_mb = (current_app.config['MAX_CONTENT_LENGTH'] or 0) // (1024 * 1024)
+    return jsonify({'error': f'Upload too large; the limit is {limit_mb} MB'}), 413
+
+
+def init_uploads(app):
+    """Route multipart uploads through UploadSink and answer oversize requests with JSON"""
+    app.request_class = UploadRequest
+    app.teardown_request(_discard_unclaimed_uploads)
+    app.register_error_handler(RequestEntityTooLarge, _upload_too_large)
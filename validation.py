@@ -0,0 +1,126 @@
+# validation.py - Vectorized row checks for grade CSVs, run before any rows are written
+import csv
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+REQUIRED_COLUMNS = ['Student_ID', 'Student_Name', 'Subject', 'Topic', 'Test_Date', 'Day', 'Teacher_Name', 'Score']
+SCORE_MIN = 0.0
+SCORE_MAX = 100.0
+TEXT_COLUMNS = ['Student_ID', 'Student_Name', 'Subject', 'Topic', 'Teacher_Name']
+REPORT_COLUMNS = ['file', 'line', 'column', 'value', 'error']
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+WEEKDAY_NUMBERS = {**{day: n for n, day in enumerate(WEEKDAYS)}, **{day[:3]: n for n, day in enumerate(WEEKDAYS)}}
+# CSV line of a data row: frame index 0 is line 2, after the header
+LINE_OFFSET = 2
+
+
+def validate_columns(df):
+    """Raise ValueError if the frame is missing any required CSV column"""
+    if not all(col in df.columns for col in REQUIRED_COLUMNS):
+        raise ValueError(f"CSV missing required columns. Required: {REQUIRED_COLUMNS}")
+
+
+def _factorized(series, func, missing):
+    """func applied once per distinct value and broadcast back to every row; NaN rows get missing"""
+    codes, uniques = pd.factorize(series)
+    values = np.array([func(value) for value in uniques] + [missing])
+    return values[codes]
+
+
+def _blank(series):
+    blank = _factorized(series, lambda value: str(value).strip() == '', True)
+    return pd.Series(blank, index=series.index)
+
+
+def validate_grades_frame(df):
+    """Split a raw grades frame into rows that can be loaded and a row-level error frame.
+
+    Every check is a whole-column operation: required text values present,
+    Test_Date parses as YYYY-MM-DD, Score is numeric and within
+    SCORE_MIN..SCORE_MAX, and Day, when given, names the weekday of
+    Test_Date (full or three-letter, any case). The frame index is taken as
+    the data row position in the file, so errors carry CSV line numbers.
+    Returns (valid, errors): valid holds the passing rows with Test_Date and
+    Score already converted, errors has one row per failed check
+    (REPORT_COLUMNS without file).
+    """
+    validate_columns(df)
+    df = df[REQUIRED_COLUMNS]
+    problems = []
+
+    def flag(mask, column, message):
+        if mask.any():
+            problems.append(pd.DataFrame({
+                'line': df.index[mask] + LINE_OFFSET,
+                'column': column,
+                'value': df.loc[mask, column].astype(str).tolist(),
+                'error': message
+            }))
+        return mask
+
+    bad = pd.Series(False, index=df.index)
+    for column in TEXT_COLUMNS:
+        bad |= flag(_blank(df[column]), column, 'missing value')
+
+    if pd.api.types.is_datetime64_any_dtype(df['Test_Date']):
+        # Typed date columns from Parquet/Arrow need no parsing
+        dates = df['Test_Date']
+    else:
+        dates = pd.to_datetime(df['Test_Date'], format='%Y-%m-%d', errors='coerce')
+    bad |= flag(dates.isna(), 'Test_Date', 'not a YYYY-MM-DD date')
+
+    scores = pd.to_numeric(df['Score'], errors='coerce')
+    bad |= flag(scores.isna(), 'Score', 'not a number')
+    bad |= flag(scores.notna() & ~scores.between(SCORE_MIN, SCORE_MAX), 'Score',
+                f'outside {SCORE_MIN:g}-{SCORE_MAX:g}')
+
+    # -1 for an unrecognised name, so it never equals a real weekday
+    day_numbers = _factorized(df['Day'], lambda value: WEEKDAY_NUMBERS.get(str(value).strip().lower(), -1), -1)
+    day_given = ~_blank(df['Day'])
+    bad |= flag(day_given & dates.notna() & (day_numbers != dates.dt.dayofweek), 'Day', 'does not match Test_Date')
+
+    errors = pd.concat(problems, ignore_index=True) if problems else pd.DataFrame(columns=REPORT_COLUMNS[1:])
+    errors = errors.sort_values('line', kind='stable', ignore_index=True)
+    return df.assign(Test_Date=dates, Score=scores)[~bad], errors
+
+
+class ErrorReport:
+    """Validation errors of one import as a CSV under the report directory, created on first use.
+
+    A report already at the path, left by an earlier import, is replaced.
+    A resumed import passes ``resume_before``, the data rows it committed
+    before: their errors are kept and the rest, which are validated again,
+    are dropped.
+    """
+
+    def __init__(self, directory, name, resume_before=0):
+        self.directory = directory
+        self.name = re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+        self.path = os.path.join(directory, self.name)
+        self.rows = 0
+        if os.path.exists(self.path):
+            kept = pd.read_csv(self.path, dtype=str, keep_default_na=False) if resume_before else None
+            if kept is not None:
+                kept = kept[kept['line'].astype(int) < resume_before + LINE_OFFSET]
+            if kept is not None and len(kept):
+                kept.to_csv(self.path, index=False, quoting=csv.QUOTE_MINIMAL)
+                self.rows = len(kept)
+            else:
+                os.remove(self.path)
+
+    def add(self, errors, source):
+        """Append the errors of one validated frame, tagged with the file they came from"""
+        if len(errors) == 0:
+            return
+        errors = errors.assign(file=os.path.basename(source))
+        os.makedirs(self.directory, exist_ok=True)
+        new_file = not os.path.exists(self.path)
+        errors[REPORT_COLUMNS].to_csv(self.path, mode='a', header=new_file, index=False, quoting=csv.QUOTE_MINIMAL)
+        self.rows += len(errors)
+
+    def summary(self):
+        """Report file name, or None when this import (with the runs it resumed) rejected no rows"""
+        return self.name if self.rows else None